@@ -16,17 +16,21 @@
 #   -t, --tcal: tcalの計算を行わないための引数です。
 #   -c, --chk: 構造を確認します。
 #   --xyz, --XYZ: .xyzファイルを作成します。
+#   --phase {cube,mo}: Phase checkの方法を選択します。(cube: cubeファイル, mo: MO係数)
+#   --shards N: tcalの計算をN個のジョブに分割します。
+#   --local: 分割したtcalをqsubではなくローカルのプロセスで実行します。
+#   --prescan: Lennard-Jonesモデルの事前スキャンで最初のConditionListを作成します。(scipyが必要)
 #
 # 依存関係:
 #   - Python 3.6以上
 #   標準ライブラリ
 #   - argparse
+#   - concurrent.futures
 #   - datetime
 #   - functools
 #   - glob
 #   - math
 #   - os
-#   - random
 #   - subprocess
 #   - sys
 #   - time
@@ -34,7 +38,6 @@
 #   - numpy
 #   ガウシアンの以下のコマンドを利用しています。
 #   - g16
-#   - newzmat
 #   - formchk
 #   - cubegen
 #
@@ -59,10 +62,10 @@ import functools
 import glob
 import math
 import os
-import random
 import subprocess
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 
@@ -123,6 +126,20 @@ def arg_parser():
                         nargs='?',
                         const=True, default=False,
                         help='Create .xyz files')
+    parser.add_argument('--phase',
+                        choices=["cube", "mo"], default="cube",
+                        help="Backend of the phase check.\n"
+                             "\tcube: compare the HOMO/LUMO cube files (cubegen)\n"
+                             "\tmo: compare the MO coefficients in the .fch files")
+    parser.add_argument('--shards',
+                        type=int, default=1,
+                        help="Number of tcal jobs among which the pair xyz files are divided.")
+    parser.add_argument('--local',
+                        help="Run the tcal shards as local processes instead of qsub.",
+                        action="store_true")
+    parser.add_argument('--prescan',
+                        help="Seed the first ConditionList from a Lennard-Jones pre-scan (requires scipy).",
+                        action="store_true")
 
     args = parser.parse_args()
 
@@ -146,6 +163,10 @@ class BrickWork:
         self.Flag_xyz = args.xyz
         self.Debug = args.debug
         self.chk = args.chk
+        self.Phase = args.phase
+        self.Shards = args.shards
+        self.LocalTcal = args.local
+        self.PreScan_Flag = args.prescan
 
         with open(f"{self.MaterName}.xyz", "r") as f:
             self.NinMol = f.readline()
@@ -269,6 +290,8 @@ class BrickWork:
                               f"Initial offset Edge: {self.initial_offset_Edge}",
                               f"Initial offset Faceon: {self.initial_offset_Faceon}"]
         self.debug_message(Debug_message_List)
+        self.setGeometry()
+        self.setEnergyTable()
 
         self.mkCheckFile(before)
 
@@ -398,9 +421,6 @@ class BrickWork:
         os.makedirs(filepath, exist_ok=True)
         Temp_SHs = []
 
-        with open(f"{filepath}/G.sh", "w") as f:
-            f.write(StandardPhrases.Sh_txt)
-        Temp_SHs.append(f"G.sh")
         print(f"Automatically generate files for structural verification...")
         self.mol_pos = "p1"
         Temp_SHs.append(self.mkFiles("0_1800_400", filepath).replace("qsub ", ""))
@@ -503,20 +523,25 @@ class BrickWork:
             self.help_check_exit()
             with open(f"./InitialCondition_3mol{self.mol_pos}.txt", "r") as f:
                 lines = f.readlines()
-            for line in lines:
-                Other = float(line.strip().split()[0])
-                Debug_Message_List = [f"Edge: {First_Edge}, Faceon: {First_Faceon}, Other: {Other}"]
+            Others = [float(line.strip().split()[0]) for line in lines]
+            if self.PreScan_Flag:
+                Centers = self.PreScan(Others, First_Edge, First_Faceon)
+            else:
+                Centers = {Other: (First_Edge, First_Faceon) for Other in Others}
+            for Other in Others:
+                Center_Edge, Center_Faceon = Centers[Other]
+                Debug_Message_List = [f"Edge: {Center_Edge}, Faceon: {Center_Faceon}, Other: {Other}"]
                 self.debug_message(Debug_Message_List)
                 NewConditions.append(
-                    self.mkNewCondition(Other, First_Edge - (2 * dev), "Edge", [First_Edge, First_Faceon]))
+                    self.mkNewCondition(Other, Center_Edge - (2 * dev), "Edge", [Center_Edge, Center_Faceon]))
                 NewConditions.append(
-                    self.mkNewCondition(Other, First_Edge - dev, "Edge", [First_Edge, First_Faceon]))
+                    self.mkNewCondition(Other, Center_Edge - dev, "Edge", [Center_Edge, Center_Faceon]))
                 NewConditions.append(
-                    self.mkNewCondition(Other, First_Edge, "Edge", [First_Edge, First_Faceon]))
+                    self.mkNewCondition(Other, Center_Edge, "Edge", [Center_Edge, Center_Faceon]))
                 NewConditions.append(
-                    self.mkNewCondition(Other, First_Edge + dev, "Edge", [First_Edge, First_Faceon]))
+                    self.mkNewCondition(Other, Center_Edge + dev, "Edge", [Center_Edge, Center_Faceon]))
                 NewConditions.append(
-                    self.mkNewCondition(Other, First_Edge + (2 * dev), "Edge", [First_Edge, First_Faceon]))
+                    self.mkNewCondition(Other, Center_Edge + (2 * dev), "Edge", [Center_Edge, Center_Faceon]))
             NewConditions = sorted(set(NewConditions))
             with open(f"./ConditionList_3mol{self.mol_pos}.txt", "w") as f:
                 for Condition in NewConditions:
@@ -525,6 +550,102 @@ class BrickWork:
         self.help_check_exit()
         return None
 
+    def PreScan(self, Others, First_Edge, First_Faceon):
+        """
+        Predict the most stable (Edge, Faceon) for each Other with a Lennard-Jones (UFF) model.
+
+        The three molecules are rigid, so every intermolecular energy is a function of the
+        translation only. Each (Edge, Faceon) grid is evaluated at once: all the translated
+        copies of a molecule are put in one KD-tree query, and only the atom pairs within
+        Constant.PreScan_Cutoff are summed. The grid around the first condition is refined
+        around its minimum with the steps in Constant.PreScan_Steps.
+
+        :param Others:
+        :param First_Edge: centre of the scanned grid
+        :param First_Faceon: centre of the scanned grid
+        :return: {Other: (Edge, Faceon)}
+        """
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            self.messages.append(f"{Color.RED}Error: --prescan requires scipy.{Color.RESET}\n"
+                                 f"\t>>> Install scipy or run without --prescan.")
+            self.HelpList.append(True)
+            self.help_check_exit()
+        print(f"\n{Color.GREEN}Pre-scanning the initial conditions (Lennard-Jones)...{Color.RESET}")
+        Unknown = sorted(set(self.Elements) - set(Constant.UFF_LJ))
+        if Unknown:
+            print(f"\t>>> {Color.YELLOW}No LJ parameter for {', '.join(Unknown)}: treated as C.{Color.RESET}")
+        Params = np.array([Constant.UFF_LJ.get(Element, Constant.UFF_LJ["C"]) for Element in self.Elements])
+        X = np.sqrt(np.outer(Params[:, 0], Params[:, 0]))
+        D = np.sqrt(np.outer(Params[:, 1], Params[:, 1]))
+
+        Mol1, Mol2, Mol3 = self.getRotatedMolecules()
+        Tree1, Tree2 = cKDTree(Mol1), cKDTree(Mol2)
+        Edge_Unit, Faceon_Unit = self.Unit[self.Edge_Axis], self.Unit[self.Faceon_Axis]
+
+        def Scan(Other, Edges, Faceons):
+            Edge_Grid, Faceon_Grid = np.meshgrid(Edges, Faceons, indexing="ij")
+            # Translation of Mol3 (mkTransition), relative to Mol1 and to Mol2
+            Shift3 = ((Edge_Grid / 2 + Other)[..., None] * Edge_Unit + Faceon_Grid[..., None] * Faceon_Unit
+                      + self.Mol3_Other).reshape(-1, 3)
+            Shift23 = Shift3 - (Edge_Grid[..., None] * Edge_Unit).reshape(-1, 3)
+            # Mol1-Mol2 depends on Edge only
+            E12 = self.PairEnergy(Tree1, Mol2, Edges[:, None] * Edge_Unit, X, D)
+            return E12[:, None] + (self.PairEnergy(Tree1, Mol3, Shift3, X, D)
+                                   + self.PairEnergy(Tree2, Mol3, Shift23, X, D)).reshape(Edge_Grid.shape)
+
+        Centers, Lines = {}, []
+        for Other in Others:
+            # Coarse grid over the whole range, then finer grids around the minimum
+            Edge, Faceon, Range, Note = First_Edge, First_Faceon, Constant.PreScan_Range, ""
+            for Step in Constant.PreScan_Steps:
+                Steps = np.arange(-Range, Range + Step / 2, Step)
+                Edges, Faceons = np.round(Edge + Steps, 2), np.round(Faceon + Steps, 2)
+                Energy = Scan(Other, Edges, Faceons)
+                i, j = np.unravel_index(np.argmin(Energy), Energy.shape)
+                if Range == Constant.PreScan_Range and (i in (0, len(Edges) - 1) or j in (0, len(Faceons) - 1)):
+                    Note = f"  {Color.YELLOW}(on the border of the scanned range){Color.RESET}"
+                Edge, Faceon, Range = float(Edges[i]) + 0.0, float(Faceons[j]) + 0.0, Step
+            Centers[Other] = (Edge, Faceon)
+            print(f"\tOther: {Other:<6} Edge: {Edge:<6} Faceon: {Faceon:<6} "
+                  f"E(LJ): {Energy[i, j]:.3f} kcal/mol{Note}")
+            Lines.append(f"{Other}\t{Edge}\t{Faceon}\t{Energy[i, j]:.6f}\n")
+
+        with open(f"./PreScan_3mol{self.mol_pos}.txt", "w") as f:
+            f.write(f"***** {self.MaterName}_3mol{self.mol_pos} Lennard-Jones pre-scan "
+                    f"(Edge: {First_Edge}±{Constant.PreScan_Range}, Faceon: {First_Faceon}±{Constant.PreScan_Range}, "
+                    f"steps: {Constant.PreScan_Steps}) *****\n"
+                    f"Distance in Other direction (Å)\tDistance in Edge direction (Å)\t"
+                    f"Distance in Faceon direction (Å)\tLJ energy (kcal/mol)\n")
+            f.writelines(Lines)
+        self.messages.append(f"\t>>> PreScan_3mol{self.mol_pos}.txt: {Color.GREEN}Created.{Color.RESET}")
+        return Centers
+
+    @staticmethod
+    def PairEnergy(Tree, Mol, Shifts, X, D):
+        """
+        Lennard-Jones energy between the molecule in Tree and Mol translated by each of Shifts
+        :param Tree: cKDTree of the fixed molecule
+        :param Mol: positions of the moved molecule (NAtoms, 3)
+        :param Shifts: translations (M, 3)
+        :param X: UFF distances x_ij (NAtoms, NAtoms)
+        :param D: UFF well depths D_ij (NAtoms, NAtoms)
+        :return: energies (M,) in kcal/mol
+        """
+        from scipy.spatial import cKDTree
+        NAtoms = len(Mol)
+        Energy = np.zeros(len(Shifts))
+        Chunk = max(1, Constant.PreScan_ChunkAtoms // NAtoms)
+        for start in range(0, len(Shifts), Chunk):
+            Points = (Shifts[start:start + Chunk, None, :] + Mol[None, :, :]).reshape(-1, 3)
+            Pairs = Tree.sparse_distance_matrix(cKDTree(Points), Constant.PreScan_Cutoff, output_type="ndarray")
+            i, j = Pairs["i"], Pairs["j"] % NAtoms
+            Ratio6 = (X[i, j] / np.maximum(Pairs["v"], 0.5)) ** 6
+            Energy[start:start + Chunk] = np.bincount(Pairs["j"] // NAtoms, weights=D[i, j] * (Ratio6 ** 2 - 2 * Ratio6),
+                                                      minlength=len(Points) // NAtoms)
+        return Energy
+
     @staticmethod
     def transform_number(number):
         if number % 1 >= 0.5:
@@ -655,8 +776,6 @@ class BrickWork:
         while not judge:
             qsubList = []
             Conditions = self.getConditions(f"./ConditionList_3mol{self.mol_pos}.txt")
-            with open(f"{self.dirpath}/G.sh", "w") as f:
-                f.write(StandardPhrases.Sh_txt)
 
             for Condition in Conditions:
                 if os.path.exists(f"{self.dirpath}/{self.MaterName}_3mol{self.mol_pos}_{Condition}.log"):
@@ -690,38 +809,9 @@ class BrickWork:
         SH_FileName = f"G-{self.Operator}_{Condition}.sh"
 
         Condition = Condition.strip().split("_")
-        Matrix_Mol3 = {
-                          "x": [int(Condition[0]) / 100, 0, 0],
-                          "y": [0, int(Condition[0]) / 100, 0],
-                          "z": [0, 0, int(Condition[0]) / 100]
-                      }[self.Edge_Axis] + self.Mol3_Other
-        Transitions = self.mkTransition(self.Edge_Axis, self.Faceon_Axis, Condition[1], Condition[2], Matrix_Mol3)
-
-        Angles = {
-            "p1": {
-                "x": [[0, 0, 0], [0, 0, 0], [0, 0, 0]],
-                "y": [[0, 0, 0], [0, 0, 0], [0, 0, 0]],
-                "z": [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
-            },
-            "p2": {
-                "x": [[180, 0, 0], [180, 0, 0], [180, 0, 0]],
-                "y": [[0, 180, 0], [0, 180, 0], [0, 180, 0]],
-                "z": [[0, 0, 180], [0, 0, 180], [0, 0, 180]]
-            },
-            "p3": {
-                "x": [[180, 0, 0], [180, 0, 0], [180, 0, 0]],
-                "y": [[0, 180, 0], [0, 180, 0], [0, 180, 0]],
-                "z": [[0, 0, 180], [0, 0, 180], [0, 0, 180]]
-            }
-        }.get(self.mol_pos).get(self.Other_Axis)
+        Element, Mol1_pos, Mol2_pos, Mol3_pos = self.mkAtomList(self.mkTransition(Condition))
 
-        Element, Mol1_pos, Mol2_pos, Mol3_pos = self.mkAtomList(Angles[0], Angles[1], Angles[2], Transitions)
-
-        with open(f"Temp_Header_3mol.txt", "w") as temp_header:
-            temp_header.write(StandardPhrases.Header_3mol)
-        with open(f"Temp_Header_3mol.txt", "r") as temp_header:
-            Headers = temp_header.readlines()
-        os.remove(f"Temp_Header_3mol.txt")
+        Headers = StandardPhrases.Header_3mol.splitlines(keepends=True)
         Headers[3] = f"%chk={CHK_FileName}\n"
 
         self.write_gjf_file(f"{dirpath}/{FileName}.gjf",
@@ -731,14 +821,57 @@ class BrickWork:
                                 Element, Mol1_pos, Mol2_pos, Mol3_pos)
             self.messages.append(f"\t>>> {FileName}.xyz: Created.")
 
-        with open(f"{dirpath}/G.sh", "r") as f:
-            lines = f.readlines()
+        lines = StandardPhrases.Sh_txt.splitlines(keepends=True)
         lines[12] = f"g16 {GJF_FileName}\n"
         with open(f"{dirpath}/{SH_FileName}", "w") as f:
             f.writelines(lines)
         qsub_temp = f"qsub {SH_FileName}"
         return qsub_temp
 
+    def setGeometry(self):
+        """
+        Read the monomer geometry once; the rotated molecules are cached per structure (mol_pos)
+        :return:
+        """
+        self.Elements, Positions = [], []
+        for Atom in self.AtomList:
+            Contents = Atom.split()
+            if len(Contents) < 4:
+                continue
+            self.Elements.append(Contents[0])
+            Positions.append(list(map(float, Contents[1:4])))
+        self.Positions = np.array(Positions).reshape(-1, 3)
+        self.Unit = {"x": np.array([1.0, 0.0, 0.0]), "y": np.array([0.0, 1.0, 0.0]), "z": np.array([0.0, 0.0, 1.0])}
+        self.RotatedMolecules = {}
+        return None
+
+    def getRotatedMolecules(self):
+        """
+        Rotated coordinates of Mol1~Mol3 for the current structure, shape (3, NAtoms, 3)
+        :return:
+        """
+        if self.mol_pos not in self.RotatedMolecules:
+            Angles = {
+                "p1": {
+                    "x": [[0, 0, 0], [0, 0, 0], [0, 0, 0]],
+                    "y": [[0, 0, 0], [0, 0, 0], [0, 0, 0]],
+                    "z": [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+                },
+                "p2": {
+                    "x": [[180, 0, 0], [180, 0, 0], [180, 0, 0]],
+                    "y": [[0, 180, 0], [0, 180, 0], [0, 180, 0]],
+                    "z": [[0, 0, 180], [0, 0, 180], [0, 0, 180]]
+                },
+                "p3": {
+                    "x": [[180, 0, 0], [180, 0, 0], [180, 0, 0]],
+                    "y": [[0, 180, 0], [0, 180, 0], [0, 180, 0]],
+                    "z": [[0, 0, 180], [0, 0, 180], [0, 0, 180]]
+                }
+            }.get(self.mol_pos).get(self.Other_Axis)
+            self.RotatedMolecules[self.mol_pos] = np.stack(
+                [self.Rotate(self.Positions, Tx, Ty, Tz) for Tx, Ty, Tz in Angles])
+        return self.RotatedMolecules[self.mol_pos]
+
     def mkDirection(self, axis_direction, input_axis, axis_name):
         """
         Make the direction
@@ -760,34 +893,26 @@ class BrickWork:
         self.help_check_exit()
         return np.array(directions[input_axis])
 
-    def mkTransition(self, Axis_Edge, Axis_Faceon, Direction_Edge, Direction_Faceon, Matrix_Mol3):
-        Edge_transl = self.mkDirection(Direction_Edge, Axis_Edge, "Edge Direction")
-        Faceon_transl = self.mkDirection(Direction_Faceon, Axis_Faceon, "Faceon Direction")
-
-        return [Edge_transl, Faceon_transl, Matrix_Mol3]
+    def mkTransition(self, Condition):
+        """
+        Translations of Mol1~Mol3 for a condition ["Mol3 Edge", "Edge", "Faceon"] (in 0.01 Å)
+        :param Condition:
+        :return: array of shape (3, 3)
+        """
+        Mol3_Edge, Edge, Faceon = (float(Value) / 100 for Value in Condition)
+        Edge_transl = Edge * self.Unit[self.Edge_Axis]
+        Faceon_transl = Faceon * self.Unit[self.Faceon_Axis]
+        Matrix_Mol3 = Mol3_Edge * self.Unit[self.Edge_Axis] + self.Mol3_Other
+        return np.array([np.zeros(3), Edge_transl, Edge_transl / 2 + Faceon_transl + Matrix_Mol3])
 
-    def mkAtomList(self, Mol1_Angles, Mol2_Angles, Mol3_Angles, Transitions):
+    def mkAtomList(self, Transitions):
         """
         Make the Atom List
-        :param Mol1_Angles:
-        :param Mol2_Angles:
-        :param Mol3_Angles:
-        :param Transitions:
+        :param Transitions: translations of Mol1~Mol3 (mkTransition)
         :return:
         """
-        Mol1, Mol2, Mol3, Elist = [], [], [], []
-        for Atom in self.AtomList:
-            Contents = Atom.split()
-            Elist.append(Contents.pop(0))
-            Position = np.array(list(map(float, Contents)))
-            atm_m1 = self.Rotate(Position, Mol1_Angles[0], Mol1_Angles[1], Mol1_Angles[2])
-            Mol1.append(atm_m1)
-            atm_m2 = self.Rotate(Position, Mol1_Angles[0], Mol2_Angles[1], Mol2_Angles[2]) + (Transitions[0] / 100)
-            Mol2.append(atm_m2)
-            atm_m3 = (self.Rotate(Position, Mol3_Angles[0], Mol3_Angles[1], Mol3_Angles[2]) + Transitions[0] / 200
-                      + Transitions[1] / 100 + Transitions[2])
-            Mol3.append(atm_m3)
-        return Elist, Mol1, Mol2, Mol3
+        Mol1, Mol2, Mol3 = self.getRotatedMolecules() + Transitions[:, np.newaxis, :]
+        return self.Elements, Mol1, Mol2, Mol3
 
     def Rotate(self, Current, Tx, Ty, Tz):
         Tx, Ty, Tz = map(math.radians, [Tx, Ty, Tz])
@@ -798,20 +923,17 @@ class BrickWork:
         R = np.eye(3)
         for axis in self.rotate:
             R = np.dot(rotation_matrices[axis], R)
-        return np.dot(R, Current)
+        # Current: one position (3,) or all the positions (NAtoms, 3)
+        return np.dot(Current, R.T)
 
     def write_gjf_file(self, filename, headers, elements, positions1, positions2=None, positions3=None):
         with open(filename, "w") as file:
-            for header in headers:
-                file.write(header)
-            for elem, pos in zip(elements, positions1):
-                file.write(f" {elem:<2}  {self.format_coordinate(pos)}  1\n")
+            file.writelines(headers)
+            file.write(self.format_block(elements, positions1, "  1"))
             if positions2 is not None:
-                for elem, pos in zip(elements, positions2):
-                    file.write(f" {elem:<2}  {self.format_coordinate(pos)}  2\n")
+                file.write(self.format_block(elements, positions2, "  2"))
             if positions3 is not None:
-                for elem, pos in zip(elements, positions3):
-                    file.write(f" {elem:<2}  {self.format_coordinate(pos)}  3\n")
+                file.write(self.format_block(elements, positions3, "  3"))
             file.write("\n")
         return
 
@@ -822,17 +944,26 @@ class BrickWork:
             else:
                 file.write(f"{len(elements) * 3}\n")
             file.write("00000001\n")
-            for elem, pos in zip(elements, positions1):
-                file.write(f" {elem:<2}  {self.format_coordinate(pos)}\n")
+            file.write(self.format_block(elements, positions1))
             if positions2 is not None:
-                for elem, pos in zip(elements, positions2):
-                    file.write(f" {elem:<2}  {self.format_coordinate(pos)}\n")
+                file.write(self.format_block(elements, positions2))
             if positions3 is not None:
-                for elem, pos in zip(elements, positions3):
-                    file.write(f" {elem:<2}  {self.format_coordinate(pos)}\n")
+                file.write(self.format_block(elements, positions3))
             file.write("\n")
         return
 
+    @staticmethod
+    def format_block(elements, positions, suffix=""):
+        """
+        Format the atom lines of one molecule (same format as format_coordinate)
+        :param elements:
+        :param positions: array of shape (NAtoms, 3)
+        :param suffix: e.g. fragment number "  1"
+        :return:
+        """
+        return "".join(f" {elem:<2}  {x:15.10f} {y:15.10f} {z:15.10f}{suffix}\n"
+                       for elem, (x, y, z) in zip(elements, np.asarray(positions, dtype=float).tolist()))
+
     @staticmethod
     def format_coordinate(coord):
         """
@@ -1004,71 +1135,92 @@ class BrickWork:
             subprocess.run(["rm", line], timeout=10)
         return
 
+    def setEnergyTable(self):
+        """
+        Energy table filled incrementally by readEnergy
+        :return:
+        """
+        self.EnergyTable = {}  # Other -> {FileName: "Other\tEdge\tFaceon\tCPE\tBSE\n"}
+        self.MinEnergy = {}  # Other -> (CPE, FileName) of the minimum
+        self.ReadLogs = set()  # logs already in the table
+        self.ErrorLogs = None  # lines of _Error.log (read at the first failure)
+        return None
+
     def readEnergy(self):
-        OtherList = []
+        """
+        Add the logs finished since the last cycle to the energy table,
+        then rewrite _all.txt and _min.txt
+        :return:
+        """
         LogList = glob.glob(f"{self.dirpath}/{self.MaterName}_3mol{self.mol_pos}_*.log")
-        LogList.sort()
-        for LogName in LogList:
-            FileName, Edge, Faceon, Other = self.getVAL_fromLogName(LogName)
-            OtherList.append(Other)
-        OtherList = sorted(set(OtherList))
+        for LogName in sorted(set(LogList) - self.ReadLogs):
+            FileName, VEdge, VFaceon, VOther = self.getVAL_fromLogName(LogName)
+            with open(LogName, "r") as f:
+                data = f.read()
+            if "Normal termination" in data:
+                CPE, BSE = self.getEnergy(data)
+                self.EnergyTable.setdefault(VOther, {})[FileName] = f"{VOther}\t{VEdge}\t{VFaceon}\t{CPE}\t{BSE}\n"
+                # The first log (in name order) is kept for equal energies
+                if VOther not in self.MinEnergy or (CPE, FileName) < self.MinEnergy[VOther]:
+                    self.MinEnergy[VOther] = (CPE, FileName)
+                self.ReadLogs.add(LogName)
+            else:
+                self.ErrorLog(LogName)
+
+        header = ("Distance in Other direction (Å)\tDistance in Edge direction (Å)\t"
+                  "Distance in Faceon direction (Å)\tCounterpoise corrected energy (A.U)"
+                  "\tBSSE energy (A.U)")
+        AllData = [f"*****  {self.MaterName}_3mol{self.mol_pos} All Results *****\n", f" \t{header}\n"]
+        MinData = [f"***** {self.MaterName}_3mol{self.mol_pos} Minimum Energy at each Angle *****\n", f"{header}\n"]
+        print(f"\t{header}")
+        for Other in sorted(self.EnergyTable):
+            VAL_Dict = self.EnergyTable[Other]
+            minkey = self.MinEnergy[Other][1]
+            AllData.append("******\t******\t******\t******\t******\t******\n")
+            MinData.append(VAL_Dict[minkey])
+            for Key in sorted(VAL_Dict):
+                sentence = f"{'*' if Key == minkey else '-'}\t{VAL_Dict[Key]}"
+                AllData.append(sentence)
+                print(sentence.strip())
+        self.write_atomic(f"{self.MaterName}_3mol{self.mol_pos}_all.txt", AllData)
+        self.write_atomic(f"{self.MaterName}_3mol{self.mol_pos}_min.txt", MinData)
+        return None
 
-        with open(f"{self.MaterName}_3mol{self.mol_pos}_all.txt", "w") as AllData:
-            with open(f"{self.MaterName}_3mol{self.mol_pos}_min.txt", "w") as MinData:
-                header = ("Distance in Other direction (Å)\tDistance in Edge direction (Å)\t"
-                          "Distance in Faceon direction (Å)\tCounterpoise corrected energy (A.U)"
-                          "\tBSSE energy (A.U)")
-                AllData.write(f"*****  {self.MaterName}_3mol{self.mol_pos} All Results *****\n")
-                MinData.write(
-                    f"***** {self.MaterName}_3mol{self.mol_pos} Minimum Energy at each Angle *****\n")
-                AllData.write(f" \t{header}\n")
-                MinData.write(f"{header}\n")
-                MinimumL = []
-
-                print(f"\t{header}")
-
-                for Other in OtherList:
-                    CPE_Dict = {}
-                    VAL_Dict = {}
-                    Keys = []
-                    AllData.write("******\t******\t******\t******\t******\t******\n")
-                    for LogName in LogList:
-                        FileName, VEdge, VFaceon, VOther = self.getVAL_fromLogName(LogName)
-                        if Other == VOther:
-                            with open(LogName, "r") as f:
-                                data = f.read()
-                            if "Normal termination" in data:
-                                CPE, BSE = self.getEnergy(data)
-                                CPE_Dict[FileName] = CPE
-                                VAL_Dict[FileName] = f"{VOther}\t{VEdge}\t{VFaceon}\t{CPE}\t{BSE}\n"
-                                Keys.append(FileName)
-                            else:
-                                print(f"{Color.RED}Error: {LogName} did not finish normally.{Color.RESET}")
-                                with open(f"./{self.MaterName}_3mol{self.mol_pos}_Error.log", "a") as f:
-                                    f.write(f"{LogName}\n")
-                                with open(f"./{self.MaterName}_3mol{self.mol_pos}_Error.log", "r") as f:
-                                    error_lines = f.readlines()
-                                if len(error_lines) != len(set(error_lines)):
-                                    print(f"{Color.RED}Error: {LogName} is duplicated.{Color.RESET}")
-                                    self.messages.append(f"{Color.RED}Error: {LogName} is duplicated.{Color.RESET}")
-                                    self.HelpList.append(True)
-                                self.help_check_exit()
-                                self.rmWildCards(f"{LogName}")
-
-                    minkey = min(CPE_Dict, key=CPE_Dict.get)
-                    MinimumL.append(minkey)
-                    MinData.write(f"{VAL_Dict[minkey]}")
-                    Keys.sort()
-                    for Key in Keys:
-                        if Key == minkey:
-                            sentence = f"*\t{VAL_Dict.get(Key)}"
-                            AllData.write(sentence)
-                            print(sentence.strip())
-
-                        else:
-                            sentence = f"-\t{VAL_Dict.get(Key)}"
-                            AllData.write(sentence)
-                            print(sentence.strip())
+    def ErrorLog(self, LogName):
+        """
+        Record a log that did not finish normally and delete it
+        :param LogName:
+        :return:
+        """
+        ErrorFile = f"./{self.MaterName}_3mol{self.mol_pos}_Error.log"
+        print(f"{Color.RED}Error: {LogName} did not finish normally.{Color.RESET}")
+        if self.ErrorLogs is None:
+            self.ErrorLogs = set()
+            if os.path.exists(ErrorFile):
+                with open(ErrorFile, "r") as f:
+                    self.ErrorLogs = set(f.read().splitlines())
+        with open(ErrorFile, "a") as f:
+            f.write(f"{LogName}\n")
+        if LogName in self.ErrorLogs:
+            print(f"{Color.RED}Error: {LogName} is duplicated.{Color.RESET}")
+            self.messages.append(f"{Color.RED}Error: {LogName} is duplicated.{Color.RESET}")
+            self.HelpList.append(True)
+        self.ErrorLogs.add(LogName)
+        self.help_check_exit()
+        self.rmWildCards(f"{LogName}")
+        return None
+
+    @staticmethod
+    def write_atomic(FileName, Lines):
+        """
+        Write the file through a temporary file so that it is never read half-written
+        :param FileName:
+        :param Lines:
+        :return:
+        """
+        with open(f"{FileName}.tmp", "w") as f:
+            f.writelines(Lines)
+        os.replace(f"{FileName}.tmp", FileName)
         return None
 
     @staticmethod
@@ -1326,36 +1478,39 @@ class BrickWork:
         if self.calculation_tcal_flag:
             os.makedirs(self.tcalpath, exist_ok=True)
             qsubList = []
-            print(f"\n"
-                  f"Copying the com files for minimum energies...")
-            for Condition in MinConditions:
-                command = ["rename", "gjf", "com",
-                           f"{self.dirpath}/{self.MaterName}_3mol{self.mol_pos}_{Condition}.gjf"]
-                self.execute(command, False)
-                command = ["cp", f"{self.dirpath}/{self.MaterName}_3mol{self.mol_pos}_{Condition}.com",
-                           f"{self.tcalpath}/{self.MaterName}_3mol{self.mol_pos}_{Condition}.com"]
-                self.execute(command, False)
-                command = ["rename", "com", "gjf",
-                           f"{self.dirpath}/{self.MaterName}_3mol{self.mol_pos}_{Condition}.com"]
-                self.execute(command, False)
-            print(f"\t>>> {Color.GREEN}Complete!!{Color.RESET}")
-            self.mkXYZFiles()
+            self.mkXYZFiles([f"{self.MaterName}_3mol{self.mol_pos}_{Condition}" for Condition in MinConditions])
             print(f"\n**********\n"
                   f"{Color.GREEN}Calculating transfer integrals...\n{Color.RESET}")
             if not os.path.exists(f"{self.tcalpath}/{self.MaterName}_3mol{self.mol_pos}_tcal.log"):
                 XYZs = glob.glob(f"{self.tcalpath}/*.xyz")
+                StalePairs = self.PairXYZs(self.tcalpath)
                 for XYZ in XYZs:
-                    if "_m1.xyz" in XYZ or "_m2.xyz" in XYZ or "-12.xyz" in XYZ or "-23.xyz" in XYZ or "-31.xyz" in XYZ:
+                    if ("_m1.xyz" in XYZ or "_m2.xyz" in XYZ or "-12.xyz" in XYZ or "-23.xyz" in XYZ
+                            or "-31.xyz" in XYZ or XYZ in StalePairs):
                         XYZ = XYZ.replace("./", "")
                         os.remove(f"{XYZ}")
                     else:
                         pass
                 self.XYZ_3mol_to_XYZ_2mol()
-                with open(f"{self.tcalpath}/tcal.sh", "w") as f:
-                    f.write(StandardPhrases.tcal_sh_txt)
-                qsubList.append("qsub tcal.sh")
+                if self.Shards <= 1 and not self.LocalTcal:
+                    with open(f"{self.tcalpath}/tcal.sh", "w") as f:
+                        f.write(StandardPhrases.tcal_sh_txt)
+                    qsubList.append("qsub tcal.sh")
+
+                    self.job_submission(qsubList, "tcal", self.tcalpath)
+                else:
+                    ShardDirs = self.ShardTcal()
+                    if self.LocalTcal:
+                        self.runTcalLocal(ShardDirs)
+                    else:
+                        for ShardDir in ShardDirs:
+                            with open(f"{self.tcalpath}/{ShardDir}.sh", "w") as f:
+                                f.write(StandardPhrases.tcal_sh_txt.replace("tcal *.xyz\n",
+                                                                            f"cd {ShardDir}\ntcal *.xyz\n"))
+                            qsubList.append(f"qsub {ShardDir}.sh")
 
-                self.job_submission(qsubList, "tcal", self.tcalpath)
+                        self.job_submission(qsubList, "tcal", self.tcalpath)
+                    self.MergeTcal(ShardDirs)
 
                 if self.Debug:
                     pass
@@ -1377,7 +1532,8 @@ class BrickWork:
                     print(f"{Color.RED}Failed!!{Color.RESET}")
                     print(f"\t\tError Message: {result.stderr.strip()}")
 
-                self.readlog()
+                if self.readlog():
+                    self.message_show()
             else:
                 print(f"\t>>> tcal.log: {Color.GREEN}Already exists!!{Color.RESET}")
                 print(f"\t>>> {Color.GREEN}Calculation of transfer integrals was skipped.{Color.RESET}")
@@ -1405,152 +1561,315 @@ class BrickWork:
             print(res.stderr.strip())
         return
 
-    def mkXYZFiles(self):
-        F_paths = glob.glob(f"{self.tcalpath}/*.com")
+    def mkXYZFiles(self, Names):
+        """
+        Make the XYZ files for tcal from the .gjf files of the calculation folder (not changed)
+        :param Names: file names without the extension
+        :return:
+        """
         print(f"\n"
               f"**********\n"
-              f"Making XYZ files...")
+              f"Making XYZ files for minimum energies...")
+        F_paths = [f"{self.dirpath}/{Name}.gjf" for Name in Names]
         if not F_paths:
-            print(f"\t>>> There is NO .com file in the {self.tcalpath} folder.")
+            print(f"\t>>> There is NO .gjf file for the minimum energies in the {self.dirpath} folder.")
             return
+        # 1つでも欠けていればtcalを欠けたままの組で実行しない
+        Lacks = [F_path for F_path in F_paths if not os.path.exists(F_path)]
+        if Lacks:
+            for F_path in Lacks:
+                self.messages.append(f"\t>>> {Color.RED}{F_path}: Does not Exist.{Color.RESET}")
+            self.messages.append(f"\t>>> XYZ files for the minimum energies were NOT made.")
+            self.HelpList.append(True)
+            self.help_check_exit()
 
         for F_path in F_paths:
-            self.process_file(F_path)
-
-        ComFileNames = glob.glob(f"{self.tcalpath}/*.com")
-        XYZFileNameList = []
-        for ComFileName in ComFileNames:
-            FormatedComfn = (ComFileName[:-4]).strip().split("/")[-1]
-            XYZFileName = f"{FormatedComfn}.xyz"
-            print(f"\t{FormatedComfn}.com -> {XYZFileName}")
-            XYZFileNameList.append(XYZFileName)
-            subprocess.run(["newzmat", "-icart", "-oxyz", FormatedComfn, XYZFileName],
-                           timeout=2, cwd=self.tcalpath)
-        Ls = []
-        for XYZFileName in XYZFileNameList:
-            with open(f"{self.tcalpath}/{XYZFileName}", "r") as xyzf:
-                lines = xyzf.readlines()
-            Ls.append(len(lines))
-            with open(f"{self.tcalpath}/{XYZFileName}", "w") as xyzf:
-                xyzf.write(f"{len(lines)}\n")
+            XYZFileName = f"{self.tcalpath}/{os.path.basename(F_path)[:-4]}.xyz"
+            print(f"\t{F_path.split('/')[-1]} -> {XYZFileName.split('/')[-1]}")
+            Elements, Coordinates = self.ReadGjf(F_path)
+            with open(XYZFileName, "w") as xyzf:
+                xyzf.write(f"{len(Elements)}\n")
                 xyzf.write("00000001\n")
-                for line in lines:
-                    xyzf.write(line)
-        print(f"\t>>> {self.tcalpath}/*.xyz: {Color.GREEN}Created!!{Color.RESET} ({len(Ls)} files)")
+                xyzf.writelines(f" {elem:<2}  {self.format_coordinate(pos)}\n"
+                                for elem, pos in zip(Elements, Coordinates))
+        print(f"\t>>> {self.tcalpath}/*.xyz: {Color.GREEN}Created!!{Color.RESET} ({len(F_paths)} files)")
         return
 
     @staticmethod
-    def process_file(F_path):
+    def ReadGjf(F_path):
         """
-        Process the file
+        Read the atoms of the Gaussian input file (.com/.gjf)
         :param F_path:
-        :return:
+        :return: elements, coordinates (N x 3 array)
         """
         with open(F_path, "r") as f:
-            lines = f.readlines()
-        new_lines = [
-            line.replace("X", "C") if line.strip().split() and line.strip().split()[0] == "X"
-            else line
-            for line in lines
-        ]
-        with open(F_path[:-4] + ".com", "w") as file:
-            file.writelines(new_lines)
+            lines = f.read().splitlines()
+
+        # Link0 (%), route section, title, charge and multiplicity, atoms の順
+        i = 0
+        while not lines[i].strip() or lines[i].lstrip().startswith("%"):
+            i += 1
+        Blanks = 0
+        while Blanks < 2:  # the route section and the title end with a blank line
+            if not lines[i].strip():
+                Blanks += 1
+            i += 1
+        i += 1  # charge and multiplicity
+
+        Atoms = []
+        for line in lines[i:]:
+            if not line.strip():
+                break
+            Atoms.append(line.split())
+
+        # "C(Fragment=1)" などのタグを除き, ダミー原子 X は C として扱う
+        Elements = [Atom[0].split("(")[0] for Atom in Atoms]
+        Elements = ["C" if elem == "X" else elem for elem in Elements]
+        # 末尾のフラグメント番号は読まない
+        Coordinates = np.array([Atom[1:4] for Atom in Atoms], dtype=float)
+        return Elements, Coordinates
+
+    def ShardTcal(self):
+        """
+        Distribute the xyz files into the shard folders (tcal_01, tcal_02, ...) in alphabetical order
+        :return: shard folders
+        """
+        XYZs = sorted(os.path.basename(XYZ) for XYZ in glob.glob(f"{self.tcalpath}/*.xyz"))
+        Shards = max(1, min(self.Shards, len(XYZs)))
+        ShardDirs = []
+        for i, Files in enumerate(np.array_split(XYZs, Shards), start=1):
+            ShardDir = f"tcal_{i:02d}"
+            os.makedirs(f"{self.tcalpath}/{ShardDir}", exist_ok=True)
+            for File in Files:
+                os.replace(f"{self.tcalpath}/{File}", f"{self.tcalpath}/{ShardDir}/{File}")
+            ShardDirs.append(ShardDir)
+        print(f"\t>>> {len(XYZs)} xyz files are divided into {len(ShardDirs)} shards.")
+        return ShardDirs
+
+    def runTcalLocal(self, ShardDirs):
+        """
+        Run tcal for every shard at the same time on this machine
+        :param ShardDirs:
+        :return:
+        """
+        print(f"\t>>> tcal is running in {len(ShardDirs)} local processes...")
+        Procs = []
+        for ShardDir in ShardDirs:
+            with open(f"{self.tcalpath}/{ShardDir}.sh.o", "w") as out:
+                Procs.append(subprocess.Popen("tcal *.xyz", shell=True, cwd=f"{self.tcalpath}/{ShardDir}",
+                                              stdout=out, stderr=subprocess.STDOUT))
+        for Proc in Procs:
+            Proc.wait()
+        return
+
+    def MergeTcal(self, ShardDirs):
+        """
+        Merge the logs of the shards into tcal.log in order and move the results back to tcalpath
+        :param ShardDirs:
+        :return:
+        """
+        # tcal.logが1つでも欠けていれば結合しない (結合したtcal.logがあると再計算されないため)
+        Lacks = [ShardDir for ShardDir in ShardDirs if not os.path.exists(f"{self.tcalpath}/{ShardDir}/tcal.log")]
+        if Lacks:
+            for ShardDir in Lacks:
+                self.messages.append(f"\t>>> {Color.RED}Error: {self.tcalpath}/{ShardDir}/tcal.log "
+                                     f"was NOT found.{Color.RESET}")
+            self.messages.append(f"\t>>> tcal.log was NOT written. The shard folders were kept as they are.")
+            self.HelpList.append(True)
+            self.help_check_exit()
+
+        with open(f"{self.tcalpath}/tcal.log", "w") as Log:
+            for ShardDir in ShardDirs:
+                ShardLog = f"{self.tcalpath}/{ShardDir}/tcal.log"
+                with open(ShardLog, "r") as f:
+                    Log.writelines(f)
+                os.remove(ShardLog)
+                for File in os.listdir(f"{self.tcalpath}/{ShardDir}"):
+                    os.replace(f"{self.tcalpath}/{ShardDir}/{File}", f"{self.tcalpath}/{File}")
+                os.rmdir(f"{self.tcalpath}/{ShardDir}")
+        print(f"\t>>> Logs of {len(ShardDirs)} shards -> tcal.log: {Color.GREEN}Merged!!{Color.RESET}")
         return
 
     def XYZ_3mol_to_XYZ_2mol(self):
-        filepaths = glob.glob(f"{self.tcalpath}/*_3mol*.xyz")
+        filepaths = sorted(glob.glob(f"{self.tcalpath}/*_3mol*.xyz"))
 
-        Faults = []
+        Faults, PairNames = [], []
         print("\nConverting 3mol to 2mol XYZ files...")
         for filepath in filepaths:
-            Mol1, Mol2, Mol3 = [], [], []
-            file_core = filepath[:-4]
-            with open(filepath, "r") as f:
-                # Read the first line (the number of atoms)
-                number_atoms = f.readline()
-                Comment = f.readline()
-                coordinates = f.readlines()
             self.messages.append("\t" + filepath.strip())
 
-            if int(float(number_atoms)) % 3 != 0:
+            # クラスターの分子数は1分子の原子数 (NinMol) から求める
+            PairFiles = self.XYZ_to_Pairs(filepath, int(self.NinMol), Constant.TcalPairs, Constant.Pair_Cutoff)
+            if PairFiles is None:
                 Faults.append(filepath)
-                self.messages.append(f"\t>>> {Color.RED}Error: {filepath} did not divide by 3.{Color.RESET}")
             else:
-                Atoms_inMol = int(round(float(number_atoms) / 3, 5))
-                for i in range(Atoms_inMol):
-                    Mol1.append(coordinates[i])
-                    Mol2.append(coordinates[i + Atoms_inMol])
-                    Mol3.append(coordinates[i + 2 * Atoms_inMol])
-                Atoms_in_TcalXYZFile = int(round(Atoms_inMol * 2, 3))
-
-                with open(f"{file_core}-12.xyz", "w") as newF12, open(f"{file_core}-23.xyz", "w") as newF23, open(
-                        f"{file_core}-31.xyz", "w") as newF31:
-                    newF12.write(f"{Atoms_in_TcalXYZFile}\n"
-                                 f"{Comment}")
-                    newF23.write(f"{Atoms_in_TcalXYZFile}\n"
-                                 f"{Comment}")
-                    newF31.write(f"{Atoms_in_TcalXYZFile}\n"
-                                 f"{Comment}")
-                    for i in range(Atoms_inMol):
-                        newF12.write(Mol1[i])
-                        newF23.write(Mol2[i])
-                        newF31.write(Mol3[i])
-                    for i in range(Atoms_inMol):
-                        newF12.write(Mol2[i])
-                        newF23.write(Mol3[i])
-                        newF31.write(Mol1[i])
-                self.messages.append(f"\t>>> {file_core}-12.xyz: Created!!")
-                self.messages.append(f"\t>>> {file_core}-23.xyz: Created!!")
-                self.messages.append(f"\t>>> {file_core}-31.xyz: Created!!")
-                os.rename(filepath, f"{file_core}.all")
+                for PairFile in PairFiles:
+                    self.messages.append(f"\t>>> {PairFile}: Created!!")
+                    PairNames.append(os.path.basename(PairFile)[:-4])
+                os.rename(filepath, f"{filepath[:-4]}.all")
+        with open(f"{self.tcalpath}/{Constant.TcalPairList}", "w") as f:
+            f.writelines(f"{PairName}\n" for PairName in PairNames)
         if len(Faults) != 0:
-            for Fault in Faults:
-                self.messages.append(f"\t>>> {Color.RED}Error: {Fault} did not divide by 3.{Color.RESET}")
+            self.messages.append(f"\t>>> {Color.RED}Error: {len(Faults)} xyz files were NOT split into pairs.{Color.RESET}")
             self.HelpList.append(True)
         else:
             self.messages.append(f"\n\t>>> {Color.GREEN}XYZ 3mol to 2mol: Succeeded!!{Color.RESET}")
         self.help_check_exit()
         return
 
+    def XYZ_to_Pairs(self, filepath, Atoms_inMol, Pairs=None, Cutoff=None):
+        """
+        Split the xyz file of a cluster into the xyz files of molecular pairs
+        :param filepath: xyz file of molecules with the same atom order
+        :param Atoms_inMol: number of atoms in one molecule
+        :param Pairs: molecule numbers (from 1) of the pairs, e.g. [(1, 2), (2, 3), (3, 1)].
+                      If None, all pairs whose closest atoms are within Cutoff are written.
+        :param Cutoff: Angstrom (Constant.Pair_Cutoff if None)
+        :return: created files (None if the cluster or the pairs are not valid)
+        """
+        with open(filepath, "r") as f:
+            number_atoms = int(float(f.readline()))
+            Comment = f.readline()
+            coordinates = [line for line in f if line.strip()]
+        if len(coordinates) != number_atoms or number_atoms % Atoms_inMol != 0 or number_atoms < Atoms_inMol * 2:
+            self.messages.append(f"\t>>> {Color.RED}Error: {filepath} could not be divided into molecules of "
+                                 f"{Atoms_inMol} atoms ({len(coordinates)} atoms, {number_atoms} in the header)."
+                                 f"{Color.RESET}")
+            self.HelpList.append(True)
+            return None
+
+        NumMol = number_atoms // Atoms_inMol
+        Blocks = ["".join(coordinates[i * Atoms_inMol:(i + 1) * Atoms_inMol]) for i in range(NumMol)]
+
+        if Pairs is None:
+            Cutoff = Constant.Pair_Cutoff if Cutoff is None else Cutoff
+            # 全ての原子間距離から分子間の最近接距離を求める
+            Positions = np.array([line.split()[1:4] for line in coordinates], dtype=float)
+            Distances = np.linalg.norm(Positions[:, None, :] - Positions[None, :, :], axis=-1)
+            Contacts = Distances.reshape(NumMol, Atoms_inMol, NumMol, Atoms_inMol).min(axis=(1, 3))
+            Pairs = [(i + 1, j + 1) for i, j in zip(*np.triu_indices(NumMol, 1)) if Contacts[i, j] <= Cutoff]
+            if NumMol == 3:
+                # 3分子ではバンドの計算が読む -12, -23, -31 の向きにそろえる
+                Pairs = [(3, 1) if Pair == (1, 3) else Pair for Pair in Pairs]
+        else:
+            Invalid = [(i, j) for i, j in Pairs if not (1 <= i <= NumMol and 1 <= j <= NumMol) or i == j]
+            if Invalid:
+                self.messages.append(f"\t>>> {Color.RED}Error: The pairs {Invalid} do not exist in {filepath} "
+                                     f"({NumMol} molecules).{Color.RESET}")
+                self.HelpList.append(True)
+                return None
+
+        PairFiles = []
+        for i, j in Pairs:
+            PairFile = f"{filepath[:-4]}{self.PairName(i, j, NumMol)}.xyz"
+            with open(PairFile, "w") as f:
+                f.write(f"{Atoms_inMol * 2}\n{Comment}{Blocks[i - 1]}{Blocks[j - 1]}")
+            PairFiles.append(PairFile)
+        return PairFiles
+
+    @staticmethod
+    def PairName(i, j, NumMol):
+        """
+        Suffix of the pair xyz file: -12 for up to 9 molecules, -0112 for 10 to 99 molecules
+        :param i:
+        :param j:
+        :param NumMol:
+        :return:
+        """
+        Width = len(str(NumMol))
+        return f"-{i:0{Width}d}{j:0{Width}d}"
+
+    @staticmethod
+    def TcalPairNames(tcal_path):
+        """
+        Names of the pairs written by XYZ_3mol_to_XYZ_2mol (the input file names in the tcal log)
+        :param tcal_path:
+        :return: list of names, or None if the list was not written
+        """
+        if not os.path.exists(f"{tcal_path}/{Constant.TcalPairList}"):
+            return None
+        with open(f"{tcal_path}/{Constant.TcalPairList}", "r") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    @classmethod
+    def PairXYZs(cls, tcal_path):
+        """
+        Pair xyz files written by XYZ_to_Pairs (one tcal result each)
+        :param tcal_path:
+        :return:
+        """
+        return [f"{tcal_path}/{Name}.xyz" for Name in cls.TcalPairNames(tcal_path) or []
+                if os.path.exists(f"{tcal_path}/{Name}.xyz")]
+
     def readlog(self):
+        """
+        Read the tcal log line by line and write the transfer integrals of every input file
+        :return: failed pairs [(input file, missing keywords)]
+        """
         print(f"\nReading the Tcal log file...")
         filepath = f"{self.tcalpath}/{self.MaterName}_3mol{self.mol_pos}_tcal.log"
         output_filepath = f"{self.tcalpath}/{self.MaterName}_3mol{self.mol_pos}_TIs.txt"
-        with open(filepath, "r") as f:
-            lines = f.readlines()
-
-        DataList = []
-        keywords = ["Input File Name:", "NLUMO", "LUMO", "HOMO", "NHOMO"]
-        for line in lines:
-            for keyword in keywords:
-                if keyword in line:
-                    DataList.append(line)
-                    break
-        if len(DataList) % 5 != 0:
-            self.messages.append(f"\t>>> {Color.RED}Error: UNEXPECTED ERROR in read Tcal log process.{Color.RESET}")
-            self.HelpList.append(True)
-            self.help_check_exit()
+        Keywords = ("NLUMO", "LUMO", "HOMO", "NHOMO")
 
-        with open(output_filepath, "w") as file:
+        Failed = []
+        with open(filepath, "r") as log, open(output_filepath, "w") as file:
             header = (f"***** Transfer Integrals in "
                       f"{self.tcalpath}/{self.MaterName}_3mol{self.mol_pos}_tcal.log *****\n")
             columns = "input file\tNLUMO (meV)\tLUMO (meV)\tHOMO (meV)\tNHOMO (meV)\n"
             file.write(header + columns)
             print(header.strip())
             print(columns.strip())
-            for i in range(0, len(DataList), 5):
-                input_file = DataList[i].split(": ")[1].split(".xyz")[0]
-                NLUMO = self.extract_value(DataList[i + 1], "NLUMO")
-                LUMO = self.extract_value(DataList[i + 2], "LUMO")
-                HOMO = self.extract_value(DataList[i + 3], "HOMO")
-                NHOMO = self.extract_value(DataList[i + 4], "NHOMO")
-                file.write(f"{input_file}\t{NLUMO}\t{LUMO}\t{HOMO}\t{NHOMO}\n")
-                print(f"{input_file}\t{NLUMO}\t{LUMO}\t{HOMO}\t{NHOMO}")
-        return
+
+            for input_file, Values in self.TcalBlocks(log):
+                # 値が見つからなかったものは nan として書き込む
+                Row = "\t".join(str(Values.get(Keyword, float("nan"))) for Keyword in Keywords)
+                file.write(f"{input_file}\t{Row}\n")
+                file.flush()
+                print(f"{input_file}\t{Row}")
+                if len(Values) < len(Keywords):
+                    Failed.append((input_file, [Keyword for Keyword in Keywords if Keyword not in Values]))
+
+        if Failed:
+            self.messages.append(f"\t>>> {Color.RED}Warning: Transfer integrals of {len(Failed)} pairs were NOT found "
+                                 f"(written as nan and excluded in combineData).{Color.RESET}")
+            for input_file, Missing in Failed:
+                self.messages.append(f"\t\t{input_file}: {', '.join(Missing)}")
+        return Failed
+
+    def TcalBlocks(self, log):
+        """
+        Split the tcal log into the blocks of "Input File Name:"
+        :param log: opened tcal log
+        :return: generator of (input file, {keyword: value})
+        """
+        input_file, Values = None, {}
+        for line in log:
+            if "Input File Name:" in line:
+                if input_file is not None:
+                    yield input_file, Values
+                input_file, Values = line.split("Input File Name:")[1].strip().split(".xyz")[0], {}
+            elif input_file is not None:
+                Value = self.extract_value(line)
+                if Value is not None and Value[0] not in Values:
+                    Values[Value[0]] = Value[1]
+        if input_file is not None:
+            yield input_file, Values
 
     @staticmethod
-    def extract_value(line, keyword):
-        return float(line.split(keyword)[-1].split()[0])
+    def extract_value(line):
+        """
+        Keyword (NLUMO, LUMO, HOMO or NHOMO) and the value after it in a line of the tcal log
+        :param line:
+        :return: (keyword, value) or None
+        """
+        Words = line.split()
+        for Keyword, Value in zip(Words, Words[1:]):
+            if Keyword in ("NLUMO", "LUMO", "HOMO", "NHOMO"):
+                try:
+                    return Keyword, float(Value)
+                except ValueError:
+                    pass
+        return None
 
     def PhaseCheck(self):
         print("\n**********\nPhase Checking...")
@@ -1560,16 +1879,19 @@ class BrickWork:
             print(f"\t>>> Any chk file is NOT found in the specified folder.\n"
                   f"\t>>> The process for phase check was {Color.GREEN}skipped.{Color.RESET}")
         else:
+            CalCores.sort()
+            print(f"\t>>> {len(CalCores)} pairs are checked in {Constant.PhaseCheck_Workers} processes "
+                  f"(backend: {self.Phase}).")
             with open(f"{self.tcalpath}/PhaseCheck.txt", "w") as file:
-                file.write("Name\tfor LUMO\tfor HOMO\n")
-                for CalCore in CalCores:
-                    self.mkCubeFile(f"{CalCore}_m1.chk")
-                    self.mkCubeFile(f"{CalCore}_m2.chk")
-
-                    HomoChk = self.ComparePhase(CalCore, "HOMO")
-                    LumoChk = self.ComparePhase(CalCore, "LUMO")
-
-                    file.write(f"{CalCore}\t{LumoChk}\t{HomoChk}\n")
+                file.write("Name\tfor LUMO\tfor HOMO\tConfidence (LUMO)\tConfidence (HOMO)\n")
+                file.flush()
+                with ProcessPoolExecutor(max_workers=Constant.PhaseCheck_Workers) as executor:
+                    futures = [executor.submit(self.PhaseCheckCore, CalCore) for CalCore in CalCores]
+                    # 終わったものから書き込む
+                    for future in as_completed(futures):
+                        CalCore, (LumoChk, LumoConf), (HomoChk, HomoConf) = future.result()
+                        file.write(f"{CalCore}\t{LumoChk}\t{HomoChk}\t{LumoConf}\t{HomoConf}\n")
+                        file.flush()
         if self.Debug:
             pass
         else:
@@ -1580,6 +1902,26 @@ class BrickWork:
             self.rmWildCards(f"{self.tcalpath}/*.gjf")
         return
 
+    def PhaseCheckCore(self, CalCore):
+        """
+        Phase check of one pair: formchk (and cubegen) for both monomers and comparison of the orbitals
+        :param CalCore:
+        :return: CalCore, (phase, confidence) for LUMO, (phase, confidence) for HOMO
+        """
+        if self.Phase == "mo":
+            MOs1 = self.ReadFchMOs(f"{CalCore}_m1.chk")
+            MOs2 = self.ReadFchMOs(f"{CalCore}_m2.chk")
+
+            HomoChk = self.CompareMOPhase(CalCore, "HOMO", MOs1, MOs2)
+            LumoChk = self.CompareMOPhase(CalCore, "LUMO", MOs1, MOs2)
+        else:
+            self.mkCubeFile(f"{CalCore}_m1.chk")
+            self.mkCubeFile(f"{CalCore}_m2.chk")
+
+            HomoChk = self.ComparePhase(CalCore, "HOMO")
+            LumoChk = self.ComparePhase(CalCore, "LUMO")
+        return CalCore, LumoChk, HomoChk
+
     def mkCalCoreList(self, chkKEY):
         FileList = glob.glob(f"{self.tcalpath}/*{chkKEY}*")
         CalCores = []
@@ -1609,51 +1951,172 @@ class BrickWork:
 
     def ComparePhase(self, CalCore, HomoLumo):
         """
+        Phase of the m2 orbital relative to the m1 orbital from the signed overlap over the high-density voxels
         :param CalCore:
         :param HomoLumo:
-        :return:
+        :return: phase ("Same" or "Opposit") and its confidence (normalized overlap, 0-1)
         """
         Val1 = self.ReadCube(f"{CalCore}_m1_{HomoLumo}.cub")
         Val2 = self.ReadCube(f"{CalCore}_m2_{HomoLumo}.cub")
 
         if len(Val1) != len(Val2):
-            return "not available(1) (Different number of grids in the file)"
-
-        PClist = []
-        print(f"{CalCore} {HomoLumo} Data Excerpt")
-        for i in random.sample(range(len(Val1)), min(20, len(Val1))):
-            if abs(Val1[i]) > 1e-7:
-                Val = Val1[i] * Val2[i]
-                print(f"m1 value = {Val1[i]}\tm2 value = {Val2[i]}")
-                PClist.append("Opposit" if Val < 0 else "Same")
-
-        PC = list(set(PClist))
-        if len(PC) == 1:
-            return PC[0]
-        elif len(PC) > 1:
-            return "not available(2)"
-        else:
-            return "not available(3)"
+            print(f"\t>>> {CalCore} {HomoLumo}: {Color.RED}Different number of grids in the file{Color.RESET}")
+            return "not_available(1)", 0.0
+
+        # m1, m2のどちらかで電子密度が大きいボクセルだけを使う
+        Density = np.maximum(np.abs(Val1), np.abs(Val2))
+        Mask = Density >= Constant.Phase_DensityCut * Density.max()
+        Val1 = Val1[Mask].astype(np.float64)
+        Val2 = Val2[Mask].astype(np.float64)
+
+        Overlap = np.dot(Val1, Val2)
+        Norm = np.sqrt(np.dot(Val1, Val1) * np.dot(Val2, Val2))
+        if Norm == 0 or Overlap == 0:
+            return "not_available(3)", 0.0
+
+        Confidence = round(abs(Overlap) / Norm, 3)
+        PC = "Opposit" if Overlap < 0 else "Same"
+        print(f"{CalCore} {HomoLumo}: {PC} (overlap = {Overlap:.4e}, confidence = {Confidence}, "
+              f"{np.count_nonzero(Mask)} voxels)")
+        if Confidence < Constant.Phase_MinConfidence:
+            print(f"\t>>> {Color.YELLOW}Warning: Low confidence in the phase of {CalCore} {HomoLumo}{Color.RESET}")
+        return PC, Confidence
+
+    @staticmethod
+    def ReadFch(fchfile, Keys):
+        """
+        Read the requested sections of the formatted checkpoint file
+        :param fchfile:
+        :param Keys: names of the sections (e.g. "Alpha MO coefficients")
+        :return: dict of the section name and its value (int, float or NumPy array)
+        """
+        Sections = {}
+        with open(fchfile, "r") as file:
+            for line in file:
+                Key = line[:40].strip()
+                if Key not in Keys:
+                    continue
+
+                Fields = line[40:].split()
+                dtype = int if Fields[0] == "I" else float
+                if Fields[1] == "N=":
+                    # 配列: I は1行に6個, R は1行に5個
+                    Num = int(Fields[2])
+                    NumLines = -(-Num // (6 if dtype is int else 5))
+                    Text = "".join(next(file) for _ in range(NumLines))
+                    Sections[Key] = np.fromstring(Text, dtype=dtype, sep=" ")
+                else:
+                    Sections[Key] = dtype(Fields[1])
+
+                if len(Sections) == len(Keys):
+                    break
+        return Sections
+
+    def ReadFchMOs(self, chkfile):
+        """
+        HOMO and LUMO coefficients of the monomer from the formatted checkpoint file
+        :param chkfile:
+        :return: dict of the HOMO/LUMO coefficients and the atom of each basis function
+        """
+        print(f"For {chkfile} ...")
+        fchk = f"{chkfile[:-4]}.fch"
+        subprocess.run(["formchk", chkfile, fchk], cwd=self.tcalpath, timeout=1000)
+        print(f"\tFile Conversion ({chkfile} -> {fchk}): {Color.GREEN}Completed!!{Color.RESET}")
+
+        Fch = self.ReadFch(f"{self.tcalpath}/{fchk}", {"Number of alpha electrons", "Number of basis functions",
+                                                       "Shell types", "Shell to atom map",
+                                                       "Alpha MO coefficients"})
+        subprocess.run(["rm", fchk], cwd=self.tcalpath, timeout=10)
+
+        NAlpha = Fch["Number of alpha electrons"]
+        Coeffs = Fch["Alpha MO coefficients"].reshape(-1, Fch["Number of basis functions"])
+
+        # 殻の種類ごとの基底関数の数 (0: S, 1: P, -1: SP, 2: 6D, -2: 5D, ...)
+        ShellTypes = Fch["Shell types"]
+        NumFunctions = np.where(ShellTypes >= 0, (ShellTypes + 1) * (ShellTypes + 2) // 2,
+                                np.where(ShellTypes == -1, 4, 2 * np.abs(ShellTypes) + 1))
+        BasisAtoms = np.repeat(Fch["Shell to atom map"], NumFunctions)
+        return {"HOMO": Coeffs[NAlpha - 1], "LUMO": Coeffs[NAlpha], "Atoms": BasisAtoms}
+
+    @staticmethod
+    def CompareMOPhase(CalCore, HomoLumo, MOs1, MOs2):
+        """
+        Phase of the m2 orbital relative to the m1 orbital from the dot product of the MO coefficients
+        :param CalCore:
+        :param HomoLumo:
+        :param MOs1: ReadFchMOs of m1
+        :param MOs2: ReadFchMOs of m2
+        :return: phase ("Same" or "Opposit") and its confidence (normalized overlap, 0-1)
+        """
+        if not np.array_equal(MOs1["Atoms"], MOs2["Atoms"]):
+            print(f"\t>>> {CalCore} {HomoLumo}: {Color.RED}Different basis functions in the file{Color.RESET}")
+            return "not_available(1)", 0.0
+
+        Coeff1 = MOs1[HomoLumo]
+        Coeff2 = MOs2[HomoLumo]
+        # m1, m2のどちらかで係数が大きい基底関数だけを使う
+        Weight = np.maximum(np.abs(Coeff1), np.abs(Coeff2))
+        Mask = Weight >= Constant.Phase_DensityCut * Weight.max()
+        Coeff1 = Coeff1[Mask]
+        Coeff2 = Coeff2[Mask]
+
+        Overlap = np.dot(Coeff1, Coeff2)
+        Norm = np.sqrt(np.dot(Coeff1, Coeff1) * np.dot(Coeff2, Coeff2))
+        if Norm == 0 or Overlap == 0:
+            return "not_available(3)", 0.0
+
+        Confidence = round(abs(Overlap) / Norm, 3)
+        PC = "Opposit" if Overlap < 0 else "Same"
+        print(f"{CalCore} {HomoLumo}: {PC} (overlap = {Overlap:.4e}, confidence = {Confidence}, "
+              f"{len(np.unique(MOs1['Atoms'][Mask]))} atoms)")
+        if Confidence < Constant.Phase_MinConfidence:
+            print(f"\t>>> {Color.YELLOW}Warning: Low confidence in the phase of {CalCore} {HomoLumo}{Color.RESET}")
+        return PC, Confidence
+
+    @staticmethod
+    def ReadCubeHeader(file):
+        """
+        Read the header of the cube file up to the volumetric data
+        :param file: opened cube file
+        :return: the number of grids in x, y and z
+        """
+        for _ in range(2):  # skip the first two lines (comments)
+            next(file)
+
+        NumAtoms = int(next(file).split()[0])
+        Xgrid, Ygrid, Zgrid = (int(next(file).split()[0]) for _ in range(3))
+        for _ in range(abs(NumAtoms)):  # skip the atoms
+            next(file)
+        if NumAtoms < 0:
+            # MO cube: the number of MOs and their indices follow the atoms
+            MOs = next(file).split()
+            while len(MOs) < int(MOs[0]) + 1:
+                MOs += next(file).split()
+        return Xgrid, Ygrid, Zgrid
 
     def ReadCube(self, Cubefile):
         """
-        Read the cube file
+        Read the volumetric data of the cube file into a float32 array
         :param Cubefile:
         :return:
         """
         with open(f"{self.tcalpath}/{Cubefile}", "r") as file:
-            for _ in range(2):  # skip the first two lines (comment and number of atoms)
-                next(file)
-
-            NumE, Xgrid, Ygrid, Zgrid = (int(next(file).split()[0]) for _ in range(4))
-            for _ in range(NumE):  # skip the number of electrons
-                next(file)
-
-            values = [float(x) for _ in range(Xgrid * Ygrid)
-                      for line in file for x in line.split()]
+            Xgrid, Ygrid, Zgrid = self.ReadCubeHeader(file)
+            NumRead = Xgrid * Ygrid * Zgrid
+
+            values = np.empty(NumRead, dtype=np.float32)
+            filled = 0
+            while filled < NumRead:
+                lines = file.readlines(Constant.Cube_ChunkSize)
+                if not lines:
+                    break
+                chunk = np.fromstring("".join(lines), dtype=np.float32, sep=" ")
+                n = min(chunk.size, NumRead - filled)
+                values[filled:filled + n] = chunk[:n]
+                filled += n
 
         subprocess.run(["rm", Cubefile], cwd=self.tcalpath, timeout=10)
-        return values
+        return values[:filled]
 
     # Result Data set
     def Result_Data_set(self, before):
@@ -1745,29 +2208,18 @@ class BrickWork:
             Min_lines = f.readlines()
         del Min_lines[0:2]
 
+        # 入力ファイル名をキーにした辞書で結合する
+        TIs = {TI_line.split()[0]: TI_line.split() for TI_line in TI_lines if TI_line.strip()}
+        PCs = {}
         if os.path.exists(f"{self.tcalpath}/{PCFileName}"):
             with open(f"{self.tcalpath}/{PCFileName}", "r") as f:
-                PC_lines = f.readlines()
-            del PC_lines[0:2]
-        else:
-            PC_lines = []
-
-        if len(TI_lines) == len(Min_lines) * 3:
-            pass
-        else:
-            self.messages.append(f"\t>>>{Color.RED}Error: The numbers of data lines in {MinFileName} "
-                                 f"and {TIFileName} DO NOT match.{Color.RESET}\n"
-                                 f"A file was NOT be changed.")
-            self.HelpList.append(True)
-        self.help_check_exit()
-
-        CombLines = []
-        CombLines12 = []
-        CombLines23 = []
-        CombLines31 = []
-        print("Entry\tOther\tDEdge\tDFaceon\tCpCE\tBSE\t**"
-              "\tTI-NLUMO\tTI-LUMO\tTI-HOMO\tTI-NHOMO\t**\tPC (LUMO)\tTI-LUMO\tPC (HOMO)\tTI-HOMO")
+                next(f, None)  # header
+                for PC_line in f:
+                    PCData = PC_line.rstrip("\n").split("\t")
+                    if len(PCData) >= 3:
+                        PCs[PCData[0]] = (PCData[1], PCData[2])
 
+        Entries = []
         for Min_line in Min_lines:
             MinData = Min_line.split()
 
@@ -1775,56 +2227,57 @@ class BrickWork:
                      f"_{int(round(float(MinData[0]) * 100, 5))}"
                      f"_{int(round(float(MinData[1]) * 100, 5))}"
                      f"_{int(round(float(MinData[2]) * 100, 5))}")
+            Entries.append((Entry, MinData))
+
+        # 最小エネルギーの構造ごとに、計算を依頼したペアのTIがそろっているかを確認する
+        PairNames = self.TcalPairNames(self.tcalpath)
+        if PairNames is None:
+            # ペアの一覧がない以前の計算では -12, -23, -31 の3つを求める
+            PairNames = [f"{Entry}{Suffix}" for Entry, _ in Entries for Suffix in ("-12", "-23", "-31")]
+        Pairs = {Entry: [(Name, Name[len(Entry):]) for Name in PairNames if Name.startswith(f"{Entry}-")]
+                 for Entry, _ in Entries}
+        Lacks = ([f"{Entry} (no pair)" for Entry, Names in Pairs.items() if not Names]
+                 + [Name for Names in Pairs.values() for Name, _ in Names if Name not in TIs])
+        if Lacks:
+            self.messages.append(f"\t>>>{Color.RED}Error: The transfer integrals of {len(Lacks)} pairs for "
+                                 f"{MinFileName} were NOT found in {TIFileName}.{Color.RESET}")
+            for Lack in Lacks:
+                self.messages.append(f"\t\t{Lack}")
+            self.messages.append(f"A file was NOT be changed.")
+            self.HelpList.append(True)
+        self.help_check_exit()
 
-            for TI_line in TI_lines:
-                TIData = TI_line.split()
-                if (TIData[0] == Entry
-                        or TIData[0] == f"{Entry}-12"
-                        or TIData[0] == f"{Entry}-23"
-                        or TIData[0] == f"{Entry}-31"):
-                    CombLine_temp = (
-                        f"{TIData[0]}\t{MinData[0]}\t{MinData[1]}\t{MinData[2]}\t{MinData[3]}\t{MinData[4]}"
-                        f"\t**\t{TIData[1]}\t{TIData[2]}\t{TIData[3]}\t{TIData[4]}")
-
-                    HomoChk = "yet"
-                    LumoChk = "yet"
-                    if len(PC_lines) != 0:
-                        for PCLine in PC_lines:
-                            PCData = PCLine.split()
-                            if PCData[0].strip() == TIData[0].strip():
-                                LumoChk = PCData[1]
-                                HomoChk = PCData[2]
-                    else:
-                        pass
+        CombLines, Excluded = {}, []
+        print("Entry\tOther\tDEdge\tDFaceon\tCpCE\tBSE\t**"
+              "\tTI-NLUMO\tTI-LUMO\tTI-HOMO\tTI-NHOMO\t**\tPC (LUMO)\tTI-LUMO\tPC (HOMO)\tTI-HOMO")
 
-                    correctTI_LUMO = self.correctTI(LumoChk, TIData[2])
-                    correctTI_HOMO = self.correctTI(HomoChk, TIData[3])
-                    CombLine = f"{CombLine_temp}\t**\t{LumoChk}\t{correctTI_LUMO}\t{HomoChk}\t{correctTI_HOMO}\n"
-                    if TIData[0] == Entry:
-                        CombLines.append(CombLine)
-                    elif TIData[0] == f"{Entry}-12":
-                        CombLines12.append(CombLine)
-                    elif TIData[0] == f"{Entry}-23":
-                        CombLines23.append(CombLine)
-                    elif TIData[0] == f"{Entry}-31":
-                        CombLines31.append(CombLine)
-                    else:
-                        pass
-                else:
-                    pass
+        for Entry, MinData in Entries:
+            for Name, Suffix in Pairs[Entry]:
+                TIData = TIs.get(Name)
+                if TIData is None:
+                    continue
+                if "nan" in TIData[1:5]:
+                    Excluded.append(Name)
+                    continue
+                CombLine_temp = (
+                    f"{TIData[0]}\t{MinData[0]}\t{MinData[1]}\t{MinData[2]}\t{MinData[3]}\t{MinData[4]}"
+                    f"\t**\t{TIData[1]}\t{TIData[2]}\t{TIData[3]}\t{TIData[4]}")
+                LumoChk, HomoChk = PCs.get(TIData[0], ("yet", "yet"))
+
+                correctTI_LUMO = self.correctTI(LumoChk, TIData[2])
+                correctTI_HOMO = self.correctTI(HomoChk, TIData[3])
+                CombLines.setdefault(Suffix, []).append(
+                    f"{CombLine_temp}\t**\t{LumoChk}\t{correctTI_LUMO}\t{HomoChk}\t{correctTI_HOMO}\n")
+        if Excluded:
+            # tcalの値が欠けたペア (readlogでnanとして書き込んだもの) は結合しない
+            self.messages.append(f"\t>>> {Color.RED}Warning: {len(Excluded)} pairs with missing transfer integrals "
+                                 f"in {TIFileName} were excluded.{Color.RESET}")
+            for Name in Excluded:
+                self.messages.append(f"\t\t{Name}")
         self.help_check_exit()
-        CombLines.sort()
-        CombLines12.sort()
-        CombLines23.sort()
-        CombLines31.sort()
-        self.saveCombData(f"{self.MaterName}_3mol{self.mol_pos}",
-                          f"{result_path}/{self.MaterName}_3mol{self.mol_pos}_min-TIs.txt", CombLines)
-        self.saveCombData(f"{self.MaterName}_3mol{self.mol_pos}-12",
-                          f"{result_path}/{self.MaterName}_3mol{self.mol_pos}_min-TIs-12.txt", CombLines12)
-        self.saveCombData(f"{self.MaterName}_3mol{self.mol_pos}-23",
-                          f"{result_path}/{self.MaterName}_3mol{self.mol_pos}_min-TIs-23.txt", CombLines23)
-        self.saveCombData(f"{self.MaterName}_3mol{self.mol_pos}-31",
-                          f"{result_path}/{self.MaterName}_3mol{self.mol_pos}_min-TIs-31.txt", CombLines31)
+        for Suffix, Lines in CombLines.items():
+            self.saveCombData(f"{self.MaterName}_3mol{self.mol_pos}{Suffix}",
+                              f"{result_path}/{self.MaterName}_3mol{self.mol_pos}_min-TIs{Suffix}.txt", sorted(Lines))
         print(f"\n"
               f"\t>>> {Color.GREEN}Combining Data: Succeeded!!{Color.RESET}\n"
               f"\t>>> {MinFileName} and {TIFileName} were combined into "
@@ -1991,6 +2444,33 @@ class Constant:
     CycleCondition_n_02 = 1
     CycleCondition_n_01 = 1
     CycleCondition_n_005 = 1
+    # Phase checkでformchk/cubegenを同時に実行するプロセス数
+    PhaseCheck_Workers = 8
+    # cubeファイルを一度に読み込むバイト数
+    Cube_ChunkSize = 1 << 20
+    # Phase checkで使うボクセルの閾値 (最大値に対する割合)
+    Phase_DensityCut = 0.1
+    # これより信頼度が低い位相判定は警告を出す
+    Phase_MinConfidence = 0.5
+    # tcalで計算する分子ペア (分子番号は1から。Noneにすると Pair_Cutoff 以内で接する全てのペア)
+    TcalPairs = [(1, 2), (2, 3), (3, 1)]
+    # 隣接ペアとみなす分子間の最近接原子間距離 (Angstrom)
+    Pair_Cutoff = 5.0
+    # XYZ_to_Pairsで書き出したペアの一覧 (combineDataでTIの行と照合する)
+    TcalPairList = "TcalPairs.txt"
+    # --prescan: UFFのLennard-Jonesパラメータ {元素: (x_i [Angstrom], D_i [kcal/mol])}
+    UFF_LJ = {"H": (2.886, 0.044), "B": (4.083, 0.180), "C": (3.851, 0.105), "N": (3.660, 0.069),
+              "O": (3.500, 0.060), "F": (3.364, 0.050), "Si": (4.295, 0.402), "P": (4.147, 0.305),
+              "S": (4.035, 0.274), "Cl": (3.947, 0.227), "Se": (4.205, 0.291), "Br": (4.189, 0.251),
+              "I": (4.500, 0.339)}
+    # --prescan: 最初の条件を中心に探索する範囲 (Angstrom)
+    PreScan_Range = 5.0
+    # --prescan: 探索の刻み (Angstrom); 2段目以降は前段の最小値の周り±前段の刻みを探索
+    PreScan_Steps = [0.2, 0.05]
+    # --prescan: 原子間相互作用のカットオフ (Angstrom)
+    PreScan_Cutoff = 8.0
+    # --prescan: 一度にKD-treeに入れる原子数の上限
+    PreScan_ChunkAtoms = 1 << 18
 
 
 class CheckRequired(argparse.Action):
@@ -4,25 +4,31 @@ import argparse
 import datetime
 import functools
 import glob
+import hashlib
+import json
 import math
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from PIL import Image
-from matplotlib.animation import FuncAnimation
 from pptx import Presentation
 from pptx.dml.color import RGBColor
 from pptx.enum.text import MSO_ANCHOR, PP_ALIGN
 from pptx.util import Pt
-from scipy.interpolate import griddata
+from scipy.interpolate import CloughTocher2DInterpolator, LinearNDInterpolator, RBFInterpolator
 from scipy.optimize import differential_evolution
+from scipy.spatial import Delaunay
 from tabulate import tabulate
 
 print = functools.partial(print, flush=True)
 
+# plot_AllDataで使う三角形分割のキャッシュ (描画プロセスごとに、(Dcol, Dtrv)の点のハッシュをキーとして最初の使用時に作成)
+Triangulations = {}
+
 
 def main():
     args, before = get_args()
@@ -38,38 +44,29 @@ def main():
         pass
     EM = EffectiveMass(args)
 
-    # Make band information files
-    print("\n**********\nMaking band information files...")
+    # Make band information
+    print("\n**********\nMaking band information...")
+    BandInfo = []
     if len(EM.p1Files) != 0 and len(EM.p2Files) != 0:
-        DatList_p12 = EM.mkBandInfo_p1p2()
-    else:
-        DatList_p12 = []
+        BandInfo.extend(EM.mkBandInfo_p1p2())
     if len(EM.p3Files) != 0:
-        DatList_p3 = EM.mkBandInfo_p3()
-    else:
-        DatList_p3 = []
-    DatList = DatList_p12 + DatList_p3
-    DatList.sort()
-    print(f"\n\t>>> {Color.GREEN}The band information files are created.{Color.RESET}")
+        BandInfo.extend(EM.mkBandInfo_p3())
+    BandInfo.sort(key=lambda Band: Band[0])
+    print(f"\n\t>>> {Color.GREEN}The band information is prepared.{Color.RESET}")
 
     # Make band structure figures
     print("\n**********\nMaking band structures...")
     Pattern = Constants.Pattern
-    FailFiles = []
     MassValues = []
     plotPNGName = ""
-    for Dat in DatList:
+    for Dat, Params in BandInfo:
         print(f"\n>>> Creating band structure figures for {Color.GREEN}{Dat}{Color.RESET}...")
-        Params, Fail = EM.getParameters(Dat)
-        if Fail:
-            FailFiles.append(Dat)
-        else:
-            if EM.debug:
-                EM.displayDef(Params)
-            dev, Kcol, Ktrv, Energy_plus_array, Energy_minus_array, Mass, Masses = EM.calcEffMass(Params)
-            MassValues.append(EM.mkEffectiveMassLine(Dat, Params, Masses))
-            plotPNGName = EM.plotBandDisp(Params["Comment"], dev, Kcol, Ktrv, Energy_plus_array, Energy_minus_array,
-                                          Masses, Pattern)
+        if EM.debug:
+            EM.displayDef(Params)
+        dev, Kcol, Ktrv, Energy_plus_array, Energy_minus_array, Mass, Masses = EM.calcEffMass(Params)
+        MassValues.append(EM.mkEffectiveMassLine(Dat, Params, Masses))
+        plotPNGName = EM.plotBandDisp(Params["Comment"], dev, Kcol, Ktrv, Energy_plus_array, Energy_minus_array,
+                                      Masses, Pattern)
     print(f"\n>>> {Color.GREEN}The band structures were ploted for {len(MassValues)} energy bands.{Color.RESET}\n")
 
     MassValues.sort()
@@ -165,6 +162,21 @@ def get_args():
     parser.add_argument('--gif', '-g', '-G',
                         help="Create GJF File from All File",
                         action='store_true')
+    parser.add_argument('--gif-preview',
+                        help="With --gif, make low-resolution GIFs with fewer frames (*_preview.gif)",
+                        action='store_true')
+    parser.add_argument('--interp',
+                        help="Interpolation for the energy contour plots (default: linear)",
+                        choices=["linear", "cubic", "rbf"], default="linear")
+    parser.add_argument('--jobs', '-j',
+                        help="Number of processes for rendering the summary figures (default: all CPUs)",
+                        type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--replot',
+                        help="Render all summary figures even if they are up to date",
+                        action='store_true')
+    parser.add_argument('--dat',
+                        help="Also export the band information as .dat files into ./BandInfo",
+                        action='store_true')
     args = parser.parse_args()
 
     if args.debug:
@@ -173,12 +185,29 @@ def get_args():
     return args, before
 
 
+def getTriangulation(points):
+    """
+    Delaunay triangulation of (Dcol, Dtrv), shared by the angles rendered in the same process.
+    :param points:
+    :return:
+    """
+    Key = hashlib.sha1(np.ascontiguousarray(points).tobytes()).hexdigest()
+    if Key not in Triangulations:
+        Triangulations[Key] = Delaunay(points)
+    return Triangulations[Key]
+
+
 class EffectiveMass:
     def __init__(self, args):
         self.args = args
         self.MaterName = args.MaterName
         self.debug = args.debug
         self.gif = args.gif
+        self.gif_preview = args.gif_preview
+        self.interp = args.interp
+        self.dat = args.dat
+        self.jobs = max(1, args.jobs)
+        self.replot = args.replot
         self.messages = []
         self.HelpList = []
         self.p1Files, self.p2Files, self.p3Files, self.AllFiles, self.Angles, self.Tilt_Angle = self.File_Set_Check()
@@ -354,81 +383,17 @@ class EffectiveMass:
         return Angles_temp
 
     def mkBandInfo_p1p2(self):
+        p1Data = self.loadMinTIsSet(self.p1Files)
+        p2Data = self.loadMinTIsSet(self.p2Files)
 
-        p1Data_12, p1Data_23, p1Data_31 = [], [], []
-        for p1File in self.p1Files:
-            if "-12.txt" in p1File:
-                p1Data_12 = self.TextFileToData(p1File)
-            elif "-23.txt" in p1File:
-                p1Data_23 = self.TextFileToData(p1File)
-            elif "-31.txt" in p1File:
-                p1Data_31 = self.TextFileToData(p1File)
-
-        p2Data_12, p2Data_23, p2Data_31 = [], [], []
-        for p2File in self.p2Files:
-            if "-12.txt" in p2File:
-                p2Data_12 = self.TextFileToData(p2File)
-            elif "-23.txt" in p2File:
-                p2Data_23 = self.TextFileToData(p2File)
-            elif "-31.txt" in p2File:
-                p2Data_31 = self.TextFileToData(p2File)
-
-        DatList_temp = []
-
-        for Angle in self.Angles:
-            name1, name2 = [], []
-            for line in p1Data_12:
-                DataList = line.strip().split()
-                if float(DataList[1]) == Angle:
-                    name1 = DataList[0].split("_")
-                    Dcol = float(DataList[2].strip())
-                    Dtrv1 = float(DataList[3].strip())
-                    T12_HOMO = float(DataList[15].strip())
-                    T12_LUMO = float(DataList[13])
-
-            for line in p1Data_23:
-                DataList = line.split()
-                if float(DataList[1]) == Angle:
-                    T23_HOMO = float(DataList[15].strip())
-                    T23_LUMO = float(DataList[13].strip())
-                else:
-                    pass
-
-            for line in p1Data_31:
-                DataList = line.split()
-                if float(DataList[1]) == Angle:
-                    T13_HOMO = float(DataList[15].strip())
-                    T13_LUMO = float(DataList[13].strip())
-                else:
-                    pass
-
-            for line in p2Data_12:
-                DataList = line.strip().split()
-                if float(DataList[1]) == Angle:
-                    name2 = DataList[0].split("_")
-                    Dtrv2 = float(DataList[3].strip())
-                else:
-                    pass
-
-            for line in p2Data_23:
-                DataList = line.split()
-                if float(DataList[1]) == Angle:
-                    T35_HOMO = float(DataList[15].strip())
-                    T35_LUMO = float(DataList[13].strip())
-                else:
-                    pass
-
-            for line in p2Data_31:
-                DataList = line.split()
-                if float(DataList[1]) == Angle:
-                    T34_HOMO = float(DataList[15].strip())
-                    T34_LUMO = float(DataList[13].strip())
-                else:
-                    pass
+        for Angle in self.joinAngles("3molp1/p2", p1Data["12"], p1Data["23"], p1Data["31"],
+                                     p2Data["12"], p2Data["23"], p2Data["31"]):
+            p1_12, p1_23, p1_31 = p1Data["12"][Angle], p1Data["23"][Angle], p1Data["31"][Angle]
+            p2_12, p2_23, p2_31 = p2Data["12"][Angle], p2Data["23"][Angle], p2Data["31"][Angle]
 
             # 同じ物質のデータかどうかを確認
-            if name1[0] == name2[0]:
-                name = name1
+            if p1_12["name"][0] == p2_12["name"][0]:
+                name = p1_12["name"]
             else:
                 self.messages.append(f"{Color.RED}"
                                      f"\t>>> Error: Data for the Different Material might exist."
@@ -436,154 +401,113 @@ class EffectiveMass:
                 self.HelpList.append(True)
             self.help_check_exit()
 
-            Dtrv = Dtrv1 + Dtrv2
+            Dcol = p1_12["Dcol"]
+            Dtrv = p1_12["Dtrv"] + p2_12["Dtrv"]
             title = f"{name[0]}_{self.Tilt_Angle}-B12-{int(Angle)}d"
-            print(f"\t>>> {title}-HOMO.dat: ", end="")
-            with open(f"./BandInfo/{title}-HOMO.dat", "w") as Fhomo:
-                Fhomo.write(f"{title}-HOMO\n")
-                Fhomo.write(f"{Constants.n}\n")
-                Fhomo.write(f"{Dcol}\n")
-                Fhomo.write(f"{Dtrv}\n")
-                Fhomo.write("\n")
-                Fhomo.write(f"{T12_HOMO}\n")
-                Fhomo.write(f"{T13_HOMO}\n")
-                Fhomo.write(f"{T23_HOMO}\n")
-                Fhomo.write(f"{T34_HOMO}\n")
-                Fhomo.write(f"{T35_HOMO}\n")
-                Fhomo.write("\n")
-            DatList_temp.append(f"./BandInfo/{title}-HOMO.dat")
-            print("Complete!")
-
-            print(f"\t>>> {title}-LUMO.dat: ", end="")
-            with open(f"./BandInfo/{title}-LUMO.dat", "w") as Flumo:
-                Flumo.write(f"{title}-LUMO\n")
-                Flumo.write(f"{Constants.n}\n")
-                Flumo.write(f"{Dcol}\n")
-                Flumo.write(f"{Dtrv}\n")
-                Flumo.write("\n")
-                Flumo.write(f"{T12_LUMO}\n")
-                Flumo.write(f"{T13_LUMO}\n")
-                Flumo.write(f"{T23_LUMO}\n")
-                Flumo.write(f"{T34_LUMO}\n")
-                Flumo.write(f"{T35_LUMO}\n")
-                Flumo.write("\n")
-            DatList_temp.append(f"./BandInfo/{title}-LUMO.dat")
-            print("Complete!")
-
-        return DatList_temp
+            yield self.mkBandRecord(f"{title}-HOMO", Dcol, Dtrv, p1_12["TI_HOMO"], p1_31["TI_HOMO"],
+                                    p1_23["TI_HOMO"], p2_31["TI_HOMO"], p2_23["TI_HOMO"])
+            yield self.mkBandRecord(f"{title}-LUMO", Dcol, Dtrv, p1_12["TI_LUMO"], p1_31["TI_LUMO"],
+                                    p1_23["TI_LUMO"], p2_31["TI_LUMO"], p2_23["TI_LUMO"])
 
     def mkBandInfo_p3(self):
+        p3Data = self.loadMinTIsSet(self.p3Files)
 
-        p3Data_12, p3Data_23, p3Data_13 = [], [], []
-        for p3 in self.p3Files:
-            if "-12.txt" in p3:
-                p3Data_12 = self.TextFileToData(p3)
-            elif "-23.txt" in p3:
-                p3Data_23 = self.TextFileToData(p3)
-            elif "-31.txt" in p3:
-                p3Data_13 = self.TextFileToData(p3)
-            else:
-                pass
-
-        DatList_temp = []
-
-        for Angle in self.Angles:
-            for line in p3Data_12:
-                DataList = line.strip().split()
-                if float(DataList[1]) == Angle:
-                    name = DataList[0].split("_")
-                    Dcol = float(DataList[2].strip())
-                    Dtrv = float(DataList[3].strip()) * 2
-                    T12_HOMO = float(DataList[15])
-                    T12_LUMO = float(DataList[13])
-                else:
-                    pass
-
-            for line in p3Data_23:
-                DataList = line.strip().split()
-                if float(DataList[1]) == Angle:
-                    T23_HOMO = float(DataList[15])
-                    T23_LUMO = float(DataList[13])
-                else:
-                    pass
-
-            for line in p3Data_13:
-                DataList = line.strip().split()
-                if float(DataList[1]) == Angle:
-                    T13_HOMO = float(DataList[15])
-                    T13_LUMO = float(DataList[13])
-                else:
-                    pass
+        for Angle in self.joinAngles("3molp3", p3Data["12"], p3Data["23"], p3Data["31"]):
+            p3_12, p3_23, p3_31 = p3Data["12"][Angle], p3Data["23"][Angle], p3Data["31"][Angle]
 
+            name = p3_12["name"]
+            Dcol = p3_12["Dcol"]
+            Dtrv = p3_12["Dtrv"] * 2
             title = f"{name[0]}_{self.Tilt_Angle}-B3-{int(Angle)}d"
-            print(f"\t>>> {title}-HOMO.dat: ", end="")
-            with open(f"./BandInfo/{title}-HOMO.dat", "w") as Fhomo:
-                Fhomo.write(f"{title}-HOMO\n")
-                Fhomo.write(f"{Constants.n}\n")
-                Fhomo.write(f"{Dcol}\n")
-                Fhomo.write(f"{Dtrv}\n")
-                Fhomo.write("\n")
-                Fhomo.write(f"{T12_HOMO}\n")
-                Fhomo.write(f"{T13_HOMO}\n")
-                Fhomo.write(f"{T23_HOMO}\n")
-                Fhomo.write(f"{T13_HOMO}\n")
-                Fhomo.write(f"{T23_HOMO}\n")
-                Fhomo.write("\n")
-            DatList_temp.append(f"./BandInfo/{title}-HOMO.dat")
-            print("Complete!")
-
-            print(f"\t>>> {title}-LUMO.dat: ", end="")
-            with open(f"./BandInfo/{title}-LUMO.dat", "w") as Flumo:
-                Flumo.write(f"{title}-LUMO\n")
-                Flumo.write(f"{Constants.n}\n")
-                Flumo.write(f"{Dcol}\n")
-                Flumo.write(f"{Dtrv}\n")
-                Flumo.write("\n")
-                Flumo.write(f"{T12_LUMO}\n")
-                Flumo.write(f"{T13_LUMO}\n")
-                Flumo.write(f"{T23_LUMO}\n")
-                Flumo.write(f"{T13_LUMO}\n")
-                Flumo.write(f"{T23_LUMO}\n")
-                Flumo.write("\n")
-            DatList_temp.append(f"./BandInfo/{title}-LUMO.dat")
-            print("Complete!")
-
-        return DatList_temp
+            yield self.mkBandRecord(f"{title}-HOMO", Dcol, Dtrv, p3_12["TI_HOMO"], p3_31["TI_HOMO"],
+                                    p3_23["TI_HOMO"], p3_31["TI_HOMO"], p3_23["TI_HOMO"])
+            yield self.mkBandRecord(f"{title}-LUMO", Dcol, Dtrv, p3_12["TI_LUMO"], p3_31["TI_LUMO"],
+                                    p3_23["TI_LUMO"], p3_31["TI_LUMO"], p3_23["TI_LUMO"])
 
     @staticmethod
-    def TextFileToData(path):
+    def loadMinTIs(path):
+        """
+        Read a *_min-TIs-*.txt file once and index its rows by angle.
+        :param path:
+        :return: {Angle: {"name", "Dcol", "Dtrv", "TI_LUMO", "TI_HOMO"}}
+        """
         with open(path, "r") as f:
             lines = f.readlines()
         del lines[0:2]
-        return lines
 
-    def getParameters(self, path):
-        if not os.path.isfile(path):
-            print(f"\t\t{Color.RED}>>> Error: {path} DOES NOT exist in the current directory.{Color.RESET}")
-            self.HelpList.append(True)
-            self.help_check_exit()
-        else:
-            pass
-        with open(path, "r") as f:
-            lines = f.readlines()
-        if lines[4].isspace() and lines[10].isspace():
-            Comment = lines[0].strip()
-            dev = int(lines[1].strip())
-            Dcol = round(float(lines[2].strip()), 3)
-            Dtrv = round(float(lines[3].strip()), 3)
-            TI12 = round(float(lines[5].strip()), 3)
-            TI13 = round(float(lines[6].strip()), 3)
-            TI23 = round(float(lines[7].strip()), 3)
-            TI34 = round(float(lines[8].strip()), 3)
-            TI35 = round(float(lines[9].strip()), 3)
-            Fail = False
+        MinTIs = {}
+        for line in lines:
+            Contents = line.split()
+            try:
+                MinTIs[float(Contents[1])] = {"name": Contents[0].split("_"),
+                                              "Dcol": float(Contents[2]),
+                                              "Dtrv": float(Contents[3]),
+                                              "TI_LUMO": float(Contents[13]),
+                                              "TI_HOMO": float(Contents[15])}
+            except (ValueError, IndexError):
+                pass
+        return MinTIs
+
+    def loadMinTIsSet(self, Files):
+        """
+        Load the -12/-23/-31 files of one structure.
+        :param Files:
+        :return: {"12": {...}, "23": {...}, "31": {...}}
+        """
+        Data = {"12": {}, "23": {}, "31": {}}
+        for File in Files:
+            for Pair in Data:
+                if f"-{Pair}.txt" in File:
+                    Data[Pair] = self.loadMinTIs(File)
+        return Data
+
+    def joinAngles(self, Structure, *Tables):
+        """
+        Angles in `self.Angles` found in every table.
+        :param Structure:
+        :param Tables:
+        :return:
+        """
+        Common = set(self.Angles)
+        for Table in Tables:
+            Common &= Table.keys()
+        Lacks = [Angle for Angle in self.Angles if Angle not in Common]
+        if Lacks:
+            print(f"\t{Color.RED}>>> {Structure}: TI data are missing at {Lacks} deg. (skipped){Color.RESET}")
+        return sorted(Common)
+
+    def mkBandRecord(self, Comment, Dcol, Dtrv, TI12, TI13, TI23, TI34, TI35):
+        """
+        Build the band parameters of one energy band.
+
+        The parameters are handed to the effective mass calculation directly.
+        With `--dat`, they are also written to ./BandInfo/{Comment}.dat in the
+        same layout as before.
+
+        :return: (Dat, Params) where Dat is the entry name used in the EffMasses file.
+        """
+        Dat = f"./BandInfo/{Comment}.dat"
+        Params = {"Comment": Comment, "dev": Constants.n, "Dcol": round(Dcol, 3), "Dtrv": round(Dtrv, 3),
+                  "TI12": round(TI12, 3), "TI13": round(TI13, 3), "TI23": round(TI23, 3),
+                  "TI34": round(TI34, 3), "TI35": round(TI35, 3)}
+        if self.dat:
+            print(f"\t>>> {Comment}.dat: ", end="")
+            with open(Dat, "w") as f:
+                f.write(f"{Comment}\n")
+                f.write(f"{Constants.n}\n")
+                f.write(f"{Dcol}\n")
+                f.write(f"{Dtrv}\n")
+                f.write("\n")
+                f.write(f"{TI12}\n")
+                f.write(f"{TI13}\n")
+                f.write(f"{TI23}\n")
+                f.write(f"{TI34}\n")
+                f.write(f"{TI35}\n")
+                f.write("\n")
+            print("Complete!")
         else:
-            print(f"\t\t{Color.RED}>>> Error: {path} is not a valid file.{Color.RESET}")
-            Fail = True
-            Comment, dev, Dcol, Dtrv, TI12, TI13, TI23, TI34, TI35 = "", 0, 0, 0, 0, 0, 0, 0, 0
-        Params = {"Comment": Comment, "dev": dev, "Dcol": Dcol, "Dtrv": Dtrv, "TI12": TI12, "TI13": TI13, "TI23": TI23,
-                  "TI34": TI34, "TI35": TI35}
-        return Params, Fail
+            print(f"\t>>> {Comment}: Complete!")
+        return Dat, Params
 
     @staticmethod
     def displayDef(Params):
@@ -1074,12 +998,13 @@ class EffectiveMass:
     def Make_Summary_Plots(self, Tilt_Angle):
         FileList = self.List_files(Tilt_Angle)
         FileList.sort()
+        Tasks = []
         for File in FileList:
-            print(f"\t>>> Making plots from {File}: ", end="")
+            print(f"\t>>> Reading data from {File}: ", end="")
             if "min-TIs" in File:
                 Data = self.getMinData(File)
-                self.plot_EvsAngle(Data)
-                self.plot_TIvsAngle(Data)
+                Tasks.append((self.plot_EvsAngle, (Data,), [f"./Figures/EvsAngle/{Data['name']}_EvsAngle.png"]))
+                Tasks.append((self.plot_TIvsAngle, (Data,), [f"./Figures/TIvsAngle/{Data['name']}_TIs.png"]))
             elif "_all.txt" in File:
                 with open(File, "r") as f:
                     lines = f.readlines()
@@ -1099,33 +1024,87 @@ class EffectiveMass:
                 Degs.sort()
                 for Deg in Degs:
                     Data = self.getAllData(File, Deg)
-                    self.plot_AllData(Data)
+                    if self.gif and self.gif_preview:
+                        Outputs = [f"./Figures/AllData/{Data['name']}_preview.gif"]
+                    elif self.gif:
+                        Outputs = [f"./Figures/AllData/{Data['name']}.gif"]
+                    else:
+                        Outputs = [f"./Figures/AllData/{Data['name']}_2D.png", f"./Figures/AllData/{Data['name']}.png"]
+                    Tasks.append((self.plot_AllData, (Data, self.interp), Outputs))
             elif "EffMasses" in File:
                 Structures = ["-B12-", "-B3-"]
                 HOMO_LUMOs = ["HOMO", "LUMO"]
                 for Structure in Structures:
                     for HOMO_LUMO in HOMO_LUMOs:
                         Data = self.getEffMassData(File, Structure, HOMO_LUMO)
-                        self.plot_EffMass(Data, Structure, HOMO_LUMO)
+                        Tasks.append((self.plot_EffMass, (Data, Structure, HOMO_LUMO),
+                                      [f"./Figures/MassvsAngles/{Data['name']}{Structure}{HOMO_LUMO}_MassvsAngle.png"]))
                         if "B12" in Structure:
                             minData1 = self.getMinData(f"./{self.MaterName}_3molp1_{Tilt_Angle}_results/"
                                                        f"{self.MaterName}_3molp1_{Tilt_Angle}_min-TIs-12.txt")
                             minData2 = self.getMinData(f"./{self.MaterName}_3molp2_{Tilt_Angle}_results/"
                                                        f"{self.MaterName}_3molp2_{Tilt_Angle}_min-TIs-12.txt")
                             minEnergy = np.array(minData1["Energy"]) + np.array(minData2["Energy"])
-                            minEnergy = list(minEnergy)
+                            minEnergy = minEnergy.tolist()
                             minAngle = minData1["Angle"]
-                            self.plot_EMassvsAngle(Data, Structure, HOMO_LUMO, minAngle, minEnergy)
                         elif "B3" in Structure:
                             minData3 = self.getMinData(f"./{self.MaterName}_3molp3_{Tilt_Angle}_results/"
                                                        f"{self.MaterName}_3molp3_{Tilt_Angle}_min-TIs-12.txt")
                             minEnergy = np.array(minData3["Energy"]) * 2
-                            minEnergy = list(minEnergy)
+                            minEnergy = minEnergy.tolist()
                             minAngle = minData3["Angle"]
-                            self.plot_EMassvsAngle(Data, Structure, HOMO_LUMO, minAngle, minEnergy)
+                        Tasks.append((self.plot_EMassvsAngle, (Data, Structure, HOMO_LUMO, minAngle, minEnergy),
+                                      [f"./Figures/{Data['name']}{Structure}{HOMO_LUMO}_EMvsAngle.png"]))
 
             print(f"{Color.GREEN}Complete!{Color.RESET}")
 
+        self.RenderFigures(Tasks)
+
+    def RenderFigures(self, Tasks):
+        """
+        Render the summary figures in a process pool.
+
+        Each task is (plot function, arguments, output files). A task is skipped when
+        all of its outputs exist and were made from the same data last time; the
+        hashes are kept in ./Figures/RenderCache.json.
+        :param Tasks:
+        :return:
+        """
+        CachePath = "./Figures/RenderCache.json"
+        if os.path.isfile(CachePath) and not self.replot:
+            with open(CachePath, "r") as f:
+                Cache = json.load(f)
+        else:
+            Cache = {}
+
+        Pending = []
+        Skipped = 0
+        for Func, FuncArgs, Outputs in Tasks:
+            Key = hashlib.sha256(repr((Func.__name__, FuncArgs)).encode()).hexdigest()
+            if all(os.path.isfile(Output) and Cache.get(Output) == Key for Output in Outputs):
+                Skipped += 1
+            else:
+                Pending.append((Func, FuncArgs, Outputs, Key))
+        print(f"\t>>> {len(Pending)} figure sets to render, {Skipped} up to date.")
+
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=plt.switch_backend,
+                                 initargs=("Agg",)) as Executor:
+            Futures = {Executor.submit(Func, *FuncArgs): (Outputs, Key) for Func, FuncArgs, Outputs, Key in Pending}
+            for Future in as_completed(Futures):
+                Outputs, Key = Futures[Future]
+                try:
+                    Future.result()
+                except Exception as e:
+                    print(f"\t{Color.RED}>>> Error: {Outputs[0]}: {e}{Color.RESET}")
+                    continue
+                for Output in Outputs:
+                    Cache[Output] = Key
+                print(f"\t>>> {Outputs[0]}: {Color.GREEN}Complete!{Color.RESET}")
+
+        with open(CachePath, "w") as f:
+            json.dump(Cache, f, indent=1)
+        return None
+
     @staticmethod
     def getMinData(FileName):
         Angle, Dcol, Dtrv, Energy, TI_HOMO, TI_LUMO = [], [], [], [], [], []
@@ -1248,49 +1227,44 @@ class EffectiveMass:
         Data["name"] = f"{filename[filename.rfind('/') + 1:filename.rfind('.txt')]}-{int(Deg)}"
         return Data
 
-    def plot_AllData(self, Data):
+    def plot_AllData(self, Data, Method="linear"):
         x = np.array(Data["Dcol"])
         y = np.array(Data["Dtrv"])
         z = np.array(Data["Energy"])
         name = Data["name"]
 
         if self.gif:
-            fig = plt.figure(figsize=(6, 6))
+            if self.gif_preview:
+                dpi, step, GIFName = 50, 15, f"{name}_preview.gif"
+            else:
+                dpi, step, GIFName = 100, 5, f"{name}.gif"
+            fig = plt.figure(figsize=(6, 6), dpi=dpi)
             ax = fig.add_subplot(111, projection="3d")
             ax.set_title(name, size=20)
             ax.set_xlabel(r"$D_{\mathrm{col}}$", fontsize=10)
             ax.set_ylabel(r"$D_{\mathrm{trv}}$", fontsize=10)
             ax.set_zlabel("Energy", fontsize=10)
             ax.tick_params(axis="both", direction="in", labelsize=8)
+            ax.scatter(x, y, z, c="r", marker="o")
 
-            # Initialize the plot
-            def init():
-                ax.scatter(x, y, z, c="r", marker="o")
-                return ax,
-
-            # Function to rotate the plot
-            def rotate(angle):
+            # 同じ図の視点だけを回転させてフレームを取得
+            Frames = []
+            for angle in range(0, 360, step):
                 ax.view_init(azim=angle)
-                return ax,
-
-            # Create the animation
-            ani = FuncAnimation(
-                fig,
-                rotate,
-                frames=np.arange(0, 360, 5),
-                init_func=init,
-                interval=100,
-                blit=False
-            )
-
-            # Save the animation as a GIF file
-            ani.save(f"./Figures/AllData/{name}.gif", writer="pillow")
+                fig.canvas.draw()
+                Frames.append(Image.fromarray(np.asarray(fig.canvas.buffer_rgba())).convert("RGB"))
+
+            # 最初のフレームのパレットを全フレームで使い回す
+            Palette = Frames[0].quantize(colors=256)
+            Frames = [Palette] + [Frame.quantize(palette=Palette, dither=Image.Dither.NONE) for Frame in Frames[1:]]
+            Frames[0].save(f"./Figures/AllData/{GIFName}", save_all=True, append_images=Frames[1:],
+                           duration=100, loop=0)
         else:
             # グリッドデータを作成
             xi = np.linspace(x.min(), x.max(), 100)
             yi = np.linspace(y.min(), y.max(), 100)
             xi, yi = np.meshgrid(xi, yi)
-            zi = griddata((x, y), z, (xi, yi), method='linear')
+            zi = self.InterpolateEnergy(x, y, z, xi, yi, Method)
 
             # プロット作成
             plt.figure(figsize=(6, 6))
@@ -1324,6 +1298,34 @@ class EffectiveMass:
 
         plt.close()
 
+    @staticmethod
+    def InterpolateEnergy(x, y, z, xi, yi, Method):
+        """
+        Interpolate the energies onto the mesh for the contour plot.
+        :param x: Dcol
+        :param y: Dtrv
+        :param z: Energy
+        :param xi:
+        :param yi:
+        :param Method: "linear", "cubic" or "rbf"
+        :return:
+        """
+        points = np.column_stack((x, y))
+        if Method == "rbf":
+            # 丸めで重なった点はRBFInterpolatorがエラーになるため、最小のエネルギーだけを残す
+            points, Inverse = np.unique(points, axis=0, return_inverse=True)
+            zu = np.full(len(points), np.inf)
+            np.minimum.at(zu, Inverse.ravel(), z)
+            # 凸包の外側も含めて滑らかに補間する
+            Interpolator = RBFInterpolator(points, zu, kernel="thin_plate_spline")
+            return Interpolator(np.column_stack((xi.ravel(), yi.ravel()))).reshape(xi.shape)
+        Triangulation = getTriangulation(points)
+        if Method == "cubic":
+            Interpolator = CloughTocher2DInterpolator(Triangulation, z)
+        else:
+            Interpolator = LinearNDInterpolator(Triangulation, z)
+        return Interpolator(xi, yi)
+
     @staticmethod
     def getEffMassData(filename, Structure, HorL):
         with open(filename, "r") as file:
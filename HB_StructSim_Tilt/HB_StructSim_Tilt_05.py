@@ -7,10 +7,10 @@ import functools
 import glob
 import math
 import os
-import random
 import subprocess
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 
@@ -149,6 +149,20 @@ class Constant:
     CycleCondition_n_02 = 1
     CycleCondition_n_01 = 1
     CycleCondition_n_005 = 1
+    # Phase checkでformchk/cubegenを同時に実行するプロセス数
+    PhaseCheck_Workers = 8
+    # cubeファイルを一度に読み込むバイト数
+    Cube_ChunkSize = 1 << 20
+    # Phase checkで使うボクセルの閾値 (最大値に対する割合)
+    Phase_DensityCut = 0.1
+    # これより信頼度が低い位相判定は警告を出す
+    Phase_MinConfidence = 0.5
+    # tcalで計算する分子ペア (分子番号は1から。Noneにすると Pair_Cutoff 以内で接する全てのペア)
+    TcalPairs = [(1, 2), (2, 3), (3, 1)]
+    # 隣接ペアとみなす分子間の最近接原子間距離 (Angstrom)
+    Pair_Cutoff = 5.0
+    # XYZ_to_Pairsで書き出したペアの一覧 (combineDataでTIの行と照合する)
+    TcalPairList = "TcalPairs.txt"
 
 
 class CheckRequired(argparse.Action):
@@ -195,7 +209,7 @@ def main():
 
     # Calculate the transfer integral
     Calculate_TI(calculation_tcal_Flag, tcal_path, MaterName, Nmol, mol_pos,
-                 Formated_Tilt, Debug, messages, HelpList)
+                 Formated_Tilt, Debug, args, messages, HelpList)
 
     # Save the results
     Result_Data_set(MaterName, Nmol, Formated_Tilt, mol_pos, tcal_path, messages, HelpList)
@@ -287,6 +301,17 @@ def arg_parser(messages, HelpList):
                         help='Create files of any condition')
     parser.add_argument('--energy', '-e',
                         action="store_true")
+    parser.add_argument('--phase',
+                        choices=["cube", "mo"], default="cube",
+                        help="Backend of the phase check.\n"
+                             "\tcube: compare the HOMO/LUMO cube files (cubegen)\n"
+                             "\tmo: compare the MO coefficients in the .fch files")
+    parser.add_argument('--shards',
+                        type=int, default=1,
+                        help="Number of tcal jobs among which the pair xyz files are divided.")
+    parser.add_argument('--local',
+                        help="Run the tcal shards as local processes instead of qsub.",
+                        action="store_true")
 
     # Create a mutually exclusive group that requires one argument
     group = parser.add_mutually_exclusive_group(required=False)
@@ -894,19 +919,7 @@ def Most_Stable_Structure_Search(MaterName, Nmol, mol_pos, Tilt, Formated_Tilt,
             RefLines = getRefLines(f"./{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_min.txt")
             MostStable = CompareStructures(RefLines, temp_Structures[-1])
         MinConditions = getMinConditions(MaterName, Nmol, Formated_Tilt, mol_pos)
-
-        for Condition in MinConditions:
-            command = ["rename", "gjf", "com",
-                       f"{dirpath}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_{Condition}.gjf"]
-            execute(command, False)
-
-            command = ["cp", f"{dirpath}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_{Condition}.com",
-                       f"{tcalpath}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_{Condition}.com"]
-            execute(command, False)
-
-            command = ["rename", "com", "gjf",
-                       f"{dirpath}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_{Condition}.com"]
-            execute(command, False)
+        MinNames = [f"{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_{Condition}" for Condition in MinConditions]
         if len(temp_Structures) < 100:
             with open(f"./{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_mins.hist", "w") as file:
                 for i in range(len(temp_Structures)):
@@ -920,8 +933,8 @@ def Most_Stable_Structure_Search(MaterName, Nmol, mol_pos, Tilt, Formated_Tilt,
         print(f"\n"
               f"\t>>> {Color.GREEN}Local minimum values were successfully found "
               f"at '{len(MinConditions)}' angles.{Color.RESET}\n"
-              f"\t>>> Com files for minimum energies were copied into {tcalpath} folder")
-        mkXYZfile(tcalpath, Debug)
+              f"\t>>> XYZ files for minimum energies are written into {tcalpath} folder")
+        mkXYZfile(dirpath, tcalpath, MinNames, Debug, messages, HelpList)
     return
 
 
@@ -1867,67 +1880,83 @@ def execute(command_list, TEXT, directory=None):
     return
 
 
-def mkXYZfile(tcalpath, Debug):
+def mkXYZfile(dirpath, tcalpath, Names, Debug, messages, HelpList):
     """
-    Make the XYZ file
+    Make the XYZ files for tcal from the .gjf files of the calculation folder
+    :param dirpath: folder of the .gjf files (not changed)
     :param tcalpath:
+    :param Names: file names without the extension
     :param Debug:
+    :param messages:
+    :param HelpList:
     :return:
     """
-    F_paths = glob.glob(f"{tcalpath}/*.com")
     print(f"\n"
           f"**********\n"
           f"Making XYZ files...")
+    F_paths = [f"{dirpath}/{Name}.gjf" for Name in Names]
     if not F_paths:
-        print(f"\t>>> There is NO .com file in the {tcalpath} folder.")
+        print(f"\t>>> There is NO .gjf file for the minimum energies in the {dirpath} folder.")
         return
+    # 1つでも欠けていればtcalを欠けたままの組で実行しない
+    Lacks = [F_path for F_path in F_paths if not os.path.exists(F_path)]
+    if Lacks:
+        for F_path in Lacks:
+            messages.append(f"\t{Color.RED}>>> {F_path}: NOT Found{Color.RESET}")
+        messages.append(f"\t>>> XYZ files for the minimum energies were NOT made.")
+        HelpList.append(True)
+        help_check_exit(messages, HelpList)
 
+    os.makedirs(tcalpath, exist_ok=True)
     for F_path in F_paths:
-        process_file(F_path)
-
-    ComFileNames = glob.glob(f"{tcalpath}/*.com")
-    XYZFileNameList = []
-    for ComFileName in ComFileNames:
-        FormatedComfn = (ComFileName[:-4]).strip().split("/")[-1]
-        XYZFileName = f"{FormatedComfn}.xyz"
+        XYZFileName = f"{tcalpath}/{os.path.basename(F_path)[:-4]}.xyz"
         if Debug:
-            print(f"{ComFileName} -> {XYZFileName}")
-        XYZFileNameList.append(XYZFileName)
-        subprocess.run(["newzmat", "-icart", "-oxyz", FormatedComfn, XYZFileName], timeout=2, cwd=tcalpath)
-    Ls = []
-    for XYZFileName in XYZFileNameList:
-        with open(f"{tcalpath}/{XYZFileName}", "r") as xyzf:
-            lines = xyzf.readlines()
-        Ls.append(len(lines))
-        with open(f"{tcalpath}/{XYZFileName}", "w") as xyzf:
-            xyzf.write(f"{len(lines)}\n")
+            print(f"{F_path} -> {XYZFileName}")
+        Elements, Coordinates = ReadGjf(F_path)
+        with open(XYZFileName, "w") as xyzf:
+            xyzf.write(f"{len(Elements)}\n")
             xyzf.write("00000001\n")
-            for line in lines:
-                xyzf.write(line)
-    print(f"\t>>> {tcalpath}/*.xyz: {Color.GREEN}Created!!{Color.RESET} ({len(Ls)} files)")
+            xyzf.writelines(f" {elem:<2}  {format_coordinate(pos)}\n" for elem, pos in zip(Elements, Coordinates))
+    print(f"\t>>> {tcalpath}/*.xyz: {Color.GREEN}Created!!{Color.RESET} ({len(F_paths)} files)")
     return
 
 
-def process_file(F_path):
+def ReadGjf(F_path):
     """
-    Process the file
+    Read the atoms of the Gaussian input file (.com/.gjf)
     :param F_path:
-    :return:
+    :return: elements, coordinates (N x 3 array)
     """
     with open(F_path, "r") as f:
-        lines = f.readlines()
-    new_lines = [
-        line.replace("X", "C") if line.strip().split() and line.strip().split()[0] == "X"
-        else line
-        for line in lines
-    ]
-    with open(F_path[:-4] + ".com", "w") as file:
-        file.writelines(new_lines)
-    return
+        lines = f.read().splitlines()
+
+    # Link0 (%), route section, title, charge and multiplicity, atoms の順
+    i = 0
+    while not lines[i].strip() or lines[i].lstrip().startswith("%"):
+        i += 1
+    Blanks = 0
+    while Blanks < 2:  # the route section and the title end with a blank line
+        if not lines[i].strip():
+            Blanks += 1
+        i += 1
+    i += 1  # charge and multiplicity
+
+    Atoms = []
+    for line in lines[i:]:
+        if not line.strip():
+            break
+        Atoms.append(line.split())
+
+    # "C(Fragment=1)" などのタグを除き, ダミー原子 X は C として扱う
+    Elements = [Atom[0].split("(")[0] for Atom in Atoms]
+    Elements = ["C" if elem == "X" else elem for elem in Elements]
+    # 末尾のフラグメント番号は読まない
+    Coordinates = np.array([Atom[1:4] for Atom in Atoms], dtype=float)
+    return Elements, Coordinates
 
 
 def Calculate_TI(calculation_tcal_flag, tcal_path, MaterName, Nmol, mol_pos,
-                 Formated_Tilt, Debug, messages, HelpList):
+                 Formated_Tilt, Debug, args, messages, HelpList):
     if calculation_tcal_flag or "2mol" in Nmol:
         pass
     else:
@@ -1936,84 +1965,141 @@ def Calculate_TI(calculation_tcal_flag, tcal_path, MaterName, Nmol, mol_pos,
         if not os.path.exists(f"./{tcal_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_tcal.log"):
             qsubList = []
             XYZs = glob.glob(f"{tcal_path}/*.xyz")
+            StalePairs = PairXYZs(tcal_path)
             for XYZ in XYZs:
-                if "_m1.xyz" in XYZ or "_m2.xyz" in XYZ or "-12.xyz" in XYZ or "-23.xyz" in XYZ or "-31.xyz" in XYZ:
+                if ("_m1.xyz" in XYZ or "_m2.xyz" in XYZ or "-12.xyz" in XYZ or "-23.xyz" in XYZ or "-31.xyz" in XYZ
+                        or XYZ in StalePairs):
                     XYZ = XYZ.replace("./", "")
                     os.remove(f"{XYZ}")
                 else:
                     pass
-            XYZ_3mol_to_XYZ_2mol(tcal_path, Debug, messages, HelpList)
+            XYZ_3mol_to_XYZ_2mol(tcal_path, MaterName, Debug, messages, HelpList)
 
-            with open(f"{tcal_path}/tcal.sh", "w") as f:
-                f.write(Stereotyped.tcal_sh_txt)
-            qsubList.append("qsub tcal.sh")
-            job_submission(messages, HelpList, qsubList, tcal_path, Nmol, "tcal")
+            if args.shards <= 1 and not args.local:
+                with open(f"{tcal_path}/tcal.sh", "w") as f:
+                    f.write(Stereotyped.tcal_sh_txt)
+                qsubList.append("qsub tcal.sh")
+                job_submission(messages, HelpList, qsubList, tcal_path, Nmol, "tcal")
+            else:
+                ShardDirs = ShardTcal(tcal_path, args.shards)
+                if args.local:
+                    runTcalLocal(tcal_path, ShardDirs)
+                else:
+                    for ShardDir in ShardDirs:
+                        with open(f"{tcal_path}/{ShardDir}.sh", "w") as f:
+                            f.write(Stereotyped.tcal_sh_txt.replace("tcal *.xyz\n", f"cd {ShardDir}\ntcal *.xyz\n"))
+                        qsubList.append(f"qsub {ShardDir}.sh")
+                    job_submission(messages, HelpList, qsubList, tcal_path, Nmol, "tcal")
+                MergeTcal(tcal_path, ShardDirs, messages, HelpList)
             if Debug:
                 pass
             else:
                 rmWildCards(f"{tcal_path}/*.sh*")
             subprocess.run(["rename", "tcal", f"{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_tcal", "tcal.log"],
                            cwd=tcal_path)
-            readlog(tcal_path, MaterName, Nmol, mol_pos, Formated_Tilt, messages, HelpList)
+            if readlog(tcal_path, MaterName, Nmol, mol_pos, Formated_Tilt, messages, HelpList):
+                message_show(messages)
         else:
             print(f"\t>>> tcal.log: {Color.GREEN}Already exists!!{Color.RESET}")
             print(f"\t>>> {Color.GREEN}Calculation of transfer integrals was skipped.{Color.RESET}")
     # Phase check
-    PhaseCheck(tcal_path, Debug)
+    PhaseCheck(tcal_path, Debug, args.phase)
+    return
+
+
+def ShardTcal(tcal_path, Shards):
+    """
+    Distribute the xyz files into the shard folders (tcal_01, tcal_02, ...) in alphabetical order
+    :param tcal_path:
+    :param Shards: number of shards
+    :return: shard folders
+    """
+    XYZs = sorted(os.path.basename(XYZ) for XYZ in glob.glob(f"{tcal_path}/*.xyz"))
+    Shards = max(1, min(Shards, len(XYZs)))
+    ShardDirs = []
+    for i, Files in enumerate(np.array_split(XYZs, Shards), start=1):
+        ShardDir = f"tcal_{i:02d}"
+        os.makedirs(f"{tcal_path}/{ShardDir}", exist_ok=True)
+        for File in Files:
+            os.replace(f"{tcal_path}/{File}", f"{tcal_path}/{ShardDir}/{File}")
+        ShardDirs.append(ShardDir)
+    print(f"\t>>> {len(XYZs)} xyz files are divided into {len(ShardDirs)} shards.")
+    return ShardDirs
+
+
+def runTcalLocal(tcal_path, ShardDirs):
+    """
+    Run tcal for every shard at the same time on this machine
+    :param tcal_path:
+    :param ShardDirs:
+    :return:
+    """
+    print(f"\t>>> tcal is running in {len(ShardDirs)} local processes...")
+    Procs = []
+    for ShardDir in ShardDirs:
+        with open(f"{tcal_path}/{ShardDir}.sh.o", "w") as out:
+            Procs.append(subprocess.Popen("tcal *.xyz", shell=True, cwd=f"{tcal_path}/{ShardDir}",
+                                          stdout=out, stderr=subprocess.STDOUT))
+    for Proc in Procs:
+        Proc.wait()
+    return
+
+
+def MergeTcal(tcal_path, ShardDirs, messages, HelpList):
+    """
+    Merge the logs of the shards into tcal.log in order and move the results back to tcal_path
+    :param tcal_path:
+    :param ShardDirs:
+    :param messages:
+    :param HelpList:
+    :return:
+    """
+    # tcal.logが1つでも欠けていれば結合しない (結合したtcal.logがあると再計算されないため)
+    Lacks = [ShardDir for ShardDir in ShardDirs if not os.path.exists(f"{tcal_path}/{ShardDir}/tcal.log")]
+    if Lacks:
+        for ShardDir in Lacks:
+            messages.append(f"\t>>> {Color.RED}Error: {tcal_path}/{ShardDir}/tcal.log was NOT found.{Color.RESET}")
+        messages.append(f"\t>>> tcal.log was NOT written. The shard folders were kept as they are.")
+        HelpList.append(True)
+        help_check_exit(messages, HelpList)
+
+    with open(f"{tcal_path}/tcal.log", "w") as Log:
+        for ShardDir in ShardDirs:
+            ShardLog = f"{tcal_path}/{ShardDir}/tcal.log"
+            with open(ShardLog, "r") as f:
+                Log.writelines(f)
+            os.remove(ShardLog)
+            for File in os.listdir(f"{tcal_path}/{ShardDir}"):
+                os.replace(f"{tcal_path}/{ShardDir}/{File}", f"{tcal_path}/{File}")
+            os.rmdir(f"{tcal_path}/{ShardDir}")
+    print(f"\t>>> Logs of {len(ShardDirs)} shards -> tcal.log: {Color.GREEN}Merged!!{Color.RESET}")
     return
 
 
-def XYZ_3mol_to_XYZ_2mol(tcal_path, Debug, messages, HelpList):
-    filepaths = glob.glob(f"{tcal_path}/*_3mol*.xyz")
+def XYZ_3mol_to_XYZ_2mol(tcal_path, MaterName, Debug, messages, HelpList):
+    filepaths = sorted(glob.glob(f"{tcal_path}/*_3mol*.xyz"))
+    # 1分子の原子数 (クラスターの分子数は原子数から求める)
+    with open(f"./{MaterName}.xyz", "r") as f:
+        Atoms_inMol = int(float(f.readline()))
 
-    Faults = []
+    Faults, PairNames = [], []
     print("\nConverting 3mol to 2mol XYZ files...")
     for filepath in filepaths:
-        Mol1, Mol2, Mol3 = [], [], []
-        filecore = filepath[:-4]
-        with open(filepath, "r") as f:
-            # Read the first line ( the number of atoms )
-            number_atoms = f.readline()
-            Comment = f.readline()
-            coordinates = f.readlines()
         if Debug:
             messages.append("\t>>> " + filepath.strip())
-            messages.append(f"\t>>> Number of atoms: {number_atoms.strip()}")
 
-        if int(float(number_atoms)) % 3 != 0:
+        PairFiles = XYZ_to_Pairs(filepath, Atoms_inMol, messages, HelpList, Constant.TcalPairs, Constant.Pair_Cutoff)
+        if PairFiles is None:
             Faults.append(filepath)
-            messages.append(f"\t>>> {Color.RED}Error: {filepath} did not divide by 3.{Color.RESET}")
         else:
-            Atoms_inMol = int(round(float(number_atoms) / 3, 5))
-            for i in range(Atoms_inMol):
-                Mol1.append(coordinates[i])
-                Mol2.append(coordinates[i + Atoms_inMol])
-                Mol3.append(coordinates[i + 2 * Atoms_inMol])
-            Atoms_in_TcalXYZFile = int(round(Atoms_inMol * 2, 3))
-
-            with open(f"{filecore}-12.xyz", "w") as newF12, open(f"{filecore}-23.xyz", "w") as newF23, open(
-                    f"{filecore}-31.xyz", "w") as newF31:
-                newF12.write(f"{Atoms_in_TcalXYZFile}\n"
-                             f"{Comment}")
-                newF23.write(f"{Atoms_in_TcalXYZFile}\n"
-                             f"{Comment}")
-                newF31.write(f"{Atoms_in_TcalXYZFile}\n"
-                             f"{Comment}")
-                for i in range(Atoms_inMol):
-                    newF12.write(Mol1[i])
-                    newF23.write(Mol2[i])
-                    newF31.write(Mol3[i])
-                for i in range(Atoms_inMol):
-                    newF12.write(Mol2[i])
-                    newF23.write(Mol3[i])
-                    newF31.write(Mol1[i])
-            messages.append(f"\t>>> {filecore}-12.xyz: Created!!")
-            messages.append(f"\t>>> {filecore}-23.xyz: Created!!")
-            messages.append(f"\t>>> {filecore}-31.xyz: Created!!")
-            os.rename(filepath, f"{filecore}.all")
+            for PairFile in PairFiles:
+                messages.append(f"\t>>> {PairFile}: Created!!")
+                PairNames.append(os.path.basename(PairFile)[:-4])
+            os.rename(filepath, f"{filepath[:-4]}.all")
+    with open(f"{tcal_path}/{Constant.TcalPairList}", "w") as f:
+        f.writelines(f"{PairName}\n" for PairName in PairNames)
     if len(Faults) != 0:
-        for Fault in Faults:
-            messages.append(f"\t>>> {Color.RED}Error: {Fault} did not divide by 3.{Color.RESET}")
+        messages.append(f"\t>>> {Color.RED}Error: {len(Faults)} xyz files were NOT split into pairs.{Color.RESET}")
         HelpList.append(True)
     else:
         messages.append(f"\n\t>>> {Color.GREEN}XYZ 3mol to 2mol: Succeeded!!{Color.RESET}")
@@ -2021,27 +2107,111 @@ def XYZ_3mol_to_XYZ_2mol(tcal_path, Debug, messages, HelpList):
     return
 
 
-def readlog(tcal_path, MaterName, Nmol, mol_pos, Formated_Tilt, messages, HelpList):
-    print(f"\nReading the Tcal log file...")
-    filepath = f"{tcal_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_tcal.log"
-    with open(filepath, "r") as file:
-        lines = file.readlines()
+def XYZ_to_Pairs(filepath, Atoms_inMol, messages, HelpList, Pairs=None, Cutoff=None):
+    """
+    Split the xyz file of a cluster into the xyz files of molecular pairs
+    :param filepath: xyz file of molecules with the same atom order
+    :param Atoms_inMol: number of atoms in one molecule
+    :param messages:
+    :param HelpList:
+    :param Pairs: molecule numbers (from 1) of the pairs, e.g. [(1, 2), (2, 3), (3, 1)].
+                  If None, all pairs whose closest atoms are within Cutoff are written.
+    :param Cutoff: Angstrom (Constant.Pair_Cutoff if None)
+    :return: created files (None if the cluster or the pairs are not valid)
+    """
+    with open(filepath, "r") as f:
+        number_atoms = int(float(f.readline()))
+        Comment = f.readline()
+        coordinates = [line for line in f if line.strip()]
+    if len(coordinates) != number_atoms or number_atoms % Atoms_inMol != 0 or number_atoms < Atoms_inMol * 2:
+        messages.append(f"\t>>> {Color.RED}Error: {filepath} could not be divided into molecules of {Atoms_inMol} "
+                        f"atoms ({len(coordinates)} atoms, {number_atoms} in the header).{Color.RESET}")
+        HelpList.append(True)
+        return None
+
+    NumMol = number_atoms // Atoms_inMol
+    Blocks = ["".join(coordinates[i * Atoms_inMol:(i + 1) * Atoms_inMol]) for i in range(NumMol)]
+
+    if Pairs is None:
+        Cutoff = Constant.Pair_Cutoff if Cutoff is None else Cutoff
+        # 全ての原子間距離から分子間の最近接距離を求める
+        Positions = np.array([line.split()[1:4] for line in coordinates], dtype=float)
+        Distances = np.linalg.norm(Positions[:, None, :] - Positions[None, :, :], axis=-1)
+        Contacts = Distances.reshape(NumMol, Atoms_inMol, NumMol, Atoms_inMol).min(axis=(1, 3))
+        Pairs = [(i + 1, j + 1) for i, j in zip(*np.triu_indices(NumMol, 1)) if Contacts[i, j] <= Cutoff]
+        if NumMol == 3:
+            # 3分子ではバンドの計算が読む -12, -23, -31 の向きにそろえる
+            Pairs = [(3, 1) if Pair == (1, 3) else Pair for Pair in Pairs]
+    else:
+        Invalid = [(i, j) for i, j in Pairs if not (1 <= i <= NumMol and 1 <= j <= NumMol) or i == j]
+        if Invalid:
+            messages.append(f"\t>>> {Color.RED}Error: The pairs {Invalid} do not exist in {filepath} "
+                            f"({NumMol} molecules).{Color.RESET}")
+            HelpList.append(True)
+            return None
 
-    DataList = []
-    keywords = ["Input File Name:", "NLUMO", "LUMO", "HOMO", "NHOMO"]
-    for line in lines:
-        for keyword in keywords:
-            if keyword in line:
-                DataList.append(line)
-                break
+    PairFiles = []
+    for i, j in Pairs:
+        PairFile = f"{filepath[:-4]}{PairName(i, j, NumMol)}.xyz"
+        with open(PairFile, "w") as f:
+            f.write(f"{Atoms_inMol * 2}\n{Comment}{Blocks[i - 1]}{Blocks[j - 1]}")
+        PairFiles.append(PairFile)
+    return PairFiles
 
-    if len(DataList) % 5 != 0:
-        print(f"\t>>> {Color.RED}Error: UNEXPECTED ERROR in read Tcal log process.{Color.RESET}")
-        HelpList.append(True)
-        help_check_exit(messages, HelpList)
 
+def PairName(i, j, NumMol):
+    """
+    Suffix of the pair xyz file: -12 for up to 9 molecules, -0112 for 10 to 99 molecules
+    :param i:
+    :param j:
+    :param NumMol:
+    :return:
+    """
+    Width = len(str(NumMol))
+    return f"-{i:0{Width}d}{j:0{Width}d}"
+
+
+def TcalPairNames(tcal_path):
+    """
+    Names of the pairs written by XYZ_3mol_to_XYZ_2mol (the input file names in the tcal log)
+    :param tcal_path:
+    :return: list of names, or None if the list was not written
+    """
+    if not os.path.exists(f"{tcal_path}/{Constant.TcalPairList}"):
+        return None
+    with open(f"{tcal_path}/{Constant.TcalPairList}", "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def PairXYZs(tcal_path):
+    """
+    Pair xyz files written by XYZ_to_Pairs (one tcal result each)
+    :param tcal_path:
+    :return:
+    """
+    return [f"{tcal_path}/{Name}.xyz" for Name in TcalPairNames(tcal_path) or []
+            if os.path.exists(f"{tcal_path}/{Name}.xyz")]
+
+
+def readlog(tcal_path, MaterName, Nmol, mol_pos, Formated_Tilt, messages, HelpList):
+    """
+    Read the tcal log line by line and write the transfer integrals of every input file
+    :param tcal_path:
+    :param MaterName:
+    :param Nmol:
+    :param mol_pos:
+    :param Formated_Tilt:
+    :param messages:
+    :param HelpList:
+    :return: failed pairs [(input file, missing keywords)]
+    """
+    print(f"\nReading the Tcal log file...")
+    filepath = f"{tcal_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_tcal.log"
     output_filepath = f"{tcal_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_TIs.txt"
-    with open(output_filepath, "w") as file:
+    Keywords = ("NLUMO", "LUMO", "HOMO", "NHOMO")
+
+    Failed = []
+    with open(filepath, "r") as log, open(output_filepath, "w") as file:
         header = (f"***** Transfer Integrals in "
                   f"{tcal_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_tcal.log *****\n")
         columns = "input file\tNLUMO (meV)\tLUMO (meV)\tHOMO (meV)\tNHOMO (meV)\n"
@@ -2049,22 +2219,60 @@ def readlog(tcal_path, MaterName, Nmol, mol_pos, Formated_Tilt, messages, HelpLi
         print(header.strip())
         print(columns.strip())
 
-        for i in range(0, len(DataList), 5):
-            input_file = DataList[i].split(": ")[1].split(".xyz")[0]
-            NLUMO = extract_value(DataList[i + 1], "NLUMO")
-            LUMO = extract_value(DataList[i + 2], "LUMO")
-            HOMO = extract_value(DataList[i + 3], "HOMO")
-            NHOMO = extract_value(DataList[i + 4], "NHOMO")
-            file.write(f"{input_file}\t{NLUMO}\t{LUMO}\t{HOMO}\t{NHOMO}\n")
-            print(f"{input_file}\t{NLUMO}\t{LUMO}\t{HOMO}\t{NHOMO}")
-    return
-
-
-def extract_value(line, keyword):
-    return float(line.split(keyword)[-1].split()[0])
+        for input_file, Values in TcalBlocks(log):
+            # 値が見つからなかったものは nan として書き込む
+            Row = "\t".join(str(Values.get(Keyword, float("nan"))) for Keyword in Keywords)
+            file.write(f"{input_file}\t{Row}\n")
+            file.flush()
+            print(f"{input_file}\t{Row}")
+            if len(Values) < len(Keywords):
+                Failed.append((input_file, [Keyword for Keyword in Keywords if Keyword not in Values]))
+
+    if Failed:
+        messages.append(f"\t>>> {Color.RED}Warning: Transfer integrals of {len(Failed)} pairs were NOT found "
+                        f"(written as nan and excluded in combineData).{Color.RESET}")
+        for input_file, Missing in Failed:
+            messages.append(f"\t\t{input_file}: {', '.join(Missing)}")
+    return Failed
+
+
+def TcalBlocks(log):
+    """
+    Split the tcal log into the blocks of "Input File Name:"
+    :param log: opened tcal log
+    :return: generator of (input file, {keyword: value})
+    """
+    input_file, Values = None, {}
+    for line in log:
+        if "Input File Name:" in line:
+            if input_file is not None:
+                yield input_file, Values
+            input_file, Values = line.split("Input File Name:")[1].strip().split(".xyz")[0], {}
+        elif input_file is not None:
+            Value = extract_value(line)
+            if Value is not None and Value[0] not in Values:
+                Values[Value[0]] = Value[1]
+    if input_file is not None:
+        yield input_file, Values
+
+
+def extract_value(line):
+    """
+    Keyword (NLUMO, LUMO, HOMO or NHOMO) and the value after it in a line of the tcal log
+    :param line:
+    :return: (keyword, value) or None
+    """
+    Words = line.split()
+    for Keyword, Value in zip(Words, Words[1:]):
+        if Keyword in ("NLUMO", "LUMO", "HOMO", "NHOMO"):
+            try:
+                return Keyword, float(Value)
+            except ValueError:
+                pass
+    return None
 
 
-def PhaseCheck(tcal_path, Debug):
+def PhaseCheck(tcal_path, Debug, Phase):
     print("\n**********\nPhase Checking...")
     chkKEY = "-12"
     CalCores = mkCalCoreList(tcal_path, chkKEY)
@@ -2072,16 +2280,19 @@ def PhaseCheck(tcal_path, Debug):
         print(f"\t>>> Any chk file is NOT found in the specified folder.\n"
               f"\t>>> The process for phase check was {Color.GREEN}skipped.{Color.RESET}")
     else:
+        CalCores.sort()
+        print(f"\t>>> {len(CalCores)} pairs are checked in {Constant.PhaseCheck_Workers} processes "
+              f"(backend: {Phase}).")
         with open(f"{tcal_path}/PhaseCheck.txt", "w") as file:
-            file.write("Name\tfor LUMO\tfor HOMO\n")
-            for CalCore in CalCores:
-                mkCubeFile(tcal_path, f"{CalCore}_m1.chk")
-                mkCubeFile(tcal_path, f"{CalCore}_m2.chk")
-
-                HomoChk = ComparePhase(tcal_path, CalCore, "HOMO")
-                LumoChk = ComparePhase(tcal_path, CalCore, "LUMO")
-
-                file.write(f"{CalCore}\t{LumoChk}\t{HomoChk}\n")
+            file.write("Name\tfor LUMO\tfor HOMO\tConfidence (LUMO)\tConfidence (HOMO)\n")
+            file.flush()
+            with ProcessPoolExecutor(max_workers=Constant.PhaseCheck_Workers) as executor:
+                futures = [executor.submit(PhaseCheckCore, tcal_path, CalCore, Phase) for CalCore in CalCores]
+                # 終わったものから書き込む
+                for future in as_completed(futures):
+                    CalCore, (LumoChk, LumoConf), (HomoChk, HomoConf) = future.result()
+                    file.write(f"{CalCore}\t{LumoChk}\t{HomoChk}\t{LumoConf}\t{HomoConf}\n")
+                    file.flush()
         if Debug:
             pass
         else:
@@ -2091,6 +2302,29 @@ def PhaseCheck(tcal_path, Debug):
     return
 
 
+def PhaseCheckCore(tcal_path, CalCore, Phase):
+    """
+    Phase check of one pair: formchk (and cubegen) for both monomers and comparison of the orbitals
+    :param tcal_path:
+    :param CalCore:
+    :param Phase: "cube" (cube files) or "mo" (MO coefficients)
+    :return: CalCore, (phase, confidence) for LUMO, (phase, confidence) for HOMO
+    """
+    if Phase == "mo":
+        MOs1 = ReadFchMOs(tcal_path, f"{CalCore}_m1.chk")
+        MOs2 = ReadFchMOs(tcal_path, f"{CalCore}_m2.chk")
+
+        HomoChk = CompareMOPhase(CalCore, "HOMO", MOs1, MOs2)
+        LumoChk = CompareMOPhase(CalCore, "LUMO", MOs1, MOs2)
+    else:
+        mkCubeFile(tcal_path, f"{CalCore}_m1.chk")
+        mkCubeFile(tcal_path, f"{CalCore}_m2.chk")
+
+        HomoChk = ComparePhase(tcal_path, CalCore, "HOMO")
+        LumoChk = ComparePhase(tcal_path, CalCore, "LUMO")
+    return CalCore, LumoChk, HomoChk
+
+
 def mkCalCoreList(tcal_path, chkKEY):
     FileList = glob.glob(f"{tcal_path}/*{chkKEY}*")
     CalCores = []
@@ -2122,55 +2356,176 @@ def mkCubeFile(tcal_path, chkfile):
 
 def ComparePhase(tcal_path, CalCore, HomoLumo):
     """
-
+    Phase of the m2 orbital relative to the m1 orbital from the signed overlap over the high-density voxels
     :param tcal_path:
     :param CalCore:
     :param HomoLumo:
-    :return:
+    :return: phase ("Same" or "Opposit") and its confidence (normalized overlap, 0-1)
     """
     Val1 = ReadCube(tcal_path, f"{CalCore}_m1_{HomoLumo}.cub")
     Val2 = ReadCube(tcal_path, f"{CalCore}_m2_{HomoLumo}.cub")
 
     if len(Val1) != len(Val2):
-        return "not available(1) (Different number of grids in the file)"
-
-    PClist = []
-    print(f"{CalCore} {HomoLumo} Data Excerpt")
-    for i in random.sample(range(len(Val1)), min(20, len(Val1))):
-        if abs(Val1[i]) > 1e-7:
-            Val = Val1[i] * Val2[i]
-            print(f"m1 value = {Val1[i]}\tm2 value = {Val2[i]}")
-            PClist.append("Opposit" if Val < 0 else "Same")
-
-    PC = list(set(PClist))
-    if len(PC) == 1:
-        return PC[0]
-    elif len(PC) > 1:
-        return "not available(2)"
-    else:
-        return "not available(3)"
+        print(f"\t>>> {CalCore} {HomoLumo}: {Color.RED}Different number of grids in the file{Color.RESET}")
+        return "not_available(1)", 0.0
+
+    # m1, m2のどちらかで電子密度が大きいボクセルだけを使う
+    Density = np.maximum(np.abs(Val1), np.abs(Val2))
+    Mask = Density >= Constant.Phase_DensityCut * Density.max()
+    Val1 = Val1[Mask].astype(np.float64)
+    Val2 = Val2[Mask].astype(np.float64)
+
+    Overlap = np.dot(Val1, Val2)
+    Norm = np.sqrt(np.dot(Val1, Val1) * np.dot(Val2, Val2))
+    if Norm == 0 or Overlap == 0:
+        return "not_available(3)", 0.0
+
+    Confidence = round(abs(Overlap) / Norm, 3)
+    PC = "Opposit" if Overlap < 0 else "Same"
+    print(f"{CalCore} {HomoLumo}: {PC} (overlap = {Overlap:.4e}, confidence = {Confidence}, "
+          f"{np.count_nonzero(Mask)} voxels)")
+    if Confidence < Constant.Phase_MinConfidence:
+        print(f"\t>>> {Color.YELLOW}Warning: Low confidence in the phase of {CalCore} {HomoLumo}{Color.RESET}")
+    return PC, Confidence
+
+
+def ReadFch(fchfile, Keys):
+    """
+    Read the requested sections of the formatted checkpoint file
+    :param fchfile:
+    :param Keys: names of the sections (e.g. "Alpha MO coefficients")
+    :return: dict of the section name and its value (int, float or NumPy array)
+    """
+    Sections = {}
+    with open(fchfile, "r") as file:
+        for line in file:
+            Key = line[:40].strip()
+            if Key not in Keys:
+                continue
 
+            Fields = line[40:].split()
+            dtype = int if Fields[0] == "I" else float
+            if Fields[1] == "N=":
+                # 配列: I は1行に6個, R は1行に5個
+                Num = int(Fields[2])
+                NumLines = -(-Num // (6 if dtype is int else 5))
+                Text = "".join(next(file) for _ in range(NumLines))
+                Sections[Key] = np.fromstring(Text, dtype=dtype, sep=" ")
+            else:
+                Sections[Key] = dtype(Fields[1])
 
-def ReadCube(tcal_path, Cubefile):
+            if len(Sections) == len(Keys):
+                break
+    return Sections
+
+
+def ReadFchMOs(tcal_path, chkfile):
+    """
+    HOMO and LUMO coefficients of the monomer from the formatted checkpoint file
+    :param tcal_path:
+    :param chkfile:
+    :return: dict of the HOMO/LUMO coefficients and the atom of each basis function
+    """
+    print(f"For {chkfile} ...")
+    fchk = f"{chkfile[:-4]}.fch"
+    subprocess.run(["formchk", chkfile, fchk], cwd=tcal_path, timeout=1000)
+    print(f"\tFile Conversion ({chkfile} -> {fchk}): {Color.GREEN}Completed!!{Color.RESET}")
+
+    Fch = ReadFch(f"{tcal_path}/{fchk}", {"Number of alpha electrons", "Number of basis functions",
+                                          "Shell types", "Shell to atom map", "Alpha MO coefficients"})
+    subprocess.run(["rm", fchk], cwd=tcal_path, timeout=10)
+
+    NAlpha = Fch["Number of alpha electrons"]
+    Coeffs = Fch["Alpha MO coefficients"].reshape(-1, Fch["Number of basis functions"])
+
+    # 殻の種類ごとの基底関数の数 (0: S, 1: P, -1: SP, 2: 6D, -2: 5D, ...)
+    ShellTypes = Fch["Shell types"]
+    NumFunctions = np.where(ShellTypes >= 0, (ShellTypes + 1) * (ShellTypes + 2) // 2,
+                            np.where(ShellTypes == -1, 4, 2 * np.abs(ShellTypes) + 1))
+    BasisAtoms = np.repeat(Fch["Shell to atom map"], NumFunctions)
+    return {"HOMO": Coeffs[NAlpha - 1], "LUMO": Coeffs[NAlpha], "Atoms": BasisAtoms}
+
+
+def CompareMOPhase(CalCore, HomoLumo, MOs1, MOs2):
     """
+    Phase of the m2 orbital relative to the m1 orbital from the dot product of the MO coefficients
+    :param CalCore:
+    :param HomoLumo:
+    :param MOs1: ReadFchMOs of m1
+    :param MOs2: ReadFchMOs of m2
+    :return: phase ("Same" or "Opposit") and its confidence (normalized overlap, 0-1)
+    """
+    if not np.array_equal(MOs1["Atoms"], MOs2["Atoms"]):
+        print(f"\t>>> {CalCore} {HomoLumo}: {Color.RED}Different basis functions in the file{Color.RESET}")
+        return "not_available(1)", 0.0
+
+    Coeff1 = MOs1[HomoLumo]
+    Coeff2 = MOs2[HomoLumo]
+    # m1, m2のどちらかで係数が大きい基底関数だけを使う
+    Weight = np.maximum(np.abs(Coeff1), np.abs(Coeff2))
+    Mask = Weight >= Constant.Phase_DensityCut * Weight.max()
+    Coeff1 = Coeff1[Mask]
+    Coeff2 = Coeff2[Mask]
+
+    Overlap = np.dot(Coeff1, Coeff2)
+    Norm = np.sqrt(np.dot(Coeff1, Coeff1) * np.dot(Coeff2, Coeff2))
+    if Norm == 0 or Overlap == 0:
+        return "not_available(3)", 0.0
+
+    Confidence = round(abs(Overlap) / Norm, 3)
+    PC = "Opposit" if Overlap < 0 else "Same"
+    print(f"{CalCore} {HomoLumo}: {PC} (overlap = {Overlap:.4e}, confidence = {Confidence}, "
+          f"{len(np.unique(MOs1['Atoms'][Mask]))} atoms)")
+    if Confidence < Constant.Phase_MinConfidence:
+        print(f"\t>>> {Color.YELLOW}Warning: Low confidence in the phase of {CalCore} {HomoLumo}{Color.RESET}")
+    return PC, Confidence
+
+
+def ReadCubeHeader(file):
+    """
+    Read the header of the cube file up to the volumetric data
+    :param file: opened cube file
+    :return: the number of grids in x, y and z
+    """
+    for _ in range(2):  # skip the first two lines (comments)
+        next(file)
+
+    NumAtoms = int(next(file).split()[0])
+    Xgrid, Ygrid, Zgrid = (int(next(file).split()[0]) for _ in range(3))
+    for _ in range(abs(NumAtoms)):  # skip the atoms
+        next(file)
+    if NumAtoms < 0:
+        # MO cube: the number of MOs and their indices follow the atoms
+        MOs = next(file).split()
+        while len(MOs) < int(MOs[0]) + 1:
+            MOs += next(file).split()
+    return Xgrid, Ygrid, Zgrid
 
+
+def ReadCube(tcal_path, Cubefile):
+    """
+    Read the volumetric data of the cube file into a float32 array
     :param tcal_path:
     :param Cubefile:
     :return:
     """
     with open(f"{tcal_path}/{Cubefile}", "r") as file:
-        for _ in range(2):  # skip the first two lines (comment and number of atoms)
-            next(file)
-
-        NumE, Xgrid, Ygrid, Zgrid = (int(next(file).split()[0]) for _ in range(4))
-        for _ in range(NumE):  # skip the number of electrons
-            next(file)
-
-        values = [float(x) for _ in range(Xgrid * Ygrid)
-                  for line in file for x in line.split()]
+        Xgrid, Ygrid, Zgrid = ReadCubeHeader(file)
+        NumRead = Xgrid * Ygrid * Zgrid
+
+        values = np.empty(NumRead, dtype=np.float32)
+        filled = 0
+        while filled < NumRead:
+            lines = file.readlines(Constant.Cube_ChunkSize)
+            if not lines:
+                break
+            chunk = np.fromstring("".join(lines), dtype=np.float32, sep=" ")
+            n = min(chunk.size, NumRead - filled)
+            values[filled:filled + n] = chunk[:n]
+            filled += n
 
     subprocess.run(["rm", Cubefile], cwd=tcal_path, timeout=10)
-    return values
+    return values[:filled]
 
 
 def Result_Data_set(MaterName, Nmol, Formated_Tilt, mol_pos, tcal_path, messages, HelpList):
@@ -2249,30 +2604,18 @@ def combineData(MaterName, Nmol, tcal_path, result_path, MinFileName, TIFileName
         MinLines = MinFile.readlines()
         del MinLines[0:2]
 
+    # 入力ファイル名をキーにした辞書で結合する
+    TIs = {TILine.split()[0]: TILine.split() for TILine in TILines if TILine.strip()}
+    PCs = {}
     if os.path.exists(f"{tcal_path}/{PCFileName}"):
         with open(f"{tcal_path}/{PCFileName}", "r") as PCFile:
-            PCLines = PCFile.readlines()
-            del PCLines[0]
-    else:
-        PCLines = []
+            next(PCFile, None)  # header
+            for PCLine in PCFile:
+                PCData = PCLine.rstrip("\n").split("\t")
+                if len(PCData) >= 3:
+                    PCs[PCData[0]] = (PCData[1], PCData[2])
 
-    if len(TILines) == len(MinLines) and "2mol" in Nmol:
-        pass
-    elif len(TILines) == len(MinLines) * 3 and "3mol" in Nmol:
-        pass
-    else:
-        messages.append(f"\t>>>{Color.RED}Error: The numbers of data lines in {MinFileName} "
-                        f"and {TIFileName} DO NOT match.{Color.RESET}\n"
-                        f"A file was NOT be changed.")
-        HelpList.append(True)
-    help_check_exit(messages, HelpList)
-
-    CombLines = []
-    CombLines12 = []
-    CombLines23 = []
-    CombLines31 = []
-    print("Entry\tAngle\tDcol\tDtrv\tCpCE\tBSE\t**"
-          "\tTI-NLUMO\tTI-LUMO\tTI-HOMO\tTI-NHOMO\t**\tPC (LUMO)\tTI-LUMO\tPC (HOMO)\tTI-HOMO")
+    Entries = []
     for MinLine in MinLines:
         MinData = MinLine.split()
 
@@ -2288,56 +2631,63 @@ def combineData(MaterName, Nmol, tcal_path, result_path, MinFileName, TIFileName
             HelpList.append(True)
             help_check_exit(messages, HelpList)
             exit()
+        Entries.append((Entry, MinData))
 
-        for TILine in TILines:
-            TIData = TILine.split()
-            if (TIData[0] == Entry
-                    or TIData[0] == f"{Entry}-12"
-                    or TIData[0] == f"{Entry}-23"
-                    or TIData[0] == f"{Entry}-31"):
-                CombLine_temp = (f"{TIData[0]}\t{MinData[0]}\t{MinData[1]}\t{MinData[2]}\t{MinData[3]}\t{MinData[4]}"
-                                 f"\t**\t{TIData[1]}\t{TIData[2]}\t{TIData[3]}\t{TIData[4]}")
-
-                HomoChk = "yet"
-                LumoChk = "yet"
-                if len(PCLines) != 0:
-                    for PCLine in PCLines:
-                        PCData = PCLine.split()
-                        if PCData[0].strip() == TIData[0].strip():
-                            LumoChk = PCData[1]
-                            HomoChk = PCData[2]
-                else:
-                    pass
-
-                correctTI_LUMO = correctTI(LumoChk, TIData[2])
-                correctTI_HOMO = correctTI(HomoChk, TIData[3])
-                CombLine = f"{CombLine_temp}\t**\t{LumoChk}\t{correctTI_LUMO}\t{HomoChk}\t{correctTI_HOMO}\n"
-                if TIData[0] == Entry:
-                    CombLines.append(CombLine)
-                elif TIData[0] == f"{Entry}-12":
-                    CombLines12.append(CombLine)
-                elif TIData[0] == f"{Entry}-23":
-                    CombLines23.append(CombLine)
-                elif TIData[0] == f"{Entry}-31":
-                    CombLines31.append(CombLine)
-                else:
-                    pass
+    # 最小エネルギーの構造ごとに、計算を依頼したペアのTIがそろっているかを確認する
+    if "2mol" in Nmol:
+        if len(TILines) != len(MinLines):
+            messages.append(f"\t>>>{Color.RED}Error: The numbers of data lines in {MinFileName} "
+                            f"and {TIFileName} DO NOT match.{Color.RESET}\n"
+                            f"A file was NOT be changed.")
+            HelpList.append(True)
+        Pairs = {Entry: [(Entry, "")] for Entry, _ in Entries}
+    else:
+        PairNames = TcalPairNames(tcal_path)
+        if PairNames is None:
+            # ペアの一覧がない以前の計算では -12, -23, -31 の3つを求める
+            PairNames = [f"{Entry}{Suffix}" for Entry, _ in Entries for Suffix in ("-12", "-23", "-31")]
+        Pairs = {Entry: [(Name, Name[len(Entry):]) for Name in PairNames if Name.startswith(f"{Entry}-")]
+                 for Entry, _ in Entries}
+        Lacks = ([f"{Entry} (no pair)" for Entry, Names in Pairs.items() if not Names]
+                 + [Name for Names in Pairs.values() for Name, _ in Names if Name not in TIs])
+        if Lacks:
+            messages.append(f"\t>>>{Color.RED}Error: The transfer integrals of {len(Lacks)} pairs for {MinFileName} "
+                            f"were NOT found in {TIFileName}.{Color.RESET}")
+            for Lack in Lacks:
+                messages.append(f"\t\t{Lack}")
+            messages.append(f"A file was NOT be changed.")
+            HelpList.append(True)
+    help_check_exit(messages, HelpList)
 
-            else:
-                pass
+    CombLines, Excluded = {}, []
+    print("Entry\tAngle\tDcol\tDtrv\tCpCE\tBSE\t**"
+          "\tTI-NLUMO\tTI-LUMO\tTI-HOMO\tTI-NHOMO\t**\tPC (LUMO)\tTI-LUMO\tPC (HOMO)\tTI-HOMO")
+    for Entry, MinData in Entries:
+        for Name, Suffix in Pairs[Entry]:
+            TIData = TIs.get(Name)
+            if TIData is None:
+                continue
+            if "nan" in TIData[1:5]:
+                Excluded.append(Name)
+                continue
+            CombLine_temp = (f"{TIData[0]}\t{MinData[0]}\t{MinData[1]}\t{MinData[2]}\t{MinData[3]}\t{MinData[4]}"
+                             f"\t**\t{TIData[1]}\t{TIData[2]}\t{TIData[3]}\t{TIData[4]}")
+            LumoChk, HomoChk = PCs.get(TIData[0], ("yet", "yet"))
+
+            correctTI_LUMO = correctTI(LumoChk, TIData[2])
+            correctTI_HOMO = correctTI(HomoChk, TIData[3])
+            CombLines.setdefault(Suffix, []).append(
+                f"{CombLine_temp}\t**\t{LumoChk}\t{correctTI_LUMO}\t{HomoChk}\t{correctTI_HOMO}\n")
+    if Excluded:
+        # tcalの値が欠けたペア (readlogでnanとして書き込んだもの) は結合しない
+        messages.append(f"\t>>> {Color.RED}Warning: {len(Excluded)} pairs with missing transfer integrals "
+                        f"in {TIFileName} were excluded.{Color.RESET}")
+        for Name in Excluded:
+            messages.append(f"\t\t{Name}")
     help_check_exit(messages, HelpList)
-    CombLines.sort()
-    CombLines12.sort()
-    CombLines23.sort()
-    CombLines31.sort()
-    saveCombData(f"{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d",
-                 f"{result_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_min-TIs.txt", CombLines)
-    saveCombData(f"{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d-12",
-                 f"{result_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_min-TIs-12.txt", CombLines12)
-    saveCombData(f"{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d-23",
-                 f"{result_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_min-TIs-23.txt", CombLines23)
-    saveCombData(f"{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d-31",
-                 f"{result_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_min-TIs-31.txt", CombLines31)
+    for Suffix, Lines in CombLines.items():
+        saveCombData(f"{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d{Suffix}",
+                     f"{result_path}/{MaterName}_{Nmol}{mol_pos}_t{Formated_Tilt}d_min-TIs{Suffix}.txt", sorted(Lines))
     print(f"\n"
           f"\t>>> {Color.GREEN}Combining Data: Succeeded!!{Color.RESET}\n"
           f"\t>>> {MinFileName} and {TIFileName} were combined into "
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Job monitor shared by the ReorgEnergy front-ends (ReorganizationEnergy_01, ReorgEnergy_02_FE).
+
+One JobMonitor tracks any number of job IDs with a single qstat per interval.
+Each watched job gets an awaitable that resolves when the job has left the queue.
+A failed qstat leaves the states untouched and is retried at the next interval.
+
+    monitor = JobMonitor()
+    JobID = monitor.submit("qsub G-Reorg-ONE-Mol-b3lyp_6-31Gd.sh")
+    monitor.run([JobID])                 # blocking
+    await monitor.wait(JobID)            # inside a coroutine
+"""
+
+import asyncio
+import datetime
+import functools
+import re
+import subprocess
+import sys
+
+print = functools.partial(print, flush=True)
+
+
+class JobMonitor:
+    def __init__(self, Interval=60, Command="qstat"):
+        """
+        :param Interval: qstat polling interval [s]
+        :param Command: qstat command
+        """
+        self._JobMonitor = "JobMonitor"
+        self.Interval = Interval
+        self.Command = Command
+        self.Jobs = {}  # JobID -> asyncio.Future (resolved when the job leaves the queue)
+        self.Status = {}  # JobID -> qstat state ("qw", "r", ...) or "done"
+        self.StartTime = datetime.datetime.now()
+        self._Poller = None
+        self.PollError = None  # message of the last failed qstat, None while qstat works
+
+    @staticmethod
+    def submit(qsub, cwd=None):
+        """
+        Submit a job and return its job ID
+        :param qsub: e.g. "qsub G-Reorg-ONE-Mol-b3lyp_6-31Gd.sh"
+        :param cwd: directory where qsub is executed
+        :return: job ID, or None when qsub failed (the error of qsub is printed)
+        """
+        try:
+            result = subprocess.run(qsub.split(), cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+        except OSError as e:
+            print(f"\t>>> '{qsub}' failed: {e}")
+            return None
+        # Your job 12345 ("G-Reorg-....sh") has been submitted
+        Match = re.search(r"Your job (\d+)", result.stdout)
+        if result.returncode == 0 and Match:
+            return int(Match.group(1))
+        Error = (result.stderr.strip() or result.stdout.strip() or "no output").replace("\n", "\n\t    ")
+        print(f"\t>>> '{qsub}' failed (exit status {result.returncode}):\n\t    {Error}")
+        return None
+
+    async def poll(self):
+        """
+        Run qstat once
+        :return: {JobID: state}, or None when qstat failed (the reason is kept in PollError)
+        """
+        try:
+            process = await asyncio.create_subprocess_exec(self.Command, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await process.communicate()
+        except OSError as e:
+            self.PollError = str(e)
+            return None
+        # An empty output is a valid "no job in the queue" only when qstat itself succeeded
+        if process.returncode != 0 or (stderr.strip() and not stdout.strip()):
+            self.PollError = (f"exit status {process.returncode}: "
+                              f"{stderr.decode(errors='replace').strip() or 'no output'}")
+            return None
+        self.PollError = None
+        States = {}
+        # The first two lines are the header
+        for line in stdout.decode().strip().splitlines()[2:]:
+            Items = line.split()
+            try:
+                States[int(Items[0])] = Items[4] if len(Items) > 4 else "?"
+            except (ValueError, IndexError):
+                pass
+        return States
+
+    def watch(self, JobID):
+        """
+        Start tracking a job
+        :param JobID:
+        :return: awaitable resolved with the job ID when the job has left the queue
+        """
+        if JobID not in self.Jobs:
+            self.Jobs[JobID] = asyncio.get_running_loop().create_future()
+            self.Status[JobID] = "submitted"
+        if self._Poller is None or self._Poller.done():
+            self._Poller = asyncio.ensure_future(self._poll_loop())
+        return self.Jobs[JobID]
+
+    async def wait(self, JobID):
+        """
+        Wait until the job has left the queue
+        :param JobID:
+        :return: job ID
+        """
+        return await self.watch(JobID)
+
+    async def wait_all(self, JobIDs):
+        """
+        Wait until all the jobs have left the queue
+        :param JobIDs:
+        :return: list of job IDs
+        """
+        return await asyncio.gather(*(self.watch(JobID) for JobID in JobIDs))
+
+    def run(self, JobIDs):
+        """
+        Blocking version of wait_all for non-async callers
+        :param JobIDs:
+        :return: list of job IDs
+        """
+        return asyncio.run(self.wait_all(JobIDs))
+
+    async def _poll_loop(self):
+        """
+        One qstat per interval for all the watched jobs
+        :return:
+        """
+        print("\n")
+        while any(not future.done() for future in self.Jobs.values()):
+            States = await self.poll()
+            if States is None:
+                # Keep the previous states and retry at the next interval
+                print(f"\n\t>>> {self.Command} failed ({self.PollError.splitlines()[0]}); "
+                      f"retrying in {self.Interval} s.\n")
+                self.show()
+                await asyncio.sleep(self.Interval)
+                continue
+            for JobID, future in self.Jobs.items():
+                if future.done():
+                    continue
+                if JobID in States:
+                    self.Status[JobID] = States[JobID]
+                else:
+                    self.Status[JobID] = "done"
+                    future.set_result(JobID)
+            self.show()
+            if any(not future.done() for future in self.Jobs.values()):
+                await asyncio.sleep(self.Interval)
+        print("")
+        return None
+
+    def show(self):
+        """
+        Rewrite the status line
+        :return:
+        """
+        now = datetime.datetime.now()
+        elapsed_time = round((now - self.StartTime).total_seconds() / 60, 1)
+        Counts = {}
+        for State in self.Status.values():
+            Counts[State] = Counts.get(State, 0) + 1
+        Summary = ", ".join(f"{Count} {State}" for State, Count in sorted(Counts.items()))
+        Pending = sorted(JobID for JobID, future in self.Jobs.items() if not future.done())
+        sys.stdout.write(
+            "\033[1F\033[G%s" %
+            f"\t{now.strftime('%m/%d %H:%M')} ({elapsed_time} min. passed): {Summary}            \n"
+            f"\tWaiting for: {' '.join(map(str, Pending[:10]))}{' ...' if len(Pending) > 10 else ''}    ")
+        sys.stdout.flush()
+        return None
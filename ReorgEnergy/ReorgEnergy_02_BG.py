@@ -1,12 +1,17 @@
 import argparse
+import concurrent.futures
 import datetime
 import functools
+import mmap
 import os
 import platform
+import re
 import subprocess
 import sys
 import time
 
+import numpy as np
+
 print = functools.partial(print, flush=True)
 
 
@@ -30,15 +35,14 @@ def main():
 
     re = ReorgEnergy(args)
 
-    re.calc_from_gjf("EG", "0")
-    re.calc_from_log("EG", "+1", f"{args.MaterName}_0_EG_{args.Function}.log")
-    re.calc_from_log("SP", "+0", f"{args.MaterName}_+1_EG_{args.Function}.log")
-    re.calc_from_log("SP", "+1", f"{args.MaterName}_0_EG_{args.Function}.log")
+    re.run_workflow(re.workflow())
 
     result_meV = re.calc_reorg_energy()
 
     re.save_result(result_meV)
 
+    re.save_mode_decomposition()
+
     after = time.time()
     elapsed_time = after - before
     formatted_time = time.strftime("%H h %M m %S s", time.gmtime(elapsed_time))
@@ -54,6 +58,17 @@ def arg_parser():
     parser.add_argument('--debug', '-d',
                         action='store_true')
     parser.add_argument('-g', '--g09')
+    parser.add_argument('--concurrent', '-c',
+                        help="Run the independent Gaussian steps at the same time, splitting the cores of the job\n"
+                             "by the expected cost of each step (default: one by one with all the cores)",
+                        action='store_true')
+    parser.add_argument('--freq', choices=['full', 'auto'], default='full',
+                        help="full: opt freq in one job (default)\n"
+                             "auto: opt only, followed by a freq job when the optimization ended near a saddle\n"
+                             "      or kept a point group other than C1")
+    parser.add_argument('--no-chk',
+                        help="Always restart the steps from coordinates instead of the previous checkpoint",
+                        action='store_true')
     args = parser.parse_args()
 
     return args
@@ -71,8 +86,13 @@ class ReorgEnergy:
             self.gaussian_command = 'g09'
         else:
             self.gaussian_command = 'g16'
+        self.serial = not args.concurrent
+        self.chain_chk = not args.no_chk
+        self.freq_mode = args.freq
         self.EnergyList = []
-        self.Freq_0_EG, self.Freq_1_EG = [], []
+        self.Freq_0_EG, self.Freq_1_EG = np.empty(0), np.empty(0)
+        # 価数ごとの振動解析の結果 (Read_frequenciesの戻り値)
+        self.FreqData = {}
 
     def get_band_info(self):
         print("\n結合情報を取得しています...")
@@ -115,7 +135,61 @@ class ReorgEnergy:
         z = f'{z:.10f}'.rjust(15, ' ')
         return f'{x} {y} {z}'
 
-    def calc_from_gjf(self, EG_or_SP, Charge):
+    def workflow(self):
+        """
+        再配置エネルギー計算の依存関係グラフを作成する関数
+        :return: {ステップ名: (関数, 引数, 依存するステップ名のリスト)}
+        """
+        Log_0_EG = f"{self.MaterName}_0_EG_{self.Function_Name}.log"
+        Log_1_EG = f"{self.MaterName}_+1_EG_{self.Function_Name}.log"
+        # +1荷のSPは0荷の構造のみに依存するため、+1荷の構造最適化と同時に計算できる
+        return {
+            "0_EG": (self.calc_from_gjf, ("EG", "0"), []),
+            "+1_EG": (self.calc_from_log, ("EG", "+1", Log_0_EG), ["0_EG"]),
+            "+0_SP": (self.calc_from_log, ("SP", "+0", Log_1_EG), ["+1_EG"]),
+            "+1_SP": (self.calc_from_log, ("SP", "+1", Log_0_EG), ["0_EG"]),
+        }
+
+    def run_workflow(self, Steps):
+        """
+        依存関係グラフに従って計算を実行する関数
+        依存するステップが全て終了したステップから順に投入する
+        --concurrentの場合は、同時に投入するステップ間で%nprocsharedを計算コストの比で分割する
+        :param Steps: workflow()の戻り値
+        :return:
+        """
+        Done, Running = [], {}
+        Remaining = dict(Steps)
+        MaxWorkers = 1 if self.serial else len(Steps)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MaxWorkers) as executor:
+            while Remaining or Running:
+                Ready = [Name for Name, (_, _, Deps) in Remaining.items() if all(Dep in Done for Dep in Deps)]
+                if self.serial:
+                    Ready = Ready[:1] if not Running else []
+                if not Ready and not Running:
+                    print(f"{Color.RED}依存関係を解決できないステップがあります: {', '.join(Remaining)}{Color.RESET}")
+                    sys.exit(1)
+                # 実行中のステップが使っていないコアを、新たに投入するステップで計算コストの比で分ける
+                # (Gaussianの実行中にコア数は変えられないため、重いEGに多く割り当てる)
+                Shares = []
+                if Ready:
+                    Free = Constants.NProcShared - sum(Used for _, Used in Running.values())
+                    Weights = [Constants.Step_Cost[Remaining[Name][1][0]] for Name in Ready]
+                    Shares = [max(1, Free * Weight // sum(Weights)) for Weight in Weights]
+                    Shares[Weights.index(max(Weights))] += max(0, Free - sum(Shares))
+                for Name, NProc in zip(Ready, Shares):
+                    Func, Args, _ = Remaining.pop(Name)
+                    if not self.serial:
+                        print(f"{Name}を投入します (%nprocshared={NProc})")
+                    Running[executor.submit(Func, *Args, NProc=NProc)] = (Name, NProc)
+                Finished, _ = concurrent.futures.wait(Running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in Finished:
+                    # ステップ内でのsys.exit()もここで再送出される
+                    future.result()
+                    Done.append(Running.pop(future)[0])
+        return None
+
+    def calc_from_gjf(self, EG_or_SP, Charge, NProc=None):
         if os.path.exists(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log"):
             print(f"{Charge}荷、{EG_or_SP}の計算は既に終了しています。")
         else:
@@ -133,7 +207,7 @@ class ReorgEnergy:
                 except IndexError:
                     break
 
-            gjf = self.write_gjf_file(EG_or_SP, Charge, data)
+            gjf = self.write_gjf_file(EG_or_SP, Charge, data, NProc)
             print(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.gjfを作成しました。")
 
             print(f"{Charge}荷、{EG_or_SP}を計算しています...")
@@ -142,39 +216,78 @@ class ReorgEnergy:
 
         self.Check_normal_termination(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log", True)
         if EG_or_SP == "EG":
-            self.Check_negative_frequency(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log", Charge)
+            self.Frequency_check(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log", Charge, NProc)
         print("")
         return None
 
-    def calc_from_log(self, EG_or_SP, Charge, Base_Log_File):
-        if os.path.exists(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log"):
+    def calc_from_log(self, EG_or_SP, Charge, Base_Log_File, NProc=None):
+        Log_File = f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log"
+        if os.path.exists(Log_File):
             print(f"{Charge}荷、{EG_or_SP}の計算は既に終了しています。")
         else:
-            print(f"{Charge}荷、{EG_or_SP}のgjfファイルを作成しています...")
-            data = self.molecular_log_open(Base_Log_File)
-            formatted_data = self.format_atomic_data(data)
-            gjf = self.write_gjf_file(EG_or_SP, Charge, formatted_data)
-            print(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.gjfを作成しました。")
-
-            print(f"{Charge}荷、{EG_or_SP}を計算しています...")
-            self.run_gaussian(gjf)
-            print(f"{Charge}荷、{EG_or_SP}の計算が終了しました。")
-
-        self.Check_normal_termination(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log", True)
+            # 前のステップのchkファイルから構造・波動関数・ヘシアンを読み込む
+            Base_Chk_File = Base_Log_File.replace(".log", ".chk")
+            if self.chain_chk and os.path.exists(Base_Chk_File):
+                print(f"{Charge}荷、{EG_or_SP}のgjfファイルを{Base_Chk_File}から作成しています...")
+                gjf = self.write_gjf_file(EG_or_SP, Charge, [], NProc, Base_Chk_File)
+                print(f"{Charge}荷、{EG_or_SP}を計算しています...")
+                self.run_gaussian(gjf)
+                if self.Normal_termination(Log_File):
+                    print(f"{Charge}荷、{EG_or_SP}の計算が終了しました。")
+                else:
+                    # 失敗した場合は座標からの計算に切り替える
+                    print(f"{Color.YELLOW}{Base_Chk_File}からの計算が正常に終了しませんでした。"
+                          f"座標から計算し直します。{Color.RESET}")
+                    os.replace(Log_File, Log_File.replace(".log", "_chk-failed.log"))
+            elif self.chain_chk:
+                print(f"{Color.YELLOW}{Base_Chk_File}が見つからないため、座標から計算します。{Color.RESET}")
+
+            if not os.path.exists(Log_File):
+                print(f"{Charge}荷、{EG_or_SP}のgjfファイルを作成しています...")
+                data = self.molecular_log_open(Base_Log_File)
+                formatted_data = self.format_atomic_data(data)
+                gjf = self.write_gjf_file(EG_or_SP, Charge, formatted_data, NProc)
+                print(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.gjfを作成しました。")
+
+                print(f"{Charge}荷、{EG_or_SP}を計算しています...")
+                self.run_gaussian(gjf)
+                print(f"{Charge}荷、{EG_or_SP}の計算が終了しました。")
+
+        self.Check_normal_termination(Log_File, True)
         if EG_or_SP == "EG":
-            self.Check_negative_frequency(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.log", Charge)
+            self.Frequency_check(Log_File, Charge, NProc)
         print("")
         return None
 
-    def write_gjf_file(self, EG_or_SP, Charge, formatted_data):
+    def write_gjf_file(self, EG_or_SP, Charge, formatted_data, NProc=None, OldChk=None):
+        """
+        gjfファイルを作成する関数
+        :param EG_or_SP:
+        :param Charge:
+        :param formatted_data: 座標 (OldChkを指定した場合は使わない)
+        :param NProc: %nprocshared
+        :param OldChk: 構造と初期波動関数を読み込むchkファイル
+        :return: gjfファイル名
+        """
         # 仮のヘッダーを作成
         header_data = StandardPhrases.Header_Template.splitlines()
-        header_data[0] = header_data[0] + "\n"
-        header_data[1] = header_data[1] + "\n"
+        # 同時に走るステップがある場合はコア数とメモリを分割する
+        if NProc is None:
+            NProc = Constants.NProcShared
+        header_data[0] = f"%nprocshared={NProc}" + "\n"
+        header_data[1] = f"%mem={Constants.Mem_GB * NProc // Constants.NProcShared}GB" + "\n"
         header_data[2] = f"%chk={self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.chk" + "\n"
-        # EGかSPかで分岐
-        if EG_or_SP == "EG":
-            header_data[3] = f"# opt freq=noraman {self.function} geom=connectivity" + "\n"
+        # EGかSPかで分岐 (chkから読み込む場合は構造・結合情報・波動関数・ヘシアンをchkから取得する)
+        # --freq autoではEGでは振動計算を行わず、必要な場合のみFQで振動計算を行う
+        Freq = "freq=noraman " if self.freq_mode == "full" else ""
+        if EG_or_SP == "EG" and OldChk:
+            header_data[3] = f"# opt=readfc {Freq}{self.function} geom=check guess=read" + "\n"
+        elif EG_or_SP == "EG":
+            header_data[3] = f"# opt {Freq}{self.function} geom=connectivity" + "\n"
+        elif EG_or_SP == "FQ":
+            header_data[3] = f"# freq=noraman {self.function} geom=check guess=read" + "\n"
+        elif EG_or_SP == "SP" and OldChk:
+            header_data[3] = f"# {self.function} geom=check guess=read" + "\n"
         elif EG_or_SP == "SP":
             header_data[3] = f"# {self.function} geom=connectivity" + "\n"
         else:
@@ -188,15 +301,18 @@ class ReorgEnergy:
             header_data[7] = "0 1\n"
         elif Charge == "+1":
             header_data[7] = "1 2\n"
+        if OldChk:
+            header_data.insert(3, f"%oldchk={OldChk}" + "\n")
         # GJFファイルへの書き込み
         with open(f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.gjf", "w") as file:
             for formatted_line in header_data:
                 file.write(formatted_line)
-            for formatted_line in formatted_data:
-                file.write(formatted_line + "\n")
-            file.write("\n")
-            file.write(self.bond_info)
-            file.write("\n")
+            if not OldChk:
+                for formatted_line in formatted_data:
+                    file.write(formatted_line + "\n")
+                file.write("\n")
+                file.write(self.bond_info)
+                file.write("\n")
             file.write("\n")
         if self.debug:
             print(f"\n************* {self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}.gjf *************")
@@ -237,37 +353,272 @@ class ReorgEnergy:
             exit()
         return None
 
+    @staticmethod
+    def Normal_termination(Log_File):
+        """
+        計算が正常に終了したかを返す関数 (終了はしない)
+        :param Log_File:
+        :return: bool
+        """
+        if not os.path.exists(Log_File):
+            return False
+        with open(Log_File, "r") as file:
+            return any("Normal termination" in line for line in file)
+
+    @staticmethod
+    def Count_cycles(Log_File):
+        """
+        logファイルからSCFサイクル数と構造最適化のステップ数を数える関数
+        :param Log_File:
+        :return: (最初のSCFのサイクル数, SCFサイクル数の合計, 構造最適化のステップ数)
+        """
+        SCF_cycles, Opt_steps = [], 0
+        with open(Log_File, "r") as file:
+            for line in file:
+                if "SCF Done" in line:
+                    Match = re.search(r"A\.U\. after\s+(\d+)\s+cycles", line)
+                    if Match:
+                        SCF_cycles.append(int(Match.group(1)))
+                elif "Step number" in line:
+                    Opt_steps += 1
+        First = SCF_cycles[0] if SCF_cycles else 0
+        return First, sum(SCF_cycles), Opt_steps
+
+    def Cycle_report(self):
+        """
+        各ステップのSCFサイクル数・構造最適化ステップ数を求める関数
+        chkから始めたステップは、最初のSCFのサイクル数を座標から始めた0_EGと比べた差を目安として付ける
+        (0_EGとは電荷も構造も異なるため、実測の削減量ではなく負になることもある)
+        :return: 各ステップの行のリスト
+        """
+        Rows = []
+        Reference = None
+        for Charge, EG_or_SP in (("0", "EG"), ("+1", "EG"), ("+0", "SP"), ("+1", "SP")):
+            Name = f"{self.MaterName}_{Charge}_{EG_or_SP}_{self.Function_Name}"
+            if not os.path.exists(f"{Name}.log"):
+                continue
+            Seed = "coords"
+            if os.path.exists(f"{Name}.gjf"):
+                with open(f"{Name}.gjf", "r") as file:
+                    if any(line.startswith("%oldchk") for line in file):
+                        Seed = "chk"
+            First, Total, Opt_steps = self.Count_cycles(f"{Name}.log")
+            if Charge == "0":
+                Reference = First
+            Estimate = f"{Reference - First:+d}" if Seed == "chk" and Reference is not None else "-"
+            Rows.append([f"{Charge}_{EG_or_SP}", Seed, First, Total, Opt_steps, Estimate])
+        return Rows
+
+    def Frequency_check(self, Log_File, Charge, NProc=None):
+        """
+        構造最適化後の振動数を確認する関数
+        --freq fullではEGのlogをそのまま確認する。
+        --freq autoでは最終構造の近似ヘシアンと収束判定を調べ、鞍点の可能性がある場合や対称性を保ったまま最適化した場合のみ振動計算(FQ)を行う。
+        :param Log_File: EGのlogファイル
+        :param Charge:
+        :param NProc:
+        :return:
+        """
+        if self.freq_mode == "full":
+            self.Check_negative_frequency(Log_File, Charge)
+            return None
+
+        FQ_Log_File = f"{self.MaterName}_{Charge}_FQ_{self.Function_Name}.log"
+        if not os.path.exists(FQ_Log_File):
+            Reason = self.Saddle_check(Log_File)
+            if Reason is None:
+                print(f"{Charge}荷: 最終構造の近似ヘシアンは全て正で、収束判定も全て満たし、"
+                      f"対称性の制約もないため、振動計算を省略します。")
+                return None
+            print(f"{Charge}荷: {Reason}ため、振動計算を行います...")
+            gjf = self.write_gjf_file("FQ", Charge, [], NProc, Log_File.replace(".log", ".chk"))
+            self.run_gaussian(gjf)
+            self.Check_normal_termination(FQ_Log_File, True)
+        self.Check_negative_frequency(FQ_Log_File, Charge)
+        return None
+
+    @staticmethod
+    def Saddle_check(Log_File):
+        """
+        構造最適化の最終ステップが鞍点・平坦な領域の近くで終わっていないかを調べる関数
+        :param Log_File: 振動計算を含まない構造最適化のlogファイル
+        :return: 振動計算が必要な理由 (不要な場合はNone)
+        """
+        Eigenvalues, In_Eigenvalues = [], False
+        Converged, In_Converged = {}, False
+        PointGroup, NoSymm = None, False
+        with open(Log_File, "r") as file:
+            for line in file:
+                # 対称性 (対称性を保った最適化は全対称な座標しか動かさないため、鞍点に収束しても上の判定を通る)
+                if "Full point group" in line:
+                    PointGroup = line.split()[3]
+                elif "Symmetry turned off" in line:
+                    NoSymm = True
+                # 近似ヘシアンの固有値 (複数行にわたるため、連続する行を1つのブロックとして扱う)
+                if line.lstrip().startswith("Eigenvalues ---"):
+                    if not In_Eigenvalues:
+                        Eigenvalues = []
+                    In_Eigenvalues = True
+                    Eigenvalues.extend(float(value) for value in re.findall(r"-?\d+\.\d+", line.split("---")[1]))
+                    continue
+                In_Eigenvalues = False
+                # 収束判定の表
+                if "Converged?" in line:
+                    Converged, In_Converged = {}, True
+                elif In_Converged and line.split() and line.split()[-1] in ("YES", "NO"):
+                    Converged[" ".join(line.split()[:-3])] = line.split()[-1]
+                else:
+                    In_Converged = False
+        if not Eigenvalues:
+            return "近似ヘシアンの固有値が見つからない"
+        if min(Eigenvalues) < Constants.Freq_FlatEigenvalue:
+            return f"最終構造の近似ヘシアンに小さい固有値 ({min(Eigenvalues)}) がある"
+        if not Converged or "NO" in Converged.values():
+            return "最終ステップで収束判定を満たしていない項目がある"
+        if not NoSymm and PointGroup not in (None, "C1"):
+            return f"対称性 ({PointGroup}) を保ったまま構造最適化しており、対称性を崩す方向の鞍点を判定できない"
+        return None
+
+    @staticmethod
+    def Frequency_section(Log_File):
+        """
+        logファイルの振動解析の部分を、行の途中で切れないチャンク(bytes)として順に返すジェネレータ
+        ファイル全体は読み込まず、mmapで振動解析の開始位置を探し、そこから一定サイズずつ読み込む
+        振動解析の結果が無い場合は何も返さない
+        :param Log_File:
+        """
+        # freq=hpmodesでは通常精度の振動解析が続けて出力されるため、次の開始行でも終了する
+        End_Keys = (b"Thermochemistry", b"Normal termination", b"Harmonic frequencies")
+        with open(Log_File, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                Start = mm.find(StandardPhrases.Freq_Marker)
+            if Start < 0:
+                return
+            file.seek(Start)
+            file.readline()
+            Rest, EOF = b"", False
+            while not EOF:
+                Chunk = file.read(Constants.Freq_ChunkSize)
+                EOF = not Chunk
+                Chunk = Rest + Chunk
+                # 行の途中で切れた部分は次のチャンクに回す
+                Cut = len(Chunk) if EOF else Chunk.rfind(b"\n") + 1
+                Chunk, Rest = Chunk[:Cut], Chunk[Cut:]
+                Ends = [Position for Position in (Chunk.find(Key) for Key in End_Keys) if Position >= 0]
+                if Ends:
+                    Chunk, EOF = Chunk[:min(Ends)], True
+                yield Chunk
+
+    def Read_frequencies(self, Log_File):
+        """
+        logファイルの振動解析の部分から振動数・換算質量・IR強度を読み込む関数
+        :param Log_File:
+        :return: {"Frequencies": 振動数[cm-1], "ReducedMasses": 換算質量[AMU], "IRIntensities": IR強度[KM/Mole]}
+                 (振動解析の結果が無い場合はNone)
+        """
+        Keys = {b"Frequencies -": "Frequencies", b"Red. masses -": "ReducedMasses", b"Reduced masses -": "ReducedMasses",
+                b"IR Inten": "IRIntensities"}
+        Values = {Name: [] for Name in Keys.values()}
+        Found = False
+        for Chunk in self.Frequency_section(Log_File):
+            Found = True
+            # 基準振動の座標の行は読まず、キーワードの行のみを探す
+            for Key, Name in Keys.items():
+                Position = Chunk.find(Key)
+                while Position >= 0:
+                    End = Chunk.find(b"\n", Position)
+                    line = Chunk[Position:End if End >= 0 else len(Chunk)]
+                    Values[Name].extend(float(value) for value in line[line.index(b"--"):].lstrip(b"-").split())
+                    Position = Chunk.find(Key, End) if End >= 0 else -1
+        if not Found:
+            return None
+        return {Name: np.array(Value) for Name, Value in Values.items()}
+
+    def Read_normal_modes(self, Log_File, NAtoms):
+        """
+        logファイルの振動解析の部分から基準振動(デカルト座標での変位)を読み込む関数
+        通常の出力 ("Atom  AN  X Y Z ...") と freq=hpmodes の出力 ("Coord Atom Element: ...") に対応する
+        各ブロックの見出しの次の行から原子数分(hpmodesでは3倍)の行をまとめて数値に変換する
+        :param Log_File:
+        :param NAtoms: 原子数
+        :return: 基準振動 (振動数の数, 原子数, 3) (読み込めない場合はNone)
+        """
+        Headers = {b"Atom  AN": "Atom", b"Coord Atom Element:": "Coord"}
+        Modes, Buffer = [], b""
+        for Chunk in self.Frequency_section(Log_File):
+            Buffer, Offset = Buffer + Chunk, 0
+            while True:
+                Found = [(Buffer.find(Key, Offset), Layout) for Key, Layout in Headers.items()]
+                Found = [(Position, Layout) for Position, Layout in Found if Position >= 0]
+                if not Found:
+                    # チャンクは行単位で区切られているため、見出しが無ければ残りは不要
+                    Buffer = b""
+                    break
+                Start, Layout = min(Found)
+                # 以降は同じ形式の見出しのみを探す
+                Headers = {Key: Value for Key, Value in Headers.items() if Value == Layout}
+                NRows = NAtoms if Layout == "Atom" else 3 * NAtoms
+                Position = End = Buffer.find(b"\n", Start) + 1
+                for _ in range(NRows):
+                    End = Buffer.find(b"\n", End) + 1 if End else 0
+                if not End:
+                    # ブロックが次のチャンクにまたがる場合
+                    Buffer = Buffer[Start:]
+                    break
+                Block = np.fromstring(Buffer[Position:End].decode(), dtype=float, sep=" ").reshape(NRows, -1)
+                if Layout == "Atom":
+                    # 原子ごとの行: Atom AN X Y Z X Y Z ...
+                    Modes.append(Block[:, 2:].reshape(NAtoms, -1, 3).transpose(1, 0, 2))
+                else:
+                    # 座標ごとの行: Coord Atom Element Mode1 Mode2 ...
+                    Modes.append(Block[:, 3:].T.reshape(-1, NAtoms, 3))
+                Offset = End
+        if not Modes:
+            return None
+        return np.concatenate(Modes)
+
+    @staticmethod
+    def Read_geometry(Log_File):
+        """
+        logファイルの最後の"Standard orientation"から原子番号と座標を読み込む関数
+        :param Log_File:
+        :return: (原子番号 (原子数,), 座標[Å] (原子数, 3))
+        """
+        with open(Log_File, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                Start = mm.rfind(b"Standard orientation")
+                if Start < 0:
+                    Start = mm.rfind(b"Input orientation")
+                Block = mm[Start:mm.find(b"Rotational constants", Start)]
+        Rows = [line.split() for line in Block.decode().split(
+            "---------------------------------------------------------------------")[2].strip().splitlines()]
+        Table = np.array(Rows, dtype=float)
+        return Table[:, 1].astype(int), Table[:, 3:6]
+
     def Check_negative_frequency(self, Log_File, Charge):
         print("振動数が負の値を持っていないかを確認しています...")
-        count, messages, HelpList = 0, [], []
-        with open(Log_File, "r") as file:
-            data = file.read()
-        Temp = data.split("Harmonic frequencies (cm**-1), IR intensities (KM/Mole), Raman scattering")[1]
-        for line in Temp.strip().splitlines():
-            if "Frequencies" in line:
-                elements = line.split()
-                for element in elements:
-                    try:
-                        element = float(element)
-                        count = count + 1
-                        if Charge == "0":
-                            self.Freq_0_EG.append([count, element])
-                        elif Charge == "+1":
-                            self.Freq_1_EG.append([count, element])
-                        else:
-                            pass
-                        if self.debug:
-                            print(f"\t>>> 周波数 {count}: {element}")
-                        if element < 0:
-                            messages.append(
-                                f"\t{Color.RED}>>> Negative frequency found {count}: {element}{Color.RESET}")
-                            HelpList.append(True)
-                    except ValueError:
-                        pass
-        if True in HelpList:
+        FreqData = self.Read_frequencies(Log_File)
+        if FreqData is None or FreqData["Frequencies"].size == 0:
+            print(f"{Color.RED}{Log_File}に振動解析の結果が見つかりませんでした。{Color.RESET}")
+            print(f"{Color.RED}プログラムを終了します。{Color.RESET}")
+            sys.exit(1)
+        Frequencies = FreqData["Frequencies"]
+        self.FreqData[Charge] = FreqData
+        if Charge == "0":
+            self.Freq_0_EG = Frequencies
+        elif Charge == "+1":
+            self.Freq_1_EG = Frequencies
+        else:
+            pass
+        if self.debug:
+            for count, element in enumerate(Frequencies, 1):
+                print(f"\t>>> 周波数 {count}: {element}")
+        Negative = np.flatnonzero(Frequencies < 0)
+        if Negative.size:
             print(f"{Color.RED}EG, {Charge}価での計算結果にて負の振動数が見つかりました。{Color.RESET}")
             sys.stderr.write(f"{Color.RED}EG, {Charge}価での計算結果にて負の振動数が見つかりました。{Color.RESET}\n")
-            for message in messages:
+            for index in Negative:
+                message = f"\t{Color.RED}>>> Negative frequency found {index + 1}: {Frequencies[index]}{Color.RESET}"
                 print(message)
                 sys.stderr.write(f"{message}\n")
             print(f"{Color.RED}ログファイルを確認してください。{Color.RESET}")
@@ -431,8 +782,9 @@ class ReorgEnergy:
             )
         )
 
-        min_freq_0_EG = min([freq[1] for freq in self.Freq_0_EG])
-        min_freq_1_EG = min([freq[1] for freq in self.Freq_1_EG])
+        # --freq autoで振動計算を省略した場合
+        min_freq_0_EG = self.Freq_0_EG.min() if self.Freq_0_EG.size else "not calculated"
+        min_freq_1_EG = self.Freq_1_EG.min() if self.Freq_1_EG.size else "not calculated"
 
         with open(f"{self.MaterName}_ReorgEnergy_{self.Function_Name}.txt", "w") as file:
             file.write(f"Execution date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
@@ -454,9 +806,127 @@ class ReorgEnergy:
             file.write(f"Minimum Frequency of 0_EG: {min_freq_0_EG}\n")
             file.write(f"Minimum Frequency of 1_EG: {min_freq_1_EG}\n")
 
+            # 各ステップのサイクル数
+            Rows = self.Cycle_report()
+            file.write("\n" + "=" * 80 + "\n")
+            file.write(f"{'Step':<10}{'Seed':<10}{'SCF (first)':<14}{'SCF (total)':<14}{'Opt steps':<12}"
+                       f"{'vs 0_EG (est.)':<20}\n")
+            file.write("=" * 80 + "\n")
+            for Row in Rows:
+                file.write(f"{Row[0]:<10}{Row[1]:<10}{Row[2]:<14}{Row[3]:<14}{Row[4]:<12}{Row[5]:<20}\n")
+            file.write("=" * 80 + "\n")
+            file.write("vs 0_EG (est.): first-SCF cycles of 0_EG (started from coordinates) minus those of the step.\n"
+                       "This is only a rough estimate of the effect of the checkpoint: 0_EG has another charge and\n"
+                       "geometry, so it can be negative. Measuring the saved SCF/opt cycles needs a run with --no-chk.\n")
+
         print("結果を保存しました。")
         return None
 
+    @staticmethod
+    def Kabsch(Reference, Coords, Masses):
+        """
+        座標Coordsを質量加重の最小二乗でReferenceに重ね合わせる関数 (並進・回転のみ)
+        :param Reference: 基準の座標 (原子数, 3)
+        :param Coords: 重ね合わせる座標 (原子数, 3)
+        :param Masses: 原子量 (原子数,)
+        :return: 重ね合わせた座標 (原子数, 3)
+        """
+        Weights = Masses / Masses.sum()
+        Reference_Center, Center = Weights @ Reference, Weights @ Coords
+        Covariance = (Coords - Center).T @ ((Reference - Reference_Center) * Weights[:, None])
+        U, _, Vt = np.linalg.svd(Covariance)
+        # 鏡映にならないようにする
+        D = np.sign(np.linalg.det(U @ Vt))
+        Rotation = U @ np.diag([1.0, 1.0, D]) @ Vt
+        return (Coords - Center) @ Rotation + Reference_Center
+
+    @staticmethod
+    def Mode_decomposition(Frequencies, Modes, Masses, Displacement):
+        """
+        構造の変位を基準振動に射影し、Huang-Rhys因子と基準振動ごとの再配置エネルギーを求める関数
+        λ_k = ω_k^2 Q_k^2 / 2, S_k = λ_k / ħω_k (Q_k: 質量加重した変位の基準振動への射影)
+        :param Frequencies: 振動数[cm-1] (振動数の数,)
+        :param Modes: 基準振動 (振動数の数, 原子数, 3)
+        :param Masses: 原子量[AMU] (原子数,)
+        :param Displacement: 変位[Å] (原子数, 3)
+        :return: (Huang-Rhys因子 (振動数の数,), 再配置エネルギー[meV] (振動数の数,))
+        """
+        Sqrt_Masses = np.sqrt(Masses)
+        # 質量加重した基準振動を規格化する
+        Weighted_Modes = Modes * Sqrt_Masses[None, :, None]
+        Weighted_Modes /= np.linalg.norm(Weighted_Modes.reshape(len(Modes), -1), axis=1)[:, None, None]
+        # 射影 [AMU^1/2 Å] -> [kg^1/2 m]
+        Q = np.einsum("kni,ni->k", Weighted_Modes, Displacement * Sqrt_Masses[:, None])
+        Q = Q * np.sqrt(Constants.AMU) * 1e-10
+        # 角振動数[rad/s] (負・ゼロの振動数は除く)
+        Omega = 2 * np.pi * Constants.C * 100 * np.clip(Frequencies, 0, None)
+        Lambda_J = 0.5 * Omega ** 2 * Q ** 2
+        Huang_Rhys = np.divide(Lambda_J, Constants.Hbar * Omega, out=np.zeros_like(Lambda_J), where=Omega > 0)
+        return Huang_Rhys, Lambda_J / Constants.E * 1000
+
+    def save_mode_decomposition(self):
+        """
+        0_EGと+1_EGの構造差を各価数の基準振動に射影し、基準振動ごとの再配置エネルギーを保存する関数
+        λ1は0価の基準振動、λ2は+1価の基準振動に対する射影から求める
+        :return:
+        """
+        print("\n基準振動ごとの再配置エネルギーを計算しています...")
+        Logs, Geometries = {}, {}
+        for Charge in ("0", "+1"):
+            # --freq autoで振動計算を別に行った場合はそのlogを使う
+            Logs[Charge] = f"{self.MaterName}_{Charge}_FQ_{self.Function_Name}.log"
+            if not os.path.exists(Logs[Charge]):
+                Logs[Charge] = f"{self.MaterName}_{Charge}_EG_{self.Function_Name}.log"
+            Geometries[Charge] = self.Read_geometry(Logs[Charge])
+
+        Energy = {(item['Charge'], item['EG_or_SP']): float(item['Energy']) for item in self.EnergyList}
+        Four_Point = {"λ1": self.hartree_to_meV(Energy[("+0", "SP")] - Energy[("0", "EG")]),
+                      "λ2": self.hartree_to_meV(Energy[("+1", "SP")] - Energy[("+1", "EG")])}
+
+        Results = {}
+        for Charge, Other, Label in (("0", "+1", "λ1"), ("+1", "0", "λ2")):
+            FreqData = self.FreqData.get(Charge) or self.Read_frequencies(Logs[Charge])
+            Modes = self.Read_normal_modes(Logs[Charge], len(Geometries[Charge][0]))
+            if FreqData is None or Modes is None or len(Modes) != FreqData["Frequencies"].size:
+                print(f"{Color.YELLOW}{Logs[Charge]}から基準振動を読み込めないため、計算を省略します。{Color.RESET}")
+                return None
+            AtomicNumbers, Reference = Geometries[Charge]
+            try:
+                Masses = np.array([PeriodicTable.atomic_symbols[Z][1] for Z in AtomicNumbers])
+            except KeyError:
+                print(f"{Color.YELLOW}原子量が登録されていない原子があるため、計算を省略します。{Color.RESET}")
+                return None
+            Displacement = self.Kabsch(Reference, Geometries[Other][1], Masses) - Reference
+            # λ1: 0価の曲面上で0_EG -> +1_EGの変位, λ2: +1価の曲面上で+1_EG -> 0_EGの変位
+            Huang_Rhys, Lambda = self.Mode_decomposition(FreqData["Frequencies"], Modes, Masses, Displacement)
+            Results[Label] = (Charge, FreqData, Huang_Rhys, Lambda)
+
+        with open(f"{self.MaterName}_ReorgModes_{self.Function_Name}.txt", "w") as file:
+            file.write(f"Execution date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            file.write(f"Material Name: {self.MaterName}\n")
+            file.write(f"Function: {self.function}\n")
+            for Label, (Charge, FreqData, Huang_Rhys, Lambda) in Results.items():
+                file.write(f"\n{Label} from the normal modes of {Charge}_EG: {round(Lambda.sum(), 4)} [meV] "
+                           f"(four-point: {round(Four_Point[Label], 4)} [meV])\n")
+                file.write("=" * 72 + "\n")
+                file.write(f"{'Mode':<8}{'Freq [cm-1]':<16}{'Red. mass [AMU]':<18}{'S (Huang-Rhys)':<16}"
+                           f"{'λ_k [meV]':<14}\n")
+                file.write("=" * 72 + "\n")
+                ReducedMasses = FreqData["ReducedMasses"]
+                for k in range(len(Lambda)):
+                    ReducedMass = f"{ReducedMasses[k]:.4f}" if k < ReducedMasses.size else "nan"
+                    file.write(f"{k + 1:<8}{FreqData['Frequencies'][k]:<16.4f}{ReducedMass:<18}"
+                               f"{Huang_Rhys[k]:<16.6f}{Lambda[k]:<14.6f}\n")
+                file.write("=" * 72 + "\n")
+
+        for Label, (Charge, FreqData, Huang_Rhys, Lambda) in Results.items():
+            print(f"{Label}: {round(Lambda.sum(), 4)} [meV] (four-point: {round(Four_Point[Label], 4)} [meV])")
+            for k in np.argsort(Lambda)[::-1][:Constants.Mode_Top]:
+                print(f"\t>>> Mode {k + 1}: {FreqData['Frequencies'][k]} [cm-1], "
+                      f"S = {round(Huang_Rhys[k], 4)}, λ_k = {round(Lambda[k], 4)} [meV]")
+        print(f"{self.MaterName}_ReorgModes_{self.Function_Name}.txtに保存しました。")
+        return None
+
 
 class PeriodicTable:
     # 原子番号に対応する元素記号と原子量の辞書
@@ -514,6 +984,8 @@ class StandardPhrases:
                        "Title Card Required\n"
                        "\n"
                        "0 1\n")
+    # 振動解析の開始を示す行
+    Freq_Marker = b"Harmonic frequencies (cm**-1), IR intensities (KM/Mole), Raman scattering"
 
 
 class Color:
@@ -555,6 +1027,22 @@ class Constants:
     C = 299792458
     # 電気素量[C]
     E = 1.602176634e-19
+    # ディラック定数[J・s]
+    Hbar = 1.054571817e-34
+    # 原子質量単位[kg]
+    AMU = 1.66053906660e-27
+    # ジョブ全体のコア数 (ReorgEnergy_02_FEの"-pe gau 12"に合わせる)
+    NProcShared = 12
+    # ジョブ全体のメモリ[GB]
+    Mem_GB = 32
+    # --concurrentでコアを分ける際の各ステップの計算コストの比 (EG: 構造最適化(+振動計算), SP: 一点計算)
+    Step_Cost = {"EG": 5, "SP": 1}
+    # --freq autoで振動計算を行う近似ヘシアンの最小固有値の閾値[Hartree/Bohr^2]
+    Freq_FlatEigenvalue = 0.001
+    # 振動解析の部分を読み込む際のチャンクサイズ[byte]
+    Freq_ChunkSize = 1 << 20
+    # 再配置エネルギーへの寄与が大きい基準振動を表示する数
+    Mode_Top = 5
 
 
 if __name__ == "__main__":
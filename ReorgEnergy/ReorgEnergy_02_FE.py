@@ -1,12 +1,15 @@
 import argparse
+import asyncio
 import datetime
 import functools
 import glob
 import os
+import re
 import subprocess
-import sys
 import time
 
+from JobMonitor import JobMonitor
+
 print = functools.partial(print, flush=True)
 
 
@@ -23,14 +26,20 @@ def main():
     # argument parser
     args, before = arg_parser()
 
-    # ReorgEnergy class
-    re = ReorgEnergy(args, before)
+    if args.batch:
+        # Batch mode: many molecules and basis functions without any prompt
+        rb = ReorgEnergyBatch(args, before)
+        rb.calculate()
+        rb.summarize()
+    else:
+        # ReorgEnergy class
+        rg = ReorgEnergy(args, before)
 
-    # Calculate
-    MyJobID = re.calculate()
+        # Calculate
+        MyJobID = rg.calculate()
 
-    # Show log
-    re.show_log(MyJobID)
+        # Show log
+        rg.show_log(MyJobID)
 
     # program end
     print(f"{Color.GREEN}"
@@ -43,14 +52,36 @@ def arg_parser():
     before = time.time()
     parser = argparse.ArgumentParser(description=StandardPhrases.ProgramAbst,
                                      formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('MaterName', help="Mater Name")
+    parser.add_argument('MaterName', nargs='?', help="Mater Name")
     parser.add_argument('--debug', '-d', '-D',
                         help="Debug mode",
                         action='store_false')
     parser.add_argument('--function', '-f', '-F',
                         help="Change the basis function",
                         action='store_true')
+    parser.add_argument('--operator', '-o',
+                        help="Operator name (skips the prompt)")
+    parser.add_argument('--batch', '-b', nargs='+', metavar='GJF',
+                        help="Batch mode: gjf files or glob patterns (e.g. 'mols/*.gjf')")
+    parser.add_argument('--functions', nargs='+', metavar='FUNCTION',
+                        help="Batch mode: keys or names in Basefunctions.function (default: 1)")
+    parser.add_argument('--max-jobs', type=int, default=4,
+                        help="Batch mode: maximum number of jobs in the queue at once (default: 4)")
+    parser.add_argument('--summary', default="ReorgEnergy_Summary.txt",
+                        help="Batch mode: consolidated result table (default: ReorgEnergy_Summary.txt)")
+    parser.add_argument('--concurrent', '-c',
+                        help="Passed to BG_ReorgEnergy: run the independent Gaussian steps at the same time",
+                        action='store_true')
+    parser.add_argument('--freq', choices=['full', 'auto'], default='full',
+                        help="Passed to BG_ReorgEnergy\n"
+                             "full: opt freq in one job (default)\n"
+                             "auto: opt only, followed by a freq job only when it is needed")
+    parser.add_argument('--no-chk',
+                        help="Passed to BG_ReorgEnergy: restart the steps from coordinates instead of the checkpoint",
+                        action='store_true')
     args = parser.parse_args()
+    if not args.MaterName and not args.batch:
+        parser.error("MaterName or --batch is required.")
 
     # View Program Overview
     print(StandardPhrases.ProgramAbst)
@@ -78,10 +109,13 @@ class ReorgEnergy:
         self.StartTime = datetime.datetime.now()
 
         # Retrieve the operator name
-        Operator = input(f"\n{Color.GREEN}Retrieve the operator name.{Color.RESET}\n"
-                         "\t>>> The name entered here will be used to identify the operator.\n"
-                         f"\tPlease enter the operator.\n"
-                         f"\t{Color.GREEN}>>> {Color.RESET}")
+        if args.operator:
+            Operator = args.operator
+        else:
+            Operator = input(f"\n{Color.GREEN}Retrieve the operator name.{Color.RESET}\n"
+                             "\t>>> The name entered here will be used to identify the operator.\n"
+                             f"\tPlease enter the operator.\n"
+                             f"\t{Color.GREEN}>>> {Color.RESET}")
         if Operator == "":
             Operator = "ONE"
         else:
@@ -182,139 +216,46 @@ class ReorgEnergy:
                                  f"\t>>> {Color.GREEN}Calculations with the conditions might be finished.{Color.RESET}")
             self.help_check_exit()
         else:
-            for qsub in qsubList:
-                qsub = qsub.split()
-                subprocess.run(qsub, cwd=dirpath)
-
-            Wait_minutes = 1
-            MyJobIDList = self.My_JobIDList(qsubList)
-            MyJobIDList.sort()
-            RunningJobIDList = self.Running_JobIDList()
-
-            Flag, wait_job_count = self.check_jobs(RunningJobIDList, MyJobIDList)
-            start_time = datetime.datetime.now()
-
-            if Flag:
-                formated_ST = start_time.strftime("%m/%d %H:%M:%S")
-                print(f"{Color.GREEN}\t>>> '{int(len(MyJobIDList))}' calculations for ReorgEnergy was submitted!!"
-                      f" {Color.RESET}at {formated_ST}")
-                print(f"\n"
-                      f"{Color.GREEN}Wait until jobID {MyJobIDList[-1]}!!{Color.RESET}\n"
-                      f"start ID: {RunningJobIDList[0]}\n"
-                      f"\n")
-            else:
-                pass
-
-            while Flag:
-                Flag, wait_job_count = self.check_jobs(RunningJobIDList, MyJobIDList)
-                formated_NOW, elapsed_time = self.getElapsedTime(start_time)
-                Now_Time = datetime.datetime.now()
-                formated_end_time = (
-                    (Now_Time + datetime.timedelta(minutes=(wait_job_count * Wait_minutes))).strftime("%m/%d %H:%M:%S"))
-                sys.stdout.write(
-                    "\033[1F\033[G%s" %
-                    f"\t{formated_NOW} ({elapsed_time} min. passed): Job {RunningJobIDList[0]} is in progress.       \n"
-                    f"\tNext Check >>> {Wait_minutes * wait_job_count} minute later! forecast: {formated_end_time}    ")
-                sys.stdout.flush()
-                time.sleep(Wait_minutes * wait_job_count * 60)
-                RunningJobIDList = self.Running_JobIDList()
-                Flag, wait_job_count = self.check_jobs(RunningJobIDList, MyJobIDList)
-            else:
-                print(f"{Color.GREEN}\n\n"
-                      f"Calculation cycles for {which} until JobID {MyJobIDList[-1]} were finished.{Color.RESET}")
+            monitor = JobMonitor()
+            JobIDs = [monitor.submit(qsub, cwd=dirpath) for qsub in qsubList]
+            MyJobIDList = sorted(JobID for JobID in JobIDs if JobID is not None)
+            if None in JobIDs:
+                self.messages.append(f"\t{Color.RED}>>> {JobIDs.count(None)} of {len(qsubList)} jobs "
+                                     f"could not be submitted (see the qsub error above).{Color.RESET}\n"
+                                     f"\t>>> Submitted jobs: {' '.join(map(str, MyJobIDList)) or 'none'}")
+                self.HelpList.append(True)
+                self.help_check_exit()
+            formated_ST = datetime.datetime.now().strftime("%m/%d %H:%M:%S")
+            print(f"{Color.GREEN}\t>>> '{int(len(MyJobIDList))}' calculations for ReorgEnergy was submitted!!"
+                  f" {Color.RESET}at {formated_ST}")
+            print(f"\n"
+                  f"{Color.GREEN}Wait until jobID {MyJobIDList[-1]}!!{Color.RESET}\n")
+
+            monitor.run(MyJobIDList)
+            print(f"{Color.GREEN}\n"
+                  f"Calculation cycles for {which} until JobID {MyJobIDList[-1]} were finished.{Color.RESET}")
         return MyJobIDList[-1]
 
-    @staticmethod
-    def My_JobIDList(qsubList):
-        """
-        Get the list of job IDs
-        :param qsubList:
-        :return:
-        """
-        jobCount = len(qsubList)
-        result = subprocess.run(["qstat"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                universal_newlines=True)
-        lines = result.stdout.strip().splitlines()
-        running_job_count = len(lines) - 2
-        if not len(lines) == 0:
-            runningJobID = []
-            lastJobID = int(lines[-1].strip().split()[0])
-            for i in range(running_job_count):
-                JobID = int(lines[i + 2].strip().split()[0])
-                runningJobID.append(JobID)
-            myStartID = int(lastJobID - jobCount + 1)
-            myJobID = list(range(int(myStartID), lastJobID + 1))
-            myJobIDs = []
-            for A in myJobID:
-                myJobIDs.append(A)
-            myJobIDs.sort()
-            return myJobIDs
-        else:
-            return [0]
-
-    @staticmethod
-    def Running_JobIDList():
-        """
-        Get the list of running job IDs
-        :return:
-        """
-        result = subprocess.run(["qstat"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                universal_newlines=True)
-        lines = result.stdout.strip().splitlines()
-        running_job_count = len(lines) - 2
-        if len(lines) == 0:
-            runningJobID = []
-        else:
-            runningJobID = []
-            for i in range(running_job_count):
-                JobID = int(lines[i + 2].strip().split()[0])
-                runningJobID.append(JobID)
-            runningJobID.sort()
-        return runningJobID
-
-    @staticmethod
-    def check_jobs(current_jobs, my_jobs):
-        """
-        Check the jobs
-        :param current_jobs:
-        :param my_jobs:
-        :return:
-        """
-        contains_my_jobs = any(job in current_jobs for job in my_jobs)
-        my_job_positions = [i for i, job in enumerate(current_jobs) if job in my_jobs]
-        if my_job_positions:
-            last_position = max(my_job_positions)
-            remaining_time = last_position + 1
-        else:
-            remaining_time = 0
-        if remaining_time == 2 or remaining_time == 1:
-            remaining_time = 0.5
-        else:
-            pass
-        return contains_my_jobs, remaining_time
-
-    @staticmethod
-    def getElapsedTime(start_time):
+    def write_sh_file(self, MaterName, basis_function, dirpath="."):
         """
-        Get the elapsed time
-        :param start_time:
-        :return:
+        Write the shell script running BG_ReorgEnergy
+        :param MaterName:
+        :param basis_function:
+        :param dirpath:
+        :return: name of the shell script
         """
-        now = datetime.datetime.now()
-        elapsed_time = now - start_time
-        elapsed_time = round(elapsed_time.total_seconds() / 60, 1)
-        formated_NOW = now.strftime("%m/%d %H:%M")
-        return formated_NOW, elapsed_time
-
-    def calculate(self):
-        print(f"{Color.GREEN}Calculating...{Color.RESET}")
-
         if self.debug:
             Debug_arg = "--debug"
         else:
             Debug_arg = ""
-
-        with open(f"G-Reorg-{self.Operator}-{self.MaterName}-{self.basis_function[1]}.sh", "w") as file:
+        BG_args = f"--freq {self.args.freq}"
+        if self.args.concurrent:
+            BG_args += " --concurrent"
+        if self.args.no_chk:
+            BG_args += " --no-chk"
+
+        ShName = f"G-Reorg-{self.Operator}-{MaterName}-{basis_function[1]}.sh"
+        with open(os.path.join(dirpath, ShName), "w") as file:
             file.write(f"#!/bin/sh\n")
             file.write(f"\n")
             file.write(f"#$ -S /bin/sh\n")
@@ -327,10 +268,16 @@ class ReorgEnergy:
             file.write(f"export GAUSS_SCRDIR=/scr/$JOB_ID\n")
             file.write(f"mkdir /scr/$JOB_ID\n")
             file.write(f"\n")
-            file.write(f"BG_ReorgEnergy {self.MaterName} {self.basis_function[1]} {Debug_arg} "
-                       f"| tee Reorg-{self.Operator}-{self.MaterName}-{self.basis_function[1]}.log\n")
-            file.write(f"rm -rf /scr/$JOB_ID| tee Reorg_{self.MaterName}.log\n")
+            file.write(f"BG_ReorgEnergy {MaterName} {basis_function[1]} {Debug_arg} {BG_args} "
+                       f"| tee Reorg-{self.Operator}-{MaterName}-{basis_function[1]}.log\n")
+            file.write(f"rm -rf /scr/$JOB_ID| tee Reorg_{MaterName}.log\n")
             file.write(f"\n")
+        return ShName
+
+    def calculate(self):
+        print(f"{Color.GREEN}Calculating...{Color.RESET}")
+
+        self.write_sh_file(self.MaterName, self.basis_function)
 
         # Execute the shell script
         qsubList = [f"qsub G-Reorg-{self.Operator}-{self.MaterName}-{self.basis_function[1]}.sh"]
@@ -378,6 +325,198 @@ class ReorgEnergy:
         return
 
 
+class ReorgEnergyBatch(ReorgEnergy):
+    """
+    Non-interactive screening of many molecules and basis functions.
+    Every (gjf, basis function) pair is one BG_ReorgEnergy job; at most `--max-jobs` of them are kept in the queue.
+    """
+
+    def __init__(self, args, before):
+        self._ReorgEnergy = "ReorgEnergyBatch"
+        self.args = args
+        self.before = before
+        self.debug = args.debug
+        self.MaxJobs = max(1, args.max_jobs)
+        self.SummaryFile = args.summary
+        self.messages, self.HelpList = [], []
+        self.StartTime = datetime.datetime.now()
+        self.Operator = args.operator if args.operator else "ONE"
+
+        # Collect the gjf files
+        print(f"{Color.GREEN}Collecting the gjf files...{Color.RESET}")
+        GjfFiles = []
+        # Skip the step inputs written by BG_ReorgEnergy (e.g. Mol_0_EG_b3lyp_6-31Gd.gjf, Mol_+1_FQ_b3lyp_6-31Gd.gjf)
+        StepGjf = re.compile(r"_(0|\+0|\+1)_(EG|SP|FQ)_(%s)\.gjf$"
+                             % "|".join(re.escape(value[1]) for value in Basefunctions.function.values()))
+        for pattern in args.batch:
+            Matched = sorted(glob.glob(pattern))
+            if not Matched:
+                self.messages.append(f"\t{Color.YELLOW}>>> No gjf file matched '{pattern}'.{Color.RESET}")
+            for gjf in Matched:
+                gjf = os.path.abspath(gjf)
+                if gjf.endswith(".gjf") and not StepGjf.search(gjf) and gjf not in GjfFiles:
+                    GjfFiles.append(gjf)
+        if not GjfFiles:
+            self.HelpList.append(True)
+            self.messages.append(f"{Color.RED}\t>>> No gjf file was found.{Color.RESET}")
+        self.help_check_exit()
+        for gjf in GjfFiles:
+            print(f"\t{os.path.relpath(gjf)}")
+
+        # Select the basis functions
+        self.basis_functions = self.select_functions(args.functions)
+        print(f"\t>>> The basis functions are set to {', '.join(bf[1] for bf in self.basis_functions)}.")
+
+        # (MaterName, basis function, directory)
+        self.Workflows = [(os.path.splitext(os.path.basename(gjf))[0], tuple(basis_function), os.path.dirname(gjf))
+                          for gjf in GjfFiles for basis_function in self.basis_functions]
+
+    def select_functions(self, Keys):
+        """
+        Resolve the basis functions given by key ("1") or by name ("b3lyp_6-31Gd")
+        :param Keys:
+        :return: list of [route, name]
+        """
+        if not Keys:
+            return [Basefunctions.function[1]]
+        Names = {value[1]: value for value in Basefunctions.function.values() if value[0] != "exit"}
+        basis_functions = []
+        for Key in Keys:
+            if Key.isdecimal() and int(Key) in Basefunctions.function \
+                    and Basefunctions.function[int(Key)][0] != "exit":
+                basis_function = Basefunctions.function[int(Key)]
+            elif Key in Names:
+                basis_function = Names[Key]
+            else:
+                self.HelpList.append(True)
+                self.messages.append(f"{Color.RED}\t>>> Unknown basis function: {Key}{Color.RESET}")
+                continue
+            if basis_function not in basis_functions:
+                basis_functions.append(basis_function)
+        self.help_check_exit()
+        return basis_functions
+
+    @staticmethod
+    def result_file(Workflow):
+        MaterName, basis_function, dirpath = Workflow
+        return os.path.join(dirpath, f"{MaterName}_ReorgEnergy_{basis_function[1]}.txt")
+
+    def calculate(self):
+        """
+        Submit all workflows, keeping at most self.MaxJobs of them in the queue
+        :return:
+        """
+        print(f"\n{Color.GREEN}Calculating...{Color.RESET}")
+        Pending = []
+        self.Status = {}
+        for Workflow in self.Workflows:
+            if os.path.exists(self.result_file(Workflow)):
+                self.Status[Workflow] = "finished before"
+            else:
+                Pending.append(Workflow)
+        print(f"\t>>> {len(self.Workflows)} workflows, {len(Pending)} to be calculated "
+              f"(at most {self.MaxJobs} at once).")
+
+        asyncio.run(self.run_workflows(Pending))
+        print(f"{Color.GREEN}\nAll workflows were finished.{Color.RESET}")
+        return None
+
+    async def run_workflows(self, Pending):
+        """
+        Run the workflows concurrently; all jobs share one JobMonitor (one qstat per interval)
+        :param Pending:
+        :return:
+        """
+        monitor = JobMonitor()
+        Slots = asyncio.Semaphore(self.MaxJobs)
+
+        async def run_workflow(Workflow):
+            MaterName, basis_function, dirpath = Workflow
+            async with Slots:
+                ShName = self.write_sh_file(MaterName, basis_function, dirpath)
+                JobID = monitor.submit(f"qsub {ShName}", cwd=dirpath)
+                if JobID is None:
+                    self.Status[Workflow] = "submit failed"
+                    return None
+                await monitor.wait(JobID)
+            self.finish_workflow(Workflow, ShName, JobID)
+
+        await asyncio.gather(*(run_workflow(Workflow) for Workflow in Pending))
+        return None
+
+    def finish_workflow(self, Workflow, ShName, JobID):
+        """
+        Record the status of a finished workflow and remove its temporary files
+        :param Workflow:
+        :param ShName:
+        :param JobID:
+        :return:
+        """
+        ErrFile = os.path.join(Workflow[2], f"{ShName}.e{JobID}")
+        if os.path.exists(ErrFile) and os.path.getsize(ErrFile) != 0:
+            self.Status[Workflow] = "failed"
+        elif not os.path.exists(self.result_file(Workflow)):
+            self.Status[Workflow] = "no result"
+        else:
+            self.Status[Workflow] = "finished"
+            if not self.debug:
+                self.rmWildCards(os.path.join(Workflow[2], f"{Workflow[0]}_*_{Workflow[1][1]}.chk"))
+                self.rmWildCards(os.path.join(Workflow[2], f"{ShName}*"))
+        return None
+
+    def summarize(self):
+        """
+        Collect λ1, λ2, total λ and the minimum frequencies of all workflows into one table
+        :return:
+        """
+        print(f"\n{Color.GREEN}Summarizing the results...{Color.RESET}")
+        Keys = {"Reorganization Energy:": "Lambda",
+                "λ1 (0_SP - 0_EG):": "Lambda1",
+                "λ2 (1_SP - 1_EG):": "Lambda2",
+                "Minimum Frequency of 0_EG:": "MinFreq_0",
+                "Minimum Frequency of 1_EG:": "MinFreq_1"}
+        Header = ["Name", "Function", "λ1 [meV]", "λ2 [meV]", "λ [meV]", "MinFreq 0_EG", "MinFreq +1_EG", "Status"]
+        Rows = []
+        for Workflow in self.Workflows:
+            MaterName, basis_function, dirpath = Workflow
+            Values = {}
+            if os.path.exists(self.result_file(Workflow)):
+                with open(self.result_file(Workflow), "r") as file:
+                    for line in file:
+                        for Key, Name in Keys.items():
+                            if line.startswith(Key):
+                                # "not calculated" when the frequency job was skipped (--freq auto)
+                                try:
+                                    Values[Name] = float(line[len(Key):].split()[0])
+                                except ValueError:
+                                    Values[Name] = float("nan")
+            # λ1 and λ2 are saved in Hartree
+            for Name in ("Lambda1", "Lambda2"):
+                if Name in Values:
+                    Values[Name] = Values[Name] * 1000 * Constants.Hartree_to_eV
+            Status = self.Status.get(Workflow, "not submitted")
+            if len(Values) != len(Keys) and Status.startswith("finished"):
+                Status = "incomplete"
+            Rows.append([MaterName, basis_function[1]]
+                        + [f"{Values[Name]:.4f}" if Name in Values else "nan"
+                           for Name in ("Lambda1", "Lambda2", "Lambda", "MinFreq_0", "MinFreq_1")]
+                        + [Status])
+
+        with open(self.SummaryFile, "w") as file:
+            file.write("\t".join(Header) + "\n")
+            for Row in Rows:
+                file.write("\t".join(Row) + "\n")
+
+        Widths = [max(len(str(Row[i])) for Row in Rows + [Header]) for i in range(len(Header))]
+        print(" | ".join(f"{Item:<{Widths[i]}}" for i, Item in enumerate(Header)))
+        print("-" * (sum(Widths) + 3 * (len(Header) - 1)))
+        for Row in Rows:
+            Line = " | ".join(f"{Item:<{Widths[i]}}" for i, Item in enumerate(Row))
+            print(Line if Row[-1].startswith("finished") else f"{Color.RED}{Line}{Color.RESET}")
+        print(f"\n\t>>> Results saved to {Color.GREEN}{self.SummaryFile}{Color.RESET}")
+        return None
+
+
 class StandardPhrases:
     def __init__(self):
         self._StandardPhrases = "StandardPhrases"
@@ -431,5 +570,10 @@ class Color:
     RESET = '\033[0m'  # reset
 
 
+class Constants:
+    # Hartree to eV
+    Hartree_to_eV = 27.21138602
+
+
 if __name__ == "__main__":
     main()
@@ -12,11 +12,10 @@ import argparse
 import os
 import subprocess
 import datetime
-import sys
-import time
 import glob
 import functools
 
+from JobMonitor import JobMonitor
 
 print = functools.partial(print, flush=True)
 
@@ -730,37 +729,18 @@ def job_execution(qsub_temp, Debug):
     if qsub_temp == "":
         print("\t>>> Any job was not submitted. Calculations with the conditions might be finished.")
     else:
-        subprocess.run(qsub_temp.split())
-        jobID = get_job_id()
-        RunningList = Running_JobIDList()
-        Flag, wait_job_count = check_jobs(RunningList, [jobID])
-        start_time = datetime.datetime.now()
-        if Flag:
-            formated_ST = start_time.strftime("%m/%d %H:%M:%S")
-            print(f"\n'{int(len([jobID]))}' calculations was submitted!! at {formated_ST}")
-            print(f"\n"
-                  f"Wait until jobID {[jobID][-1]}!!\n"
-                  f"start ID: {RunningList[0]}\n"
-                  f"\n")
-        else:
-            pass
-
-        while Flag:
-            Flag, wait_job_count = check_jobs(RunningList, [jobID])
-            formated_NOW, elapsed_time = getElapsedTime(start_time)
-            Now_time = datetime.datetime.now()
-            formated_end_time = (
-                (Now_time + datetime.timedelta(minutes=wait_job_count)).strftime("%m/%d %H:%M:%S"))
-            sys.stdout.write(
-                "\033[1F\033[G%s" %
-                f"\t{formated_NOW} ({elapsed_time} min. passed): Job {RunningList[0]} is in progress.            \n"
-                f"\tNext Check >>> {wait_job_count} minute later! forecast: {formated_end_time}    ")
-            sys.stdout.flush()
-            time.sleep(wait_job_count * 60)
-            RunningList = Running_JobIDList()
-            Flag, wait_job_count = check_jobs(RunningList, [jobID])
-        else:
-            print(f"{Color.GREEN}\n\nCalculation cycles until JobID {jobID} were finished.{Color.RESET}")
+        # qstatの監視はJobMonitorにまとめる (1回の間隔につきqstatは1回)
+        monitor = JobMonitor()
+        jobID = monitor.submit(qsub_temp)
+        if jobID is None:
+            help_check_exit([f"\t{Color.RED}>>> The job was not submitted. Check the qsub error above.{Color.RESET}"],
+                            [True])
+        formated_ST = datetime.datetime.now().strftime("%m/%d %H:%M:%S")
+        print(f"\n'1' calculations was submitted!! at {formated_ST}")
+        print(f"\n"
+              f"Wait until jobID {jobID}!!\n")
+        monitor.run([jobID])
+        print(f"{Color.GREEN}\n\nCalculation cycles until JobID {jobID} were finished.{Color.RESET}")
     if Debug:
         pass
     else:
@@ -768,92 +748,6 @@ def job_execution(qsub_temp, Debug):
     return None
 
 
-# jobIDを取得する関数
-def get_job_id():
-    """
-    jobIDを取得する関数
-    """
-    result = subprocess.run(["qstat"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                            universal_newlines=True)
-    lines = result.stdout.strip().splitlines()
-    lastJobID = int(lines[-1].strip().split()[0])
-    return lastJobID
-
-
-# 現在実行中のジョブIDのリストを取得する関数
-def Running_JobIDList():
-    """
-    現在実行中のジョブIDのリストを取得する関数。
-
-    この関数はqstatコマンドを実行し、実行中のジョブIDを取得してリストに
-    格納し、ソートしたリストを返します。
-
-    戻り値:
-        list: 実行中のジョブIDを含むソートされたリスト。
-
-    例外:
-        なし。ただし、qstatコマンドが失敗した場合や、出力フォーマットが
-        期待通りでない場合、正しい結果が得られない可能性があります。
-    """
-    result = subprocess.run(["qstat"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                            universal_newlines=True)
-    lines = result.stdout.strip().splitlines()
-    running_job_count = len(lines) - 2
-    if len(lines) == 0:
-        runningJobID = []
-    else:
-        runningJobID = []
-        for i in range(running_job_count):
-            JobID = int(lines[i + 2].strip().split()[0])
-            runningJobID.append(JobID)
-        runningJobID.sort()
-    return runningJobID
-
-
-# ジョブの状態をチェックする関数
-def check_jobs(current_jobs, my_jobs):
-    """自分のジョブが現在のジョブリストに含まれているか、終了時間を推定する。
-
-    Args:
-        current_jobs (list): 現在実行中のジョブのIDリスト。
-        my_jobs (list): 自分のジョブのIDリスト。
-
-    Returns:
-        tuple:
-            - bool: 自分のジョブが含まれているかどうか。
-            - int: 自分のジョブが終了するまでの推定時間（ジョブ数）。含まれていない場合は0。
-    """
-    contains_my_jobs = any(job in current_jobs for job in my_jobs)
-    my_job_positions = [i for i, job in enumerate(current_jobs) if job in my_jobs]
-    if my_job_positions:
-        last_position = max(my_job_positions)
-        remaining_time = last_position + 1
-    else:
-        remaining_time = 0
-    if remaining_time == 2 or remaining_time == 1:
-        remaining_time = 0.5
-    else:
-        pass
-    return contains_my_jobs, remaining_time
-
-
-# 経過時間を取得する関数
-def getElapsedTime(start_time):
-    """開始時刻からの経過時間（分）と現在時刻を計算する。
-
-    Args:
-        start_time (datetime.datetime): 経過時間を計測する開始時刻。
-
-    Returns:
-        tuple: 現在時刻（"MM/DD HH:MM"形式）と開始時刻からの経過時間（分、小数点以下1桁）のタプル。
-    """
-    now = datetime.datetime.now()
-    elapsed_time = now - start_time
-    elapsed_time = round(elapsed_time.total_seconds() / 60, 1)
-    formated_NOW = now.strftime("%m/%d %H:%M")
-    return formated_NOW, elapsed_time
-
-
 # ワイルドカードを削除する関数
 def rmWildCards(wildcard):
     """